@@ -1,111 +1,237 @@
 import yfinance as yf
-import psycopg2
-from decimal import Decimal
-
-DB_CONFIG = {
-    "host": "127.0.0.1",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "1234",
-    "port": 5400
+import pandas as pd
+import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from psycopg2 import extras
+from db import get_connection
+import price_history
+import momentum
+import leaderboard
+import metrics
+
+# --- FETCH CONFIG ---
+FETCH_CONFIG = {
+    "chunk_size": 20,       # symbols per yfinance request
+    "max_workers": 4,       # chunks fetched concurrently
+    "chunk_timeout": 15,    # seconds per download attempt
+    "retries": 2,           # extra attempts per chunk after the first
+    "backoff": 1.0          # seconds, doubled after each failed attempt
 }
 
+def to_yf_symbol(symbol):
+    return symbol if "." in symbol else f"{symbol}.NS"
+
+def _download_chunk(chunk, period, timeout, **kwargs):
+    data = yf.download(chunk, period=period, interval="1d", group_by='ticker', progress=False,
+                       auto_adjust=True, threads=False, timeout=timeout, **kwargs)
+    if data is None or data.empty:
+        raise Exception("Empty response")
+    # Normalize single-ticker frames to the (ticker, field) column layout
+    if not isinstance(data.columns, pd.MultiIndex):
+        data = pd.concat({chunk[0]: data}, axis=1)
+    return data
+
+def _fetch_chunk(index, chunk, period, config, **kwargs):
+    started = time.monotonic()
+    delay = config["backoff"]
+    error = None
+    attempts = 0
+    for attempt in range(config["retries"] + 1):
+        attempts += 1
+        attempt_started = time.monotonic()
+        try:
+            data = _download_chunk(chunk, period, config["chunk_timeout"], **kwargs)
+            metrics.YF_DOWNLOAD_SECONDS.observe(time.monotonic() - attempt_started, result="ok")
+            return data, {"chunk": index, "symbols": len(chunk), "attempts": attempts,
+                          "latency_ms": round((time.monotonic() - started) * 1000, 1), "error": None}
+        except Exception as e:
+            metrics.YF_DOWNLOAD_SECONDS.observe(time.monotonic() - attempt_started, result="error")
+            error = str(e)
+            if attempt < config["retries"]:
+                time.sleep(delay)
+                delay *= 2
+    return None, {"chunk": index, "symbols": len(chunk), "attempts": attempts,
+                  "latency_ms": round((time.monotonic() - started) * 1000, 1), "error": error}
+
+def fetch_prices(yf_symbols, period="5d", config=None, **kwargs):
+    """
+    Download daily bars for yf_symbols in concurrent chunks and merge them into
+    one (ticker, field) frame. Each symbol is fetched exactly once; a chunk that
+    keeps failing or overruns its time budget is reported and skipped.
+    Returns (frame_or_None, fetch_stats).
+    """
+    config = {**FETCH_CONFIG, **(config or {})}
+    size = config["chunk_size"]
+    chunks = [yf_symbols[i:i + size] for i in range(0, len(yf_symbols), size)]
+
+    # Worst case for one chunk: every attempt times out plus all backoff sleeps
+    budget = (config["chunk_timeout"] * (config["retries"] + 1)
+              + config["backoff"] * (2 ** config["retries"] - 1) + 5)
+
+    started = time.monotonic()
+    frames = []
+    chunk_stats = []
+    pool = ThreadPoolExecutor(max_workers=config["max_workers"], thread_name_prefix="yf-chunk")
+    try:
+        futures = {pool.submit(_fetch_chunk, i, chunk, period, config, **kwargs): (i, chunk)
+                   for i, chunk in enumerate(chunks)}
+        # Queued chunks wait behind running ones, so scale the overall budget by the number of waves
+        waves = -(-len(chunks) // config["max_workers"]) or 1
+        done, not_done = wait(futures, timeout=budget * waves)
+        for future in done:
+            data, stats = future.result()
+            chunk_stats.append(stats)
+            if data is not None:
+                frames.append(data)
+        for future in not_done:
+            i, chunk = futures[future]
+            future.cancel()
+            chunk_stats.append({"chunk": i, "symbols": len(chunk), "attempts": None,
+                                "latency_ms": None, "error": "Timed out"})
+    finally:
+        # Don't let a stuck request hold up the refresh
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    chunk_stats.sort(key=lambda c: c["chunk"])
+    failed = [c for c in chunk_stats if c["error"]]
+    data = pd.concat(frames, axis=1) if frames else None
+    stats = {
+        "chunks": len(chunks),
+        "failed_chunks": len(failed),
+        "failed_symbols": sum(c["symbols"] for c in failed),
+        "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        "chunk_stats": chunk_stats
+    }
+    return data, stats
+
+def fetch_new_bars(stocks, last_dates, default_period="5d", config=None):
+    """
+    Fetch only the bars each symbol is missing. Symbols are grouped by their last
+    stored date and each group is fetched from that date on (inclusive, so the
+    latest bar is refreshed and the fetch is never empty); symbols with no history
+    get default_period. stocks is [(stock_id, symbol, ...)].
+    Returns (merged_frame_or_None, fetch_stats).
+    """
+    groups = {}
+    for stock in stocks:
+        start = last_dates.get(stock[0])
+        groups.setdefault(start, []).append(to_yf_symbol(stock[1]))
+
+    frames = []
+    stats = {"chunks": 0, "failed_chunks": 0, "failed_symbols": 0, "latency_ms": 0.0,
+             "groups": len(groups), "chunk_stats": []}
+    for start, symbols in groups.items():
+        if start is None:
+            data, group_stats = fetch_prices(symbols, period=default_period, config=config)
+        else:
+            data, group_stats = fetch_prices(symbols, period=None, config=config, start=start.isoformat())
+        if data is not None:
+            frames.append(data)
+        for key in ("chunks", "failed_chunks", "failed_symbols", "latency_ms"):
+            stats[key] += group_stats[key]
+        stats["chunk_stats"].extend(group_stats["chunk_stats"])
+
+    data = pd.concat(frames, axis=1) if frames else None
+    return data, stats
+
+def last_two_closes(closes):
+    """
+    For a (date x ticker) close frame, return (last, previous) valid close per
+    ticker as two Series, skipping NaN gaps. Missing values come back as NaN.
+    """
+    arr = closes.to_numpy(dtype=float)
+    n = arr.shape[0]
+    valid = ~np.isnan(arr)
+    cols = np.arange(arr.shape[1])
+
+    has_last = valid.any(axis=0)
+    last_idx = n - 1 - np.argmax(valid[::-1], axis=0)
+    last = np.where(has_last, arr[last_idx, cols], np.nan)
+
+    # Hide the last valid row and look again for the previous close
+    valid[last_idx, cols] = False
+    has_prev = has_last & valid.any(axis=0)
+    prev_idx = n - 1 - np.argmax(valid[::-1], axis=0)
+    prev = np.where(has_prev, arr[prev_idx, cols], np.nan)
+
+    return pd.Series(last, index=closes.columns), pd.Series(prev, index=closes.columns)
+
+def compute_price_rows(stocks, closes, scores=None):
+    """
+    Build (stock_id, current_price, day_change, momentum_score) rows for every
+    stock in one vectorized pass. stocks is [(stock_id, symbol, current_price)],
+    closes is a (date x stock_id) frame and scores maps stock_id to momentum.
+    Stocks without closes keep their stored price with no change; stocks without
+    a score get None so the stored momentum is kept. Returns (rows, priced_count).
+    """
+    frame = pd.DataFrame(stocks, columns=["stock_id", "symbol", "stored_price"])
+    frame["stored_price"] = frame["stored_price"].astype(float)
+
+    if closes is not None and not closes.empty:
+        last, prev = last_two_closes(closes)
+        frame["last"] = frame["stock_id"].map(last)
+        frame["prev"] = frame["stock_id"].map(prev)
+    else:
+        frame["last"] = np.nan
+        frame["prev"] = np.nan
+
+    priced = frame["last"].notna() & (frame["last"] > 0)
+    prev = frame["prev"].where(frame["prev"].notna() & (frame["prev"] != 0), frame["last"])
+    frame["current_price"] = frame["last"].where(priced, frame["stored_price"]).fillna(100.0)
+    frame["day_change"] = (((frame["last"] - prev) / prev) * 100).where(priced, 0.0).fillna(0.0)
+    frame["momentum_score"] = frame["stock_id"].map(scores) if scores is not None else np.nan
+
+    rows = list(zip(frame["stock_id"].astype(int).tolist(),
+                    frame["current_price"].round(2).tolist(),
+                    frame["day_change"].round(2).tolist(),
+                    frame["momentum_score"].round(2).astype(object).where(frame["momentum_score"].notna(), None).tolist()))
+    return rows, int(priced.sum())
+
+def write_price_rows(cur, rows):
+    """Persist all price rows with a single UPDATE ... FROM (VALUES ...) round-trip."""
+    extras.execute_values(cur, """
+        UPDATE Stock AS s
+        SET current_price = v.current_price, day_change = v.day_change,
+            momentum_score = COALESCE(v.momentum_score, s.momentum_score)
+        FROM (VALUES %s) AS v(stock_id, current_price, day_change, momentum_score)
+        WHERE s.stock_id = v.stock_id
+    """, rows, template="(%s, %s::numeric, %s::numeric, %s::numeric)", page_size=max(len(rows), 1))
+
 def update_all_prices():
+    conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = get_connection()
         cur = conn.cursor()
         
-        # 1. Get all symbols
-        cur.execute("SELECT stock_id, symbol FROM Stock")
+        # 1. Get all symbols (stored prices double as the fallback when a fetch fails)
+        cur.execute("SELECT stock_id, symbol, current_price FROM Stock")
         stocks = cur.fetchall()
         
         if not stocks:
             return {"status": "skipped", "message": "No stocks in database"}
         
-        # 2. Batch fetch from yfinance
-        raw_symbols = [s[1] for s in stocks]
-        symbols_with_suffix = [s if "." in s else f"{s}.NS" for s in raw_symbols]
-        
-        try:
-            # Chunking logic to prevent timeouts
-            chunk_size = 20
-            all_data = None
-            
-            for i in range(0, len(symbols_with_suffix), chunk_size):
-                chunk = symbols_with_suffix[i:i + chunk_size]
-                try:
-                    chunk_data = yf.download(chunk, period="5d", interval="1d", group_by='ticker', progress=False, auto_adjust=True)
-                    
-                    if all_data is None:
-                        all_data = chunk_data
-                    else:
-                        pass 
-                        
-                except Exception as e:
-                    print(f"Chunk fetch failed: {e}")
-            
-            all_data = yf.download(symbols_with_suffix, period="5d", interval="1d", group_by='ticker', progress=False, auto_adjust=True, threads=True) 
+        # 2. Fetch only the bars missing since each symbol's last stored bar
+        last_dates = price_history.last_bar_dates(cur)
+        fetch_started = time.monotonic()
+        all_data, fetch_stats = fetch_new_bars(stocks, last_dates)
+        metrics.REFRESH_FETCH_SECONDS.observe(time.monotonic() - fetch_started)
+        symbol_to_id = {to_yf_symbol(symbol): stock_id for stock_id, symbol, _ in stocks}
+        bars_written = price_history.write_bars(cur, price_history.bars_from_frame(all_data, symbol_to_id))
 
-        except Exception as e:
-            print(f"Batch fetch failed: {e}")
-            all_data = None
-
-        updated_count = 0
-        for stock_id, symbol in stocks:
-            try:
-                yf_symbol = symbol if "." in symbol else f"{symbol}.NS"
-                data = None
-                
-                # extracting from MultiIndex DF
-                if all_data is not None and not all_data.empty:
-                    try:
-                        if len(symbols_with_suffix) > 1:
-                            data = all_data[yf_symbol]
-                        else:
-                            data = all_data
-                    except KeyError:
-                        # Try finding without suffix if mismatch
-                        data = None
-
-                if data is not None and not data.empty and 'Close' in data:
-                    current_price = data['Close'].iloc[-1]
-                    # Handle NaN values
-                    if pd.isna(current_price):
-                        # Try previous day
-                        current_price = data['Close'].iloc[-2] if len(data) > 1 else 0
-
-                    prev_close = data['Close'].iloc[-2] if len(data) > 1 else current_price
-                    
-                    if prev_close and prev_close != 0:
-                        day_change = ((current_price - prev_close) / prev_close) * 100
-                    else:
-                        day_change = 0
-                        
-                    momentum = day_change
-                else:
-                    # Updated Fallback Logic without Randomness for stability
-                    cur.execute("SELECT current_price FROM Stock WHERE stock_id = %s", (stock_id,))
-                    row = cur.fetchone()
-                    current_price = row[0] if row else 100.0
-                    day_change = 0.0 # No change if fetch fails
-                    momentum = 0.0
-
-                inr_price = current_price
-                    
-                cur.execute("""
-                    UPDATE Stock 
-                    SET current_price = %s, day_change = %s, momentum_score = %s 
-                    WHERE stock_id = %s
-                """, (float(inr_price), float(day_change), float(momentum), stock_id))
-                updated_count += 1
-                
-            except Exception as e:
-                # Silent fail for individual stock to keep process moving
-                pass
+        # 3. Compute every row in memory from stored history, then write them in one statement
+        closes = price_history.recent_closes(cur, n=2)
+        scores = momentum.engine.scores(cur)
+        rows, priced_count = compute_price_rows(stocks, closes, scores)
+        write_price_rows(cur, rows)
         
+        conn.commit()
+        # Rank each sector once per refresh, from the prices just committed
+        leaderboard.rebuild(cur)
         conn.commit()
         cur.close()
-        return {"status": "success", "updated": updated_count}
+        return {"status": "success", "updated": len(rows), "priced": priced_count,
+                "bars_written": bars_written, "fetch": fetch_stats}
         
     except Exception as e:
         print(f"Update error: {e}")
@@ -1,15 +1,53 @@
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import psycopg2
 from psycopg2 import extras
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, date
 from decimal import Decimal
-import MarketData
+import json
+import market_scheduler
+import stock_cache
+import valuation
+import streaming
+import tax_ledger
+import lot_selection
+import nav
+import risk
+import table_explorer
+import exports
+import trade_import
+import metrics
+import db
 
 app = Flask(__name__, static_folder='frontend', static_url_path='')
 CORS(app)
 
+# --- REQUEST METRICS: latency, status and DB queries per route (see /api/metrics) ---
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    # Route templates (not raw paths) keep the label set small
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.finish_request(route, request.method, response.status_code)
+    return response
+
+# Admin token, sent as-is like the admin console or as "Bearer <token>" (Prometheus authorization)
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    auth_token = request.headers.get('Authorization', '')
+    if auth_token.removeprefix('Bearer ') != "fx_admin_secret_token_2026":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    body = metrics.render(pool=db.pool_metrics())
+    return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_background_jobs():
+    market_scheduler.scheduler.ensure_started()
+
 @app.route('/')
 def home():
     return send_from_directory('frontend', 'landing.html')
@@ -23,17 +61,8 @@ def news_page():
     return send_from_directory('frontend', 'news.html')
 
 # --- DATABASE CONFIG ---
-# --- DATABASE CONFIG ---
-DB_CONFIG = {
-    "host": "127.0.0.1",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "1234",
-    "port": 5400
-}
-
-def get_connection():
-    return psycopg2.connect(**DB_CONFIG)
+# Connections come from the shared pool in db.py; conn.close() returns them to the pool.
+from db import get_connection
 
 # Helper function to make Decimal types JSON-serializable
 def clean_decimal(obj):
@@ -75,11 +104,13 @@ def get_user_details(user_id):
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=extras.DictCursor)
-        cur.execute('SELECT user_id, name, email, cash_balance FROM "User" WHERE user_id = %s', (user_id,))
-        user = cur.fetchone()
-        cur.close()
-        conn.close()
-        
+        try:
+            cur.execute('SELECT user_id, name, email, cash_balance FROM "User" WHERE user_id = %s', (user_id,))
+            user = cur.fetchone()
+        finally:
+            cur.close()
+            conn.close()
+
         if user:
             return jsonify({
                 "user_id": user['user_id'],
@@ -91,78 +122,134 @@ def get_user_details(user_id):
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# --- HISTORY LISTINGS: keyset pagination & streaming ---
+# ?limit=N[&after=<id>]  -> one page plus "next_after" for the following page
+# ?format=ndjson         -> every row streamed as newline-delimited JSON
+# (no parameters)        -> the full listing, streamed from a server-side cursor
+MAX_PAGE_SIZE = 1000
+
+def listing_params():
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return limit, request.args.get('after', type=int), request.args.get('format')
+
+def convert_transaction(row):
+    d = dict(row)
+    d['price'] = float(d['price'])
+    d['txn_date'] = d['txn_date'].strftime('%Y-%m-%d %H:%M:%S')
+    return d
+
+def convert_realized_gain(row):
+    d = dict(row)
+    # Convert Decimals and Dates
+    d['buy_price'] = float(d['buy_price'])
+    d['sell_price'] = float(d['sell_price'])
+    d['total_gain'] = float(d['total_gain'])
+    d['buy_date'] = str(d['buy_date'])
+    d['sell_date'] = str(d['sell_date'])
+    return d
+
+def transactions_query(after):
+    # Newest first; the keyset is (txn_date, txn_id) so ties on date stay stable
+    keyset = ""
+    if after is not None:
+        keyset = "AND (t.txn_date, t.txn_id) < (SELECT txn_date, txn_id FROM Transaction WHERE txn_id = %s)"
+    return f"""
+        SELECT t.txn_id, t.txn_type, t.quantity, t.price, t.txn_date, s.symbol 
+        FROM Transaction t
+        JOIN Stock s ON t.stock_id = s.stock_id
+        WHERE t.user_id = %s {keyset}
+        ORDER BY t.txn_date DESC, t.txn_id DESC
+    """
+
+def realized_gains_query(after):
+    keyset = ""
+    if after is not None:
+        keyset = "AND (r.sell_date, r.gain_id) < (SELECT sell_date, gain_id FROM RealizedGain WHERE gain_id = %s)"
+    return f"""
+        SELECT r.*, s.symbol 
+        FROM RealizedGain r
+        JOIN Stock s ON r.stock_id = s.stock_id
+        WHERE r.user_id = %s {keyset}
+        ORDER BY r.sell_date DESC, r.gain_id DESC
+    """
+
+def stream_response(chunks, mimetype):
+    return app.response_class(chunks, mimetype=mimetype)
+
 @app.route('/api/transactions/<int:user_id>', methods=['GET'])
 def get_transactions(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor(cursor_factory=extras.DictCursor)
-        # Join with Stock to get symbol
-        query = """
-            SELECT t.txn_id, t.txn_type, t.quantity, t.price, t.txn_date, s.symbol 
-            FROM Transaction t
-            JOIN Stock s ON t.stock_id = s.stock_id
-            WHERE t.user_id = %s
-            ORDER BY t.txn_date DESC
-        """
-        cur.execute(query, (user_id,))
-        rows = cur.fetchall()
-        txns = []
-        for row in rows:
-            d = dict(row)
-            d['price'] = float(d['price'])
-            d['txn_date'] = row['txn_date'].strftime('%Y-%m-%d %H:%M:%S')
-            txns.append(d)
-        cur.close()
-        conn.close()
-        return jsonify(txns)
+        limit, after, fmt = listing_params()
+        params = (user_id,) if after is None else (user_id, after)
+
+        if limit is not None:
+            conn = get_connection()
+            cur = conn.cursor(cursor_factory=extras.DictCursor)
+            try:
+                rows, next_after = streaming.fetch_page(cur, transactions_query(after) + " LIMIT %s",
+                                                        params, limit, 'txn_id')
+            finally:
+                cur.close()
+                conn.close()
+            return jsonify({"items": [convert_transaction(r) for r in rows], "next_after": next_after})
+
+        rows = streaming.iter_rows(transactions_query(after), params, 'txn_stream', convert_transaction)
+        if fmt == 'ndjson':
+            return stream_response(streaming.ndjson(rows), 'application/x-ndjson')
+        return stream_response(streaming.json_array(rows), 'application/json')
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/tax_report/<int:user_id>', methods=['GET'])
 def get_tax_report(user_id):
     try:
-        conn = get_connection()
-        cur = conn.cursor(cursor_factory=extras.DictCursor)
-        query = """
-            SELECT r.*, s.symbol 
-            FROM RealizedGain r
-            JOIN Stock s ON r.stock_id = s.stock_id
-            WHERE r.user_id = %s
-            ORDER BY r.sell_date DESC
-        """
-        cur.execute(query, (user_id,))
-        rows = cur.fetchall()
-        report = []
-        summary = {"short_term_gain": 0.0, "long_term_gain": 0.0, "tax_liability": 0.0}
-        
-        for row in rows:
-            d = dict(row)
-            # Convert Decimals and Dates
-            d['buy_price'] = float(d['buy_price'])
-            d['sell_price'] = float(d['sell_price'])
-            d['total_gain'] = float(d['total_gain'])
-            d['buy_date'] = str(d['buy_date'])
-            d['sell_date'] = str(d['sell_date'])
-            report.append(d)
-            
-            if d['term'] == 'SHORT':
-                summary['short_term_gain'] += d['total_gain']
-            else:
-                summary['long_term_gain'] += d['total_gain']
-        
-        # Simple Tax Calc (Example logic: 15% STCG, 10% LTCG)
-        # Assuming only positive gains are taxed, but losses offset gains.
-        # This is a basic estimation.
-        stcg = summary['short_term_gain']
-        ltcg = summary['long_term_gain']
-        
-        tax = (stcg * 0.15) if stcg > 0 else 0
-        tax += (ltcg * 0.10) if ltcg > 0 else 0
-        summary['tax_liability'] = tax
-        
-        cur.close()
-        conn.close()
-        return jsonify({"details": report, "summary": summary})
+        limit, after, fmt = listing_params()
+        params = (user_id,) if after is None else (user_id, after)
+        # ?details=0 returns only the materialized summary
+        include_details = request.args.get('details', '1') != '0'
+
+        if fmt != 'ndjson':
+            conn = get_connection()
+            cur = conn.cursor(cursor_factory=extras.DictCursor)
+            try:
+                summary = tax_ledger.get_summary(cur, user_id)
+                if not include_details:
+                    return jsonify({"summary": summary})
+                if limit is not None:
+                    rows, next_after = streaming.fetch_page(cur, realized_gains_query(after) + " LIMIT %s",
+                                                            params, limit, 'gain_id')
+                    return jsonify({"details": [convert_realized_gain(r) for r in rows],
+                                    "summary": summary, "next_after": next_after})
+            finally:
+                cur.close()
+                conn.close()
+
+        rows = streaming.iter_rows(realized_gains_query(after), params, 'gain_stream', convert_realized_gain)
+        if fmt == 'ndjson':
+            return stream_response(streaming.ndjson(rows), 'application/x-ndjson')
+        head = '{"summary": ' + json.dumps(summary) + ', "details": '
+        return stream_response(streaming.json_array(rows, head=head, tail='}'), 'application/json')
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- EXPORTS: full history as CSV (COPY ... TO STDOUT) or Parquet, streamed ---
+# kind is transactions, lots or realized_gains; ?format=csv|parquet&since=&until= (YYYY-MM-DD, inclusive)
+def export_response(kind, user_id):
+    fmt = request.args.get('format', 'csv')
+    since, until = request.args.get('since'), request.args.get('until')
+    response = stream_response(exports.stream(kind, fmt, user_id, since, until), exports.FORMATS[fmt])
+    name = exports.filename(kind, fmt, user_id, since, until)
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+@app.route('/api/export/<string:kind>/<int:user_id>', methods=['GET'])
+def export_user_data(kind, user_id):
+    try:
+        return export_response(kind, user_id)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -196,23 +283,73 @@ def register():
 def get_portfolio(user_id):
     conn = get_connection()
     cur = conn.cursor(cursor_factory=extras.DictCursor)
-    query = """
-        SELECT s.stock_id, s.symbol, s.sector, p.total_quantity, p.avg_buy_price, s.current_price
-        FROM Portfolio p
-        JOIN Stock s ON p.stock_id = s.stock_id
-        WHERE p.user_id = %s
-    """
-    cur.execute(query, (user_id,))
-    rows = cur.fetchall()
-    holdings = []
-    for row in rows:
-        d = dict(row)
-        d['avg_buy_price'] = float(d['avg_buy_price'])
-        d['current_price'] = float(d['current_price'])
-        holdings.append(d)
-    cur.close()
-    conn.close()
-    return jsonify(holdings)
+    try:
+        result = valuation.value_portfolio(cur, user_id)
+        return jsonify(result['holdings'] if result else [])
+    finally:
+        cur.close()
+        conn.close()
+
+# --- ENDPOINT: PORTFOLIO SUMMARY (holdings + totals + sector allocation in one call) ---
+@app.route('/api/portfolio/<int:user_id>/summary', methods=['GET'])
+def get_portfolio_summary(user_id):
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=extras.DictCursor)
+        try:
+            result = valuation.value_portfolio(cur, user_id)
+        finally:
+            cur.close()
+            conn.close()
+        if result is None:
+            return jsonify({"status": "error", "message": "User not found"}), 404
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- ENDPOINT: PORTFOLIO NAV HISTORY (daily equity curve for charts) ---
+@app.route('/api/portfolio/<int:user_id>/nav', methods=['GET'])
+def get_portfolio_nav(user_id):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            curve = nav.engine.curve(cur, user_id)
+        finally:
+            cur.close()
+            conn.close()
+        if curve is None:
+            return jsonify({"status": "error", "message": "User not found"}), 404
+
+        since = request.args.get('since')
+        if since:
+            curve = curve[curve.index >= datetime.strptime(since, '%Y-%m-%d').date()]
+        return jsonify({
+            "status": "success",
+            "dates": [d.isoformat() for d in curve.index],
+            "nav": curve["nav"].round(2).tolist(),
+            "holdings_value": curve["holdings_value"].round(2).tolist(),
+            "cash": curve["cash"].round(2).tolist()
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# --- ENDPOINT: RISK ANALYTICS (volatility, beta, VaR, drawdown, correlations) ---
+@app.route('/api/risk/<int:user_id>', methods=['GET'])
+def get_risk_report(user_id):
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            report = risk.engine.report(cur, user_id)
+        finally:
+            cur.close()
+            conn.close()
+        if report is None:
+            return jsonify({"status": "error", "message": "User not found"}), 404
+        return jsonify(dict(report, status="success"))
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 # --- ENDPOINT: EXECUTE BUY ---
 @app.route('/api/buy', methods=['POST'])
@@ -236,21 +373,65 @@ def sell_stock_api():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
 
+# --- ENDPOINT: PREVIEW SELL (tax impact, nothing is executed) ---
+# ?stock_id=&quantity= previews one FIFO sell; ?amount= (optionally with sector or
+# stock_id) picks the shares that raise that much cash with the least tax.
+@app.route('/api/sell/preview/<int:user_id>', methods=['GET'])
+def preview_sell_api(user_id):
+    try:
+        stock_id = request.args.get('stock_id', type=int)
+        quantity = request.args.get('quantity', type=int)
+        amount = request.args.get('amount', type=float)
+        if quantity is None and amount is None:
+            return jsonify({"status": "error", "message": "Provide quantity (with stock_id) or amount"}), 400
+        if quantity is not None and (stock_id is None or quantity <= 0):
+            return jsonify({"status": "error", "message": "quantity must be a positive number of shares of one stock_id"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            lots = lot_selection.load_open_lots(cur, user_id, sector=request.args.get('sector'), stock_id=stock_id)
+        finally:
+            cur.close()
+            conn.close()
+
+        if quantity is not None:
+            if quantity > lots["remaining"].sum():
+                return jsonify({"status": "error", "message": "Insufficient total shares."}), 400
+            preview = lot_selection.summarize(lots, lot_selection.fifo_take(lots, {stock_id: quantity}))
+        else:
+            # Holdings worth less than amount are sold in full and the gap is reported as shortfall
+            take, exact = lot_selection.select_for_amount(lots, amount, detail=True)
+            preview = lot_selection.summarize(lots, take, amount)
+            preview["selection"] = "least_tax" if exact else "approximate"
+        preview["status"] = "success"
+        return jsonify(preview)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 # --- ENDPOINT: MARKET DATA ---
+# Prices are refreshed by the background scheduler; the status endpoint only
+# reports the last snapshot and its age, so open browser tabs never trigger a fetch.
+@app.route('/api/market/status', methods=['GET'])
+def market_status():
+    try:
+        return jsonify(market_scheduler.scheduler.snapshot())
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Refresh now; concurrent requests join the same in-flight run (single-flight)
 @app.route('/api/market/refresh', methods=['POST'])
 def refresh_market_data():
     try:
-        result = MarketData.update_all_prices()
-        return jsonify(result)
+        return jsonify(market_scheduler.scheduler.request_refresh())
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # --- ENDPOINT: GET ALL STOCKS (Market Overview) ---
-@app.route('/api/stocks', methods=['GET'])
-def get_all_stocks():
+def load_stocks_payload():
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
     try:
-        conn = get_connection()
-        cur = conn.cursor(cursor_factory=extras.DictCursor)
         cur.execute("SELECT * FROM Stock ORDER BY symbol")
         rows = cur.fetchall()
         stocks = []
@@ -258,9 +439,23 @@ def get_all_stocks():
             d = dict(row)
             d['current_price'] = float(d['current_price'])
             stocks.append(d)
+        return app.json.dumps(stocks).encode('utf-8')
+    finally:
         cur.close()
         conn.close()
-        return jsonify(stocks)
+
+# Serialized once per market-data version; the refresh job bumps the version
+stocks_snapshot = stock_cache.VersionedSnapshot(load_stocks_payload)
+
+@app.route('/api/stocks', methods=['GET'])
+def get_all_stocks():
+    try:
+        body, etag = stocks_snapshot.get(market_scheduler.scheduler.version)
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # Let browsers keep the payload but revalidate it (If-None-Match -> 304)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -314,100 +509,279 @@ def get_market_news():
 
 # --- CORE LOGIC FUNCTIONS (Stage 3 Logic) ---
 
-def execute_buy(user_id, stock_id, quantity, buy_price):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        # Check Cash Balance
-        total_cost = Decimal(quantity) * Decimal(buy_price)
+def validate_order(quantity, price):
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity <= 0:
+        raise Exception("Quantity must be a positive whole number of shares.")
+    if price is None or float(price) <= 0:
+        raise Exception("Price must be positive.")
+
+# Row locks are always taken in the same order (User, then Portfolio, then BuyLot)
+# so concurrent buys and sells on one account queue up instead of deadlocking.
+def apply_buy(cur, user_id, stock_id, quantity, buy_price):
+    validate_order(quantity, buy_price)
+    total_cost = Decimal(quantity) * Decimal(str(buy_price))
+
+    # Check & Deduct Cash in one statement; the row lock makes concurrent buys queue here
+    cur.execute('UPDATE "User" SET cash_balance = cash_balance - %s WHERE user_id = %s AND cash_balance >= %s RETURNING cash_balance',
+                (total_cost, user_id, total_cost))
+    if cur.fetchone() is None:
         cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s', (user_id,))
         res = cur.fetchone()
         if not res:
             raise Exception("User not found")
-        
-        balance = res[0]
-        if balance < total_cost:
-            raise Exception(f"Insufficient funds. Required: ₹{total_cost}, Available: ₹{balance}")
-
-        # Deduct Cash
-        cur.execute('UPDATE "User" SET cash_balance = cash_balance - %s WHERE user_id = %s', (total_cost, user_id))
-
-        cur.execute('INSERT INTO Transaction (user_id, stock_id, txn_type, quantity, price) VALUES (%s, %s, %s, %s, %s)',
-                    (user_id, stock_id, 'BUY', quantity, buy_price))
-        cur.execute('INSERT INTO BuyLot (user_id, stock_id, buy_date, buy_price, initial_quantity, remaining_quantity) VALUES (%s, %s, CURRENT_DATE, %s, %s, %s)',
-                    (user_id, stock_id, buy_price, quantity, quantity))
-        cur.execute('''
-            INSERT INTO Portfolio (user_id, stock_id, total_quantity, avg_buy_price)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (user_id, stock_id) DO UPDATE SET
-                avg_buy_price = ((Portfolio.total_quantity * Portfolio.avg_buy_price) + (EXCLUDED.total_quantity * EXCLUDED.avg_buy_price)) 
-                                / (Portfolio.total_quantity + EXCLUDED.total_quantity),
-                total_quantity = Portfolio.total_quantity + EXCLUDED.total_quantity
-        ''', (user_id, stock_id, quantity, buy_price))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+        raise Exception(f"Insufficient funds. Required: ₹{total_cost}, Available: ₹{res[0]}")
+
+    cur.execute('INSERT INTO Transaction (user_id, stock_id, txn_type, quantity, price) VALUES (%s, %s, %s, %s, %s)',
+                (user_id, stock_id, 'BUY', quantity, buy_price))
+    cur.execute('''
+        INSERT INTO Portfolio (user_id, stock_id, total_quantity, avg_buy_price)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (user_id, stock_id) DO UPDATE SET
+            avg_buy_price = ((Portfolio.total_quantity * Portfolio.avg_buy_price) + (EXCLUDED.total_quantity * EXCLUDED.avg_buy_price)) 
+                            / (Portfolio.total_quantity + EXCLUDED.total_quantity),
+            total_quantity = Portfolio.total_quantity + EXCLUDED.total_quantity
+    ''', (user_id, stock_id, quantity, buy_price))
+    cur.execute('INSERT INTO BuyLot (user_id, stock_id, buy_date, buy_price, initial_quantity, remaining_quantity) VALUES (%s, %s, CURRENT_DATE, %s, %s, %s)',
+                (user_id, stock_id, buy_price, quantity, quantity))
+
+def execute_buy(user_id, stock_id, quantity, buy_price):
+    db.run_transaction(lambda cur: apply_buy(cur, user_id, stock_id, quantity, buy_price))
+
+# Consumes open lots oldest-first for one sell. A running sum over the lots
+# (ordered by buy_date, lot_id) gives how much was consumed before each lot;
+# every lot that starts before the sell quantity is used up gives
+# LEAST(remaining, qty - consumed_before). The lot updates and RealizedGain
+# rows (Term: simple 365 day rule) are written in bulk and summarized for the tax ledger.
+FIFO_SELL_SQL = """
+    WITH ordered AS (
+        SELECT lot_id, buy_date, buy_price, remaining_quantity,
+               SUM(remaining_quantity) OVER (ORDER BY buy_date, lot_id) - remaining_quantity AS consumed_before
+        FROM BuyLot
+        WHERE user_id = %(user_id)s AND stock_id = %(stock_id)s AND remaining_quantity > 0
+    ),
+    alloc AS (
+        SELECT lot_id, buy_date, buy_price,
+               LEAST(remaining_quantity, %(qty)s - consumed_before) AS qty_consumed
+        FROM ordered
+        WHERE consumed_before < %(qty)s
+    ),
+    lots AS (
+        UPDATE BuyLot b SET remaining_quantity = b.remaining_quantity - a.qty_consumed
+        FROM alloc a
+        WHERE b.lot_id = a.lot_id
+        RETURNING b.lot_id
+    ),
+    gains AS (
+        INSERT INTO RealizedGain (user_id, stock_id, buy_lot_id, quantity, buy_date, sell_date, buy_price, sell_price, total_gain, term)
+        SELECT %(user_id)s, %(stock_id)s, a.lot_id, a.qty_consumed, a.buy_date, CURRENT_DATE, a.buy_price, %(price)s,
+               (%(price)s::numeric - a.buy_price) * a.qty_consumed,
+               CASE WHEN CURRENT_DATE - a.buy_date > 365 THEN 'LONG' ELSE 'SHORT' END
+        FROM alloc a
+        RETURNING quantity, total_gain, term
+    )
+    SELECT COALESCE(SUM(quantity), 0) AS quantity,
+           COALESCE(SUM(total_gain) FILTER (WHERE term = 'SHORT'), 0) AS short_term_gain,
+           COALESCE(SUM(total_gain) FILTER (WHERE term = 'LONG'), 0) AS long_term_gain,
+           COALESCE(SUM(total_gain) FILTER (WHERE total_gain < 0), 0) AS realized_loss,
+           COUNT(*) AS lot_count
+    FROM gains
+"""
+
+def apply_sell_fifo(cur, user_id, stock_id, qty_to_sell, sell_price):
+    validate_order(qty_to_sell, sell_price)
+
+    # Add Cash first so the User row is locked before the holding, as in apply_buy
+    total_sale = Decimal(qty_to_sell) * Decimal(str(sell_price))
+    cur.execute('UPDATE "User" SET cash_balance = cash_balance + %s WHERE user_id = %s RETURNING user_id', (total_sale, user_id))
+    if cur.fetchone() is None:
+        raise Exception("User not found")
+
+    # Conditional decrement locks the holding, so two sells can't both pass the check
+    cur.execute('UPDATE Portfolio SET total_quantity = total_quantity - %s WHERE user_id = %s AND stock_id = %s AND total_quantity >= %s RETURNING total_quantity',
+                (qty_to_sell, user_id, stock_id, qty_to_sell))
+    if cur.fetchone() is None:
+        raise Exception("Insufficient total shares.")
+
+    # FIFO allocation, lot updates and tax rows in one set-based statement
+    cur.execute(FIFO_SELL_SQL, {"user_id": user_id, "stock_id": stock_id,
+                                "qty": qty_to_sell, "price": sell_price})
+    sold = cur.fetchone()
+    if sold['quantity'] != qty_to_sell:
+        raise Exception("Insufficient open lots.")
+
+    tax_ledger.record_sale(cur, user_id, sold['short_term_gain'], sold['long_term_gain'],
+                           sold['realized_loss'], sold['lot_count'])
+
+    cur.execute('INSERT INTO Transaction (user_id, stock_id, txn_type, quantity, price) VALUES (%s, %s, %s, %s, %s)', (user_id, stock_id, 'SELL', qty_to_sell, sell_price))
 
 def execute_sell_fifo(user_id, stock_id, qty_to_sell, sell_price):
-    conn = get_connection()
-    cur = conn.cursor(cursor_factory=extras.DictCursor)
-    try:
-        cur.execute('SELECT total_quantity FROM Portfolio WHERE user_id = %s AND stock_id = %s', (user_id, stock_id))
-        portfolio_record = cur.fetchone()
-        if not portfolio_record or portfolio_record['total_quantity'] < qty_to_sell:
-            raise Exception("Insufficient total shares.")
-
-        cur.execute('SELECT lot_id, remaining_quantity, buy_price, buy_date FROM BuyLot WHERE user_id = %s AND stock_id = %s AND remaining_quantity > 0 ORDER BY buy_date ASC', 
-                    (user_id, stock_id))
-        lots = cur.fetchall()
-        remaining_to_sell = qty_to_sell
-        for lot in lots:
-            if remaining_to_sell <= 0: break
-            
-            # Determine quantity from this lot
-            if lot['remaining_quantity'] <= remaining_to_sell:
-                qty_consumed = lot['remaining_quantity']
-                cur.execute('UPDATE BuyLot SET remaining_quantity = 0 WHERE lot_id = %s', (lot['lot_id'],))
+    db.run_transaction(lambda cur: apply_sell_fifo(cur, user_id, stock_id, qty_to_sell, sell_price),
+                       cursor_factory=extras.DictCursor)
+
+
+# --- BATCH ORDERS ---
+BATCH_MODES = ('all_or_nothing', 'best_effort')
+MAX_BATCH_ORDERS = 500
+CENT = Decimal('0.01')
+
+def apply_order_batch(cur, user_id, orders, mode):
+    """
+    Validate a list of orders against the account's cash and holdings in memory,
+    in submission order, then write every accepted order in bulk. In
+    all_or_nothing mode a single rejection leaves the account untouched.
+    Returns (results, executed_any).
+    """
+    # 1. Lock the account, then every holding the batch touches (same order as single orders)
+    cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s FOR UPDATE', (user_id,))
+    res = cur.fetchone()
+    if not res:
+        raise Exception("User not found")
+    cash = res['cash_balance']
+
+    stock_ids = sorted({o.get('stock_id') for o in orders if isinstance(o.get('stock_id'), int)})
+    cur.execute('SELECT stock_id FROM Stock WHERE stock_id = ANY(%s)', (stock_ids,))
+    known_stocks = {row['stock_id'] for row in cur.fetchall()}
+    cur.execute('''
+        SELECT stock_id, total_quantity, avg_buy_price FROM Portfolio
+        WHERE user_id = %s AND stock_id = ANY(%s)
+        ORDER BY stock_id FOR UPDATE
+    ''', (user_id, stock_ids))
+    holdings = {row['stock_id']: [row['total_quantity'], row['avg_buy_price'] or Decimal(0)] for row in cur.fetchall()}
+
+    # 2. Simulate the orders one by one against in-memory cash and holdings
+    results = []
+    accepted = []
+    for i, order in enumerate(orders):
+        side = str(order.get('type', '')).upper()
+        stock_id = order.get('stock_id')
+        quantity = order.get('quantity')
+        price = order.get('price')
+        result = {"index": i, "type": side, "stock_id": stock_id, "quantity": quantity, "price": price}
+        try:
+            if side not in ('BUY', 'SELL'):
+                raise Exception("Order type must be BUY or SELL.")
+            validate_order(quantity, price)
+            if stock_id not in known_stocks:
+                raise Exception("Unknown stock.")
+
+            unit_price = Decimal(str(price))
+            amount = Decimal(quantity) * unit_price
+            held = holdings.setdefault(stock_id, [0, Decimal(0)])
+            if side == 'BUY':
+                if cash < amount:
+                    raise Exception(f"Insufficient funds. Required: ₹{amount}, Available: ₹{cash}")
+                cash -= amount
+                held[1] = ((held[0] * held[1] + amount) / (held[0] + quantity)).quantize(CENT)
+                held[0] += quantity
             else:
-                qty_consumed = remaining_to_sell
-                cur.execute('UPDATE BuyLot SET remaining_quantity = remaining_quantity - %s WHERE lot_id = %s', (remaining_to_sell, lot['lot_id']))
-            
-            # --- TAX CALCULATION ---
-            buy_price = lot['buy_price']
-            gain_per_share = Decimal(sell_price) - Decimal(buy_price)
-            total_gain = gain_per_share * Decimal(qty_consumed)
-            
-            # Term (Short vs Long) - Simple 365 day rule
-            # buy_date is python date object
-            days_held = (datetime.now().date() - lot['buy_date']).days
-            term = 'LONG' if days_held > 365 else 'SHORT'
-            
-            cur.execute('''
-                INSERT INTO RealizedGain (user_id, stock_id, buy_lot_id, quantity, buy_date, sell_date, buy_price, sell_price, total_gain, term)
-                VALUES (%s, %s, %s, %s, %s, CURRENT_DATE, %s, %s, %s, %s)
-            ''', (user_id, stock_id, lot['lot_id'], qty_consumed, lot['buy_date'], buy_price, sell_price, total_gain, term))
-            # -----------------------
-
-            remaining_to_sell -= qty_consumed
-
-        cur.execute('UPDATE Portfolio SET total_quantity = total_quantity - %s WHERE user_id = %s AND stock_id = %s', (qty_to_sell, user_id, stock_id))
-        cur.execute('INSERT INTO Transaction (user_id, stock_id, txn_type, quantity, price) VALUES (%s, %s, %s, %s, %s)', (user_id, stock_id, 'SELL', qty_to_sell, sell_price))
-        
-        # Add Cash
-        total_sale = Decimal(qty_to_sell) * Decimal(sell_price)
-        cur.execute('UPDATE "User" SET cash_balance = cash_balance + %s WHERE user_id = %s', (total_sale, user_id))
-        
-        conn.commit()
+                if held[0] < quantity:
+                    raise Exception("Insufficient total shares.")
+                cash += amount
+                held[0] -= quantity
+            result["status"] = "executed"
+            accepted.append((side, stock_id, quantity, price))
+        except Exception as e:
+            result["status"] = "rejected"
+            result["message"] = str(e)
+        results.append(result)
+
+    if mode == 'all_or_nothing' and len(accepted) < len(orders):
+        for result in results:
+            if result["status"] == "executed":
+                result["status"] = "not_executed"
+        return results, False
+    if not accepted:
+        return results, False
+
+    # 3. Bulk writes: transactions, new lots, FIFO sells, final holdings and cash
+    extras.execute_values(cur, 'INSERT INTO Transaction (user_id, stock_id, txn_type, quantity, price) VALUES %s',
+                          [(user_id, sid, side, qty, px) for side, sid, qty, px in accepted])
+
+    buys = [(user_id, sid, px, qty, qty) for side, sid, qty, px in accepted if side == 'BUY']
+    if buys:
+        extras.execute_values(cur, '''
+            INSERT INTO BuyLot (user_id, stock_id, buy_date, buy_price, initial_quantity, remaining_quantity)
+            VALUES %s
+        ''', buys, template="(%s, %s, CURRENT_DATE, %s, %s, %s)")
+
+    # New lots are always the newest, so consuming sells after inserting them
+    # gives the same FIFO matches as executing the orders one at a time
+    tax = [Decimal(0), Decimal(0), Decimal(0), 0]
+    for side, sid, qty, px in accepted:
+        if side != 'SELL':
+            continue
+        cur.execute(FIFO_SELL_SQL, {"user_id": user_id, "stock_id": sid, "qty": qty, "price": px})
+        sold = cur.fetchone()
+        if sold['quantity'] != qty:
+            raise Exception("Insufficient open lots.")
+        tax[0] += sold['short_term_gain']
+        tax[1] += sold['long_term_gain']
+        tax[2] += sold['realized_loss']
+        tax[3] += sold['lot_count']
+    if tax[3]:
+        tax_ledger.record_sale(cur, user_id, *tax)
+
+    touched = {sid for _, sid, _, _ in accepted}
+    extras.execute_values(cur, '''
+        INSERT INTO Portfolio (user_id, stock_id, total_quantity, avg_buy_price)
+        VALUES %s
+        ON CONFLICT (user_id, stock_id) DO UPDATE SET
+            total_quantity = EXCLUDED.total_quantity,
+            avg_buy_price = EXCLUDED.avg_buy_price
+    ''', [(user_id, sid, holdings[sid][0], holdings[sid][1]) for sid in sorted(touched)])
+
+    cur.execute('UPDATE "User" SET cash_balance = %s WHERE user_id = %s', (cash, user_id))
+    return results, True
+
+@app.route('/api/orders/batch', methods=['POST'])
+def batch_orders_api():
+    data = request.json # Expects user_id, orders: [{type, stock_id, quantity, price}], optional mode
+    try:
+        mode = data.get('mode', 'all_or_nothing')
+        orders = data.get('orders')
+        if mode not in BATCH_MODES:
+            raise Exception(f"Mode must be one of: {', '.join(BATCH_MODES)}")
+        if not isinstance(orders, list) or not orders:
+            raise Exception("orders must be a non-empty list")
+        if len(orders) > MAX_BATCH_ORDERS:
+            raise Exception(f"At most {MAX_BATCH_ORDERS} orders per batch")
+        if not all(isinstance(o, dict) for o in orders):
+            raise Exception("Each order must be an object")
+
+        results, executed = db.run_transaction(
+            lambda cur: apply_order_batch(cur, data['user_id'], orders, mode),
+            cursor_factory=extras.DictCursor)
+        executed_count = sum(1 for r in results if r["status"] == "executed")
+        body = {
+            "status": "success" if executed else "rejected",
+            "mode": mode,
+            "executed": executed_count,
+            "rejected": sum(1 for r in results if r["status"] == "rejected"),
+            "results": results
+        }
+        return jsonify(body), (200 if executed else 400)
     except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        cur.close()
-        conn.close()
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+
+# --- ENDPOINT: BULK TRADE IMPORT (CSV of historical trades) ---
+# Body is the CSV (raw, or a multipart "file" field): date, symbol, type, quantity, price.
+# ?dry_run=1 returns the diff without writing; ?adjust_cash=1 also applies the cash flows.
+@app.route('/api/import/<int:user_id>', methods=['POST'])
+def import_trades_api(user_id):
+    try:
+        upload = request.files.get('file')
+        text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+        if not text.strip():
+            return jsonify({"status": "error", "message": "Send the trades as CSV"}), 400
+        result = trade_import.import_trades(user_id, text,
+                                            dry_run=request.args.get('dry_run') == '1',
+                                            adjust_cash=request.args.get('adjust_cash') == '1')
+        return jsonify(result), (400 if result["status"] == "rejected" else 200)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 
 # --- ENDPOINT: AI RECOMMENDATIONS ---
@@ -416,12 +790,67 @@ import recommendation_engine
 @app.route('/api/recommendations/<int:user_id>', methods=['GET'])
 def get_recommendations(user_id):
     try:
-        rec = recommendation_engine.analyze_portfolio(user_id)
+        # Precomputed by the batch job after each market refresh; computed on demand
+        # for users without a stored result or who traded since it was computed
+        rec = recommendation_engine.get_stored(user_id)
+        if rec is None:
+            rec = recommendation_engine.analyze_portfolio(user_id)
         return jsonify(rec)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+# --- ENDPOINT: STRATEGY PROFILES & REBALANCE PLAN ---
+import strategy
+import leaderboard
+
+@app.route('/api/strategies', methods=['GET'])
+def list_strategies():
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            return jsonify(strategy.list_profiles(cur))
+        finally:
+            cur.close()
+            conn.close()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/api/rebalance/<int:user_id>', methods=['GET'])
+def get_rebalance_plan(user_id):
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=extras.DictCursor)
+        try:
+            profile = strategy.load_profile(cur, request.args.get('profile'))
+            if profile is None:
+                return jsonify({"status": "error", "message": "Unknown strategy profile"}), 404
+            portfolio = valuation.value_portfolio(cur, user_id)
+            if portfolio is None:
+                return jsonify({"status": "error", "message": "User not found"}), 404
+
+            # Sectors with no holdings are opened with their top momentum stock
+            board = leaderboard.current(cur)
+            held = {h['stock_id'] for h in portfolio['holdings']}
+            candidates = {}
+            for sector in profile['targets']:
+                picks = board.best(sector, held)
+                if picks:
+                    candidates[sector] = picks[0]
+        finally:
+            cur.close()
+            conn.close()
+
+        plan = strategy.plan_rebalance(portfolio['holdings'], portfolio['summary']['cash_balance'],
+                                       profile['targets'], candidates)
+        plan["status"] = "success"
+        plan["profile"] = profile['name']
+        return jsonify(plan)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
 # --- ADMIN: AUTH & VISUALIZER ---
 ADMIN_CREDENTIALS = {
     "username": "admin",
@@ -447,19 +876,40 @@ def list_tables():
     try:
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT table_name 
-            FROM information_schema.tables 
-            WHERE table_schema = 'public' 
-            ORDER BY table_name
-        """)
-        tables = [row[0] for row in cur.fetchall()]
-        cur.close()
-        conn.close()
+        try:
+            tables = sorted(t["name"] for t in table_explorer.catalog(cur).values())
+        finally:
+            cur.close()
+            conn.close()
         return jsonify(tables)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/admin/pool', methods=['GET'])
+def get_pool_metrics():
+    # Simple token check
+    auth_token = request.headers.get('Authorization')
+    if auth_token != "fx_admin_secret_token_2026":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    return jsonify(db.pool_metrics())
+
+@app.route('/api/admin/slow_requests', methods=['GET'])
+def get_slow_requests():
+    # Simple token check
+    auth_token = request.headers.get('Authorization')
+    if auth_token != "fx_admin_secret_token_2026":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    # Newest first, each with the statements it ran
+    return jsonify(list(reversed(metrics.slow_requests)))
+
+# ?limit=N&after=<next_after>  keyset page (default 100 rows)
+# ?columns=a,b                 only these columns (the page key is always included)
+# ?filter=col:op:value         repeatable; op is eq, ne, lt, lte, gt, gte, like, null, notnull
+# ?sort=col&order=desc         any indexed column, ties broken by the primary key
+# ?format=ndjson               every matching row, streamed
+# Tables without a primary key are paged by OFFSET (first MAX_OFFSET rows only).
 @app.route('/api/admin/table/<string:table_name>', methods=['GET'])
 def get_table_data(table_name):
     # Simple token check
@@ -468,36 +918,58 @@ def get_table_data(table_name):
         return jsonify({"status": "error", "message": "Unauthorized"}), 403
 
     try:
+        limit = request.args.get('limit', default=table_explorer.DEFAULT_PAGE_SIZE, type=int)
+        limit = max(1, min(limit, table_explorer.MAX_PAGE_SIZE))
+        columns = [c for c in request.args.get('columns', '').split(',') if c]
+        filters = [(f.split(':', 2) + ['', ''])[:3] for f in request.args.getlist('filter')]
+        descending = request.args.get('order', 'asc').lower() == 'desc'
+        streamed = request.args.get('format') == 'ndjson'
+
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-        allowed_tables = [row[0] for row in cur.fetchall()]
-        
-        actual_table_name = table_name
-        if table_name.lower() == 'user':
-            actual_table_name = '"User"'
-        elif table_name not in allowed_tables:
-            return jsonify({"status": "error", "message": "Invalid table name"}), 400
+        try:
+            table = table_explorer.lookup(cur, table_name)
+            if table is None:
+                return jsonify({"status": "error", "message": "Invalid table name"}), 400
+            query, params, key = table_explorer.build_query(
+                table, columns, filters, request.args.get('sort'), descending,
+                request.args.get('after'), None if streamed else limit)
+            if not streamed:
+                rows, next_after = table_explorer.fetch_page(conn, query, params, limit, key)
+                estimated = table_explorer.estimate_rows(cur, table)
+        finally:
+            cur.close()
+            conn.close()
 
-        cur.close()
-        
-        cur = conn.cursor(cursor_factory=extras.DictCursor)
-        cur.execute(f"SELECT * FROM {actual_table_name}")
-        rows = cur.fetchall()
-        
-        data = []
-        for row in rows:
-            d = dict(row)
-            for k, v in d.items():
-                if isinstance(v, Decimal):
-                    d[k] = float(v)
-                elif isinstance(v, (date, datetime)):
-                    d[k] = v.isoformat()
-            data.append(d)
-            
-        cur.close()
-        conn.close()
-        return jsonify(data)
+        if streamed:
+            rows = streaming.iter_rows(query, params, 'explorer_stream', table_explorer.convert_row)
+            return stream_response(streaming.ndjson(rows), 'application/x-ndjson')
+        return jsonify({
+            "status": "success",
+            "table": table["name"],
+            "columns": columns or list(table["columns"]),
+            "sortable": sorted(table["indexed"]),
+            "estimated_rows": estimated,
+            "items": rows,
+            "next_after": next_after
+        })
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Every user's rows (or ?user_id=), for the accountants
+@app.route('/api/admin/export/<string:kind>', methods=['GET'])
+def export_all_data(kind):
+    # Simple token check
+    auth_token = request.headers.get('Authorization')
+    if auth_token != "fx_admin_secret_token_2026":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    try:
+        return export_response(kind, request.args.get('user_id', type=int))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
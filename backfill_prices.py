@@ -0,0 +1,47 @@
+import argparse
+from db import get_connection
+import MarketData
+import price_history
+import momentum
+
+def backfill(period="2y", symbols=None):
+    conn = get_connection()
+    cur = conn.cursor()
+
+    print(f"Backfilling {period} of daily bars...")
+
+    try:
+        price_history.ensure_schema(cur)
+
+        if symbols:
+            cur.execute("SELECT stock_id, symbol FROM Stock WHERE symbol = ANY(%s)", (symbols,))
+        else:
+            cur.execute("SELECT stock_id, symbol FROM Stock")
+        stocks = cur.fetchall()
+        if not stocks:
+            print("No matching stocks in database.")
+            return
+
+        symbol_to_id = {MarketData.to_yf_symbol(symbol): stock_id for stock_id, symbol in stocks}
+        data, stats = MarketData.fetch_prices(list(symbol_to_id), period=period)
+        rows = price_history.bars_from_frame(data, symbol_to_id)
+        price_history.write_bars(cur, rows)
+
+        conn.commit()
+        print(f"Stored {len(rows)} bars for {len(stocks)} stocks "
+              f"({stats['failed_symbols']} symbols failed, {stats['latency_ms'] / 1000:.1f}s fetch).")
+        print(f"Momentum scores updated for {momentum.recompute_all()} stocks.")
+
+    except Exception as e:
+        conn.rollback()
+        print(f"Error: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load historical OHLCV bars into PriceBar.")
+    parser.add_argument("--period", default="2y", help="yfinance period, e.g. 1y, 2y, 5y, max")
+    parser.add_argument("--symbols", nargs="*", help="Only these symbols (default: whole universe)")
+    args = parser.parse_args()
+    backfill(args.period, args.symbols)
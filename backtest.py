@@ -0,0 +1,332 @@
+import argparse
+import itertools
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from db import get_connection
+import momentum
+import lot_selection
+import strategy
+import recommendation_engine
+from tax_ledger import estimate_tax
+
+# Replays the V2 allocation rules over stored PriceBar history: every
+# `rebalance_every` trading days the portfolio gets the same analysis as
+# analyze_portfolio (one tax-aware trim of the most overweight sector, one buy of
+# the top momentum stock in the most underweight sector) and the trades are
+# executed with FIFO lots, transaction costs and per-financial-year tax.
+
+DEFAULT_PARAMS = {
+    "targets": dict(strategy.DEFAULT_TARGETS),
+    "initial_cash": 1000000.0,
+    "rebalance_every": 21,      # trading days between rebalances
+    "overweight_band": recommendation_engine.OVERWEIGHT_BAND,
+    "underweight_band": recommendation_engine.UNDERWEIGHT_BAND,
+    "cash_buffer": strategy.CASH_BUFFER,
+    "max_buy": recommendation_engine.MAX_BUY_AMOUNT,
+    "cost_bps": 10.0,           # brokerage + charges per trade, basis points of value
+}
+
+MOMENTUM_DEPTH = max(max(momentum.WINDOWS), momentum.VOL_WINDOW) + 1
+
+def load_market(cur, since=None, symbols=None):
+    """Stored closes (forward filled) with each stock's symbol and sector, as plain arrays."""
+    closes = momentum.load_close_matrix(cur, since=since)
+    cur.execute("SELECT stock_id, symbol, COALESCE(sector, 'Unclassified') FROM Stock")
+    info = {stock_id: (symbol, sector) for stock_id, symbol, sector in cur.fetchall()}
+    cols = [sid for sid in closes.columns if sid in info and (not symbols or info[sid][0] in symbols)]
+    return {
+        "dates": np.array(closes.index, dtype='datetime64[D]'),
+        "stock_ids": cols,
+        "symbols": [info[sid][0] for sid in cols],
+        "sectors": [info[sid][1] for sid in cols],
+        "closes": closes[cols].ffill().to_numpy(dtype=float)
+    }
+
+def financial_year(dates):
+    """April-March financial year (its starting calendar year) of each date."""
+    return (dates.astype('datetime64[M]') - np.timedelta64(3, 'M')).astype('datetime64[Y]').astype(int) + 1970
+
+
+class Backtest:
+    """
+    Event-driven backtest: state only changes on rebalance days and financial
+    year ends, and the daily equity curve is rebuilt afterwards from the trade
+    matrix (cumulative positions x closes), as in nav.replay.
+    """
+
+    def __init__(self, market, params=None, holdings=None):
+        self.market = market
+        self.params = dict(DEFAULT_PARAMS, **(params or {}))
+        self.holdings = holdings or {}    # {stock_id: quantity} to start from instead of cash only
+        targets = self.params["targets"]
+        self.target_sectors = list(targets)
+        self.target_pct = np.array(list(targets.values()), dtype=float)
+        col_of = {s: j for j, s in enumerate(self.target_sectors)}
+        self.sector_col = np.array([col_of.get(s, -1) for s in market["sectors"]], dtype=np.int64)
+        self.curve = None
+
+    # --- execution (mirrors apply_buy / apply_sell_fifo) ---
+    def _buy(self, t, j, shares):
+        # Cash never drops below the tax already owed for the open financial year
+        price = self.closes[t, j]
+        spendable = self.cash - estimate_tax(*self.year_gain)
+        shares = min(shares, int(max(spendable, 0) // (price * (1 + self.params["cost_bps"] / 10000))))
+        if shares <= 0:
+            return
+        value = shares * price
+        cost = value * self.params["cost_bps"] / 10000
+        self.qty[j] += shares
+        self.lots[j].append([t, price, shares])
+        self.cash -= value + cost
+        self.delta[t, j] += shares
+        self.flow[t] -= value + cost
+        self.traded += value
+        self.costs += cost
+        self.trades += 1
+
+    def _sell(self, t, j, shares):
+        price = self.closes[t, j]
+        value = shares * price
+        cost = value * self.params["cost_bps"] / 10000
+        left = shares
+        lots = self.lots[j]
+        while left:
+            lot = lots[0]
+            used = min(lot[2], left)
+            gain = (price - lot[1]) * used
+            if (self.dates[t] - self.dates[lot[0]]).astype(int) > lot_selection.LONG_TERM_DAYS:
+                self.year_gain[1] += gain
+            else:
+                self.year_gain[0] += gain
+            lot[2] -= used
+            left -= used
+            if lot[2] == 0:
+                lots.pop(0)
+        self.qty[j] -= shares
+        self.cash += value - cost
+        self.delta[t, j] -= shares
+        self.flow[t] += value - cost
+        self.traded += value
+        self.costs += cost
+        self.trades += 1
+
+    def _settle_tax(self, t):
+        tax = estimate_tax(*self.year_gain)
+        self.shortfall = max(self.shortfall, tax - max(self.cash, 0.0))
+        self.cash -= tax
+        self.flow[t] -= tax
+        self.taxes += tax
+        self.year_gain = [0.0, 0.0]
+
+    # --- V2 rules ---
+    def _scores(self, t):
+        window = self.closes[max(0, t - MOMENTUM_DEPTH + 1):t + 1]
+        scores = momentum.compute_momentum(pd.DataFrame(window)).to_numpy()
+        return np.where(np.isnan(scores), -np.inf, scores)
+
+    def _rebalance(self, t):
+        p = self.params
+        prices = self.closes[t]
+        priced = ~np.isnan(prices)
+        value = self.qty * np.nan_to_num(prices)
+        total = value.sum()
+        scores = self._scores(t)
+
+        if total == 0:
+            # Cash only: open every target sector with its top momentum stock
+            candidates = {}
+            for k, sector in enumerate(self.target_sectors):
+                in_sector = np.flatnonzero((self.sector_col == k) & priced)
+                if len(in_sector):
+                    j = int(in_sector[np.argmax(scores[in_sector])])
+                    candidates[sector] = {"stock_id": j, "symbol": self.market["symbols"][j], "current_price": prices[j]}
+            plan = strategy.plan_rebalance([], self.cash, p["targets"], candidates, cash_buffer=p["cash_buffer"])
+            for trade in plan["trades"]:
+                self._buy(t, trade["stock_id"], trade["quantity"])
+            return
+
+        mapped = self.sector_col >= 0
+        matrix = np.bincount(self.sector_col[mapped], weights=value[mapped], minlength=len(self.target_sectors))
+        over_idx, over_val, under_idx, _ = recommendation_engine.select_sectors(
+            matrix[None, :], np.array([total]), self.target_pct, p["overweight_band"], p["underweight_band"])
+        cash_before = self.cash
+
+        if over_idx[0] >= 0:
+            # Tax-aware trim back to target, through the same lot selection as the live engine
+            rows = []
+            for j in np.flatnonzero((self.sector_col == over_idx[0]) & (self.qty > 0)):
+                for k, (bt, buy_price, remaining) in enumerate(self.lots[j]):
+                    rows.append((k, j, self.market["symbols"][j], self.target_sectors[over_idx[0]],
+                                 self.dates[bt], buy_price, remaining, prices[j]))
+            lots = lot_selection.lots_from_rows(rows, today=self.dates[t].astype(object))
+            take = lot_selection.select_for_amount(lots, float(over_val[0]) / 100 * total)
+            sold = np.bincount(lots["stock_id"], weights=take, minlength=len(prices)) if len(take) else np.zeros(0)
+            for j in np.flatnonzero(sold):
+                self._sell(t, j, int(sold[j]))
+
+        if under_idx[0] >= 0 and cash_before > p["cash_buffer"]:
+            in_sector = np.flatnonzero((self.sector_col == under_idx[0]) & priced & (self.qty == 0))
+            if len(in_sector):
+                j = int(in_sector[np.argmax(scores[in_sector])])
+                amount = min(cash_before - p["cash_buffer"], p["max_buy"])
+                shares = int(amount // (prices[j] * (1 + p["cost_bps"] / 10000)))
+                if shares > 0:
+                    self._buy(t, j, shares)
+
+    # --- driver ---
+    def run(self):
+        m, p = self.market, self.params
+        self.closes, self.dates = m["closes"], m["dates"]
+        n_days, n_stocks = self.closes.shape
+        start = min(momentum.MIN_BARS, n_days - 1)
+
+        self.qty = np.zeros(n_stocks, dtype=np.int64)
+        self.lots = [[] for _ in range(n_stocks)]   # FIFO [day index, buy price, remaining]
+        self.cash = float(p["initial_cash"])
+        self.delta = np.zeros((n_days, n_stocks))
+        self.flow = np.zeros(n_days)
+        self.traded = self.costs = self.taxes = 0.0
+        self.shortfall = 0.0    # largest tax bill the cash on hand could not cover
+        self.trades = 0
+        self.year_gain = [0.0, 0.0]    # short, long term gains of the open financial year
+
+        # A real starting portfolio enters at the first trading day's closes
+        col_of = {sid: j for j, sid in enumerate(m["stock_ids"])}
+        for stock_id, quantity in self.holdings.items():
+            j = col_of.get(stock_id)
+            if j is not None and quantity > 0 and not np.isnan(self.closes[start, j]):
+                self.qty[j] += quantity
+                self.lots[j].append([start, self.closes[start, j], quantity])
+                self.delta[start, j] += quantity
+        initial_value = self.cash + float(self.qty @ np.nan_to_num(self.closes[start]))
+
+        fy = financial_year(self.dates)
+        year_ends = set((np.flatnonzero(fy[1:] != fy[:-1]) + 1).tolist())
+        rebalances = set(range(start, n_days, p["rebalance_every"]))
+        for t in sorted(t for t in (year_ends | rebalances) if t >= start):
+            if t in year_ends:
+                self._settle_tax(t)
+            if t in rebalances:
+                self._rebalance(t)
+        accrued_tax = estimate_tax(*self.year_gain)
+
+        held = np.cumsum(self.delta, axis=0)
+        cash = p["initial_cash"] + np.cumsum(self.flow)
+        nav = (cash + np.einsum('ij,ij->i', held, np.nan_to_num(self.closes)))[start:]
+        self.curve = pd.Series(nav, index=pd.to_datetime(self.dates[start:]))
+        return self._summary(nav, initial_value, accrued_tax)
+
+    def _summary(self, nav, initial_value, accrued_tax):
+        start, end = self.dates[-len(nav)], self.dates[-1]
+        years = max((end - start).astype(int) / 365.25, 1 / 365.25)
+        final = float(nav[-1]) - accrued_tax
+        pre_tax_final = float(nav[-1]) + self.taxes
+        returns = nav[1:] / nav[:-1] - 1 if len(nav) > 1 else np.zeros(0)
+        peak = np.maximum.accumulate(nav)
+
+        def cagr(value):
+            return float(((value / initial_value) ** (1 / years) - 1) * 100) if value > 0 else -100.0
+
+        return {
+            "start": str(start),
+            "end": str(end),
+            "initial_value": round(initial_value, 2),
+            "final_value": round(final, 2),
+            "total_return_pct": round((final / initial_value - 1) * 100, 2),
+            "cagr_pct": round(cagr(final), 2),
+            "pre_tax_cagr_pct": round(cagr(pre_tax_final), 2),
+            "tax_drag_pct": round(cagr(pre_tax_final) - cagr(final), 2),
+            "volatility_pct": round(float(returns.std(ddof=1) * math.sqrt(252) * 100), 2) if len(returns) > 1 else None,
+            "max_drawdown_pct": round(float((nav / peak - 1).min() * 100), 2),
+            "turnover": round(float(self.traded / nav.mean() / years), 2),
+            "trades": self.trades,
+            "costs": round(float(self.costs), 2),
+            "taxes": round(float(self.taxes + accrued_tax), 2),
+            "cash_shortfall": round(float(max(self.shortfall, accrued_tax - max(self.cash, 0.0))), 2)
+        }
+
+
+# --- PARAMETER SWEEPS ---
+# Workers receive the market arrays once (pool initializer), not with every task.
+_market = None
+
+def _init_worker(market):
+    global _market
+    _market = market
+
+def _run(params):
+    return params, Backtest(_market, params).run()
+
+def sweep(market, grid, workers=None):
+    """Run every combination of grid {param: [values]} across a process pool."""
+    keys = list(grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(market,)) as pool:
+        return list(pool.map(_run, combos))
+
+def parse_grid(specs):
+    """['rebalance_every=5,21,63', 'cost_bps=5,10'] -> {'rebalance_every': [5, 21, 63], 'cost_bps': [5.0, 10.0]}"""
+    grid = {}
+    for spec in specs:
+        key, values = spec.split("=", 1)
+        if key not in DEFAULT_PARAMS or key == "targets":
+            raise SystemExit(f"Unknown sweep parameter: {key}")
+        kind = type(DEFAULT_PARAMS[key])
+        grid[key] = [kind(v) for v in values.split(",")]
+    return grid
+
+def load_inputs(args):
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        market = load_market(cur, since=args.since, symbols=args.symbols)
+        profile = strategy.load_profile(cur, args.profile)
+        if profile is None:
+            raise SystemExit(f"Unknown strategy profile: {args.profile}")
+        holdings, cash = {}, args.cash
+        if args.user is not None:
+            cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s', (args.user,))
+            row = cur.fetchone()
+            if row is None:
+                raise SystemExit(f"User {args.user} not found")
+            cash = float(row[0])
+            cur.execute("SELECT stock_id, total_quantity FROM Portfolio WHERE user_id = %s AND total_quantity > 0", (args.user,))
+            holdings = dict(cur.fetchall())
+        return market, profile, holdings, cash
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest the V2 allocation rules over stored price history.")
+    parser.add_argument("--since", help="First date (YYYY-MM-DD), default all history")
+    parser.add_argument("--symbols", nargs="*", help="Only these symbols (default: whole universe)")
+    parser.add_argument("--profile", help="Strategy profile name (default profile if omitted)")
+    parser.add_argument("--user", type=int, help="Start from this user's current holdings and cash")
+    parser.add_argument("--cash", type=float, default=DEFAULT_PARAMS["initial_cash"])
+    parser.add_argument("--rebalance-every", type=int, default=DEFAULT_PARAMS["rebalance_every"])
+    parser.add_argument("--cost-bps", type=float, default=DEFAULT_PARAMS["cost_bps"])
+    parser.add_argument("--sweep", nargs="*", help="Parameter grid, e.g. rebalance_every=5,21,63 cost_bps=5,10")
+    parser.add_argument("--workers", type=int, help="Processes for --sweep (default: CPU count)")
+    args = parser.parse_args()
+
+    market, profile, holdings, cash = load_inputs(args)
+    print(f"{len(market['dates'])} days x {len(market['stock_ids'])} stocks, profile '{profile['name']}'")
+    base = {"targets": profile["targets"], "initial_cash": cash,
+            "rebalance_every": args.rebalance_every, "cost_bps": args.cost_bps}
+
+    started = time.monotonic()
+    if args.sweep:
+        if holdings:
+            raise SystemExit("--sweep starts from cash; it cannot be combined with --user")
+        varied = parse_grid(args.sweep)
+        grid = {k: [v] for k, v in base.items()}
+        grid.update(varied)
+        for params, result in sweep(market, grid, args.workers):
+            print({k: params[k] for k in varied}, result)
+    else:
+        print(Backtest(market, base, holdings).run())
+    print(f"Done in {time.monotonic() - started:.1f}s")
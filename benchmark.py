@@ -0,0 +1,443 @@
+import argparse
+import http.client
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+from urllib.parse import urlsplit
+import numpy as np
+import pandas as pd
+from psycopg2 import extras
+from werkzeug.security import generate_password_hash
+from db import get_connection
+import MarketData
+import momentum
+import price_history
+import trade_import
+from populate_stocks import populate_db, sectors_data
+
+# Seeds a local Postgres with synthetic users, lots and transactions, times the
+# core trading functions against it and drives concurrent HTTP load at the API.
+# Prices come from a deterministic stand-in for yfinance, so runs are repeatable
+# and never touch the network. Compare runs with --save / --baseline.
+
+# --- BENCH CONFIG ---
+BENCH_CONFIG = {
+    "users": 50,              # synthetic accounts created by `seed`
+    "trades_per_user": 200,   # imported per account (buys, and sells of held shares)
+    "history_days": 400,      # calendar days of PriceBar history
+    "cash": 1000000.0,        # starting cash per account
+    "iterations": 50,         # calls per microbenchmark
+    "refresh_iterations": 5,  # update_all_prices is a whole-market refresh; fewer calls
+    "concurrency": 16,        # HTTP load threads
+    "duration": 30,           # seconds of HTTP load
+    "tolerance": 0.20         # allowed p95 slowdown against a baseline before failing
+}
+EMAIL_PREFIX = "bench_"
+PERCENTILES = (50, 95, 99)
+
+# Key endpoints for the HTTP load; {user} is a random seeded account per request
+ENDPOINTS = {
+    "stocks": "/api/stocks",
+    "portfolio": "/api/portfolio/{user}",
+    "summary": "/api/portfolio/{user}/summary",
+    "nav": "/api/portfolio/{user}/nav",
+    "risk": "/api/risk/{user}",
+    "transactions": "/api/transactions/{user}?limit=100",
+    "tax_report": "/api/tax_report/{user}?details=0",
+    "recommendations": "/api/recommendations/{user}"
+}
+
+
+# --- STUB PRICE SOURCE ---
+class StubYF:
+    """
+    Drop-in for the `yf` module used by MarketData: download() returns a
+    (ticker, field) frame of business-day bars from a seeded random walk per
+    symbol, so the same date always gets the same bar. latency adds a delay per
+    call and failure_rate makes that share of calls raise, like a flaky network.
+    """
+
+    def __init__(self, seed=0, latency=0.0, failure_rate=0.0, history_days=3 * 365):
+        self.seed = seed
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.start = pd.Timestamp(date.today() - timedelta(days=history_days))
+        self.base_prices = {MarketData.to_yf_symbol(symbol): price
+                            for stocks in sectors_data.values() for symbol, _, price in stocks}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @lru_cache(maxsize=None)
+    def bars(self, yf_symbol):
+        """Full OHLCV history for one symbol, ending at its base price today."""
+        days = pd.bdate_range(self.start, pd.Timestamp(date.today()))
+        rng = np.random.default_rng([self.seed, sum(map(ord, yf_symbol))])
+        returns = rng.normal(0.0004, 0.016, len(days))
+        close = self.base_prices.get(yf_symbol, 100.0) * np.exp(np.cumsum(returns) - returns.sum())
+        spread = np.abs(rng.normal(0, 0.008, len(days)))
+        return pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, 0.004, len(days))),
+            "High": close * (1 + spread),
+            "Low": close * (1 - spread),
+            "Close": close,
+            "Volume": rng.integers(100000, 5000000, len(days)).astype(float)
+        }, index=days)
+
+    def download(self, tickers, period=None, start=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+        if failed:
+            raise Exception("Simulated download failure")
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        if start is not None:
+            since = pd.Timestamp(start)
+        else:
+            since = pd.Timestamp(date.today() - timedelta(days=int(str(period or "5d").rstrip("d"))))
+        return pd.concat({t: self.bars(t).loc[since:] for t in tickers}, axis=1)
+
+def install_stub(stub):
+    """Route MarketData's yfinance calls to the stub."""
+    MarketData.yf = stub
+    return stub
+
+
+# --- SEEDING ---
+def bench_users(cur):
+    cur.execute('SELECT user_id FROM "User" WHERE email LIKE %s ORDER BY user_id', (EMAIL_PREFIX.replace("_", "\\_") + "%",))
+    return [row[0] for row in cur.fetchall()]
+
+def reset(cur):
+    """Delete every seeded account and everything it owns."""
+    users = bench_users(cur)
+    if users:
+        for table in ("Recommendation", "RealizedGain", "BuyLot", "Transaction", "Portfolio", "TaxSummary", '"User"'):
+            cur.execute(f"DELETE FROM {table} WHERE user_id = ANY(%s)", (users,))
+    return len(users)
+
+def seed_prices(stub, days):
+    """Write `days` of stub history for every stock, then score momentum and set prices."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT stock_id, symbol FROM Stock")
+        symbol_to_id = {MarketData.to_yf_symbol(symbol): stock_id for stock_id, symbol in cur.fetchall()}
+        frame = stub.download(list(symbol_to_id), start=(date.today() - timedelta(days=days)).isoformat())
+        written = price_history.write_bars(cur, price_history.bars_from_frame(frame, symbol_to_id))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+        conn.close()
+    momentum.recompute_all()
+    MarketData.update_all_prices()
+    return written
+
+def synthetic_trades(rng, stub, symbols, count, days):
+    """CSV of `count` trades over the last `days`: buys at the day's close, sells of held shares."""
+    sessions = pd.bdate_range(date.today() - timedelta(days=days), date.today())
+    dates = sorted(rng.choice(sessions) for _ in range(count))
+    held = {}
+    lines = ["date,symbol,type,quantity,price"]
+    for day in dates:
+        if held and rng.random() < 0.3:
+            symbol = rng.choice(sorted(held))
+            quantity = rng.randint(1, held[symbol])
+            side = "SELL"
+            held[symbol] -= quantity
+            if not held[symbol]:
+                del held[symbol]
+        else:
+            symbol = rng.choice(symbols)
+            quantity = rng.randint(1, 20)
+            side = "BUY"
+            held[symbol] = held.get(symbol, 0) + quantity
+        price = stub.bars(MarketData.to_yf_symbol(symbol))["Close"].asof(day)
+        lines.append(f"{day.date().isoformat()},{symbol},{side},{quantity},{price:.2f}")
+    return "\n".join(lines) + "\n"
+
+def create_users(cur, count, cash, run):
+    password = generate_password_hash("bench")
+    rows = [(f"Bench User {i}", f"{EMAIL_PREFIX}{run}_{i}@example.com", password, cash) for i in range(count)]
+    return [row[0] for row in extras.execute_values(cur, """
+        INSERT INTO "User" (name, email, password_hash, cash_balance) VALUES %s RETURNING user_id
+    """, rows, fetch=True)]
+
+def seed(users, trades_per_user, days, cash, stub, seed=0, workers=4, fresh=False):
+    populate_db()
+    started = time.monotonic()
+    bars = seed_prices(stub, days)
+    print(f"Wrote {bars} price bars in {time.monotonic() - started:.1f}s")
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        if fresh:
+            print(f"Removed {reset(cur)} earlier bench users")
+        user_ids = create_users(cur, users, cash, int(time.time()))
+        cur.execute("SELECT symbol FROM Stock ORDER BY symbol")
+        symbols = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+        conn.close()
+
+    def load(i_user):
+        i, user_id = i_user
+        rng = random.Random(seed * 100003 + i)
+        result = trade_import.import_trades(user_id, synthetic_trades(rng, stub, symbols, trades_per_user, days))
+        if result["status"] != "imported":
+            raise Exception(f"Import for user {user_id} {result['status']}: {result['errors'][:3]}")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(load, enumerate(user_ids)))
+    print(f"Imported {users * trades_per_user} trades for {users} users in {time.monotonic() - started:.1f}s")
+    return user_ids
+
+
+# --- STATISTICS ---
+def summarize(samples, elapsed=None, errors=0):
+    """Latency summary in ms for a list of seconds; throughput over `elapsed` when given."""
+    ms = np.asarray(samples, dtype=float) * 1000
+    if not len(ms):
+        return {"count": 0, "errors": errors}
+    stats = {"count": len(ms), "errors": errors, "mean": round(float(ms.mean()), 2), "max": round(float(ms.max()), 2)}
+    for p, value in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        stats[f"p{p}"] = round(float(value), 2)
+    stats["per_second"] = round(len(ms) / (elapsed if elapsed else ms.sum() / 1000), 1)
+    return stats
+
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"{'name':<26}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'per s':>10}")
+    for name, s in results.items():
+        if not s["count"]:
+            print(f"{name:<26}{0:>8}{s['errors']:>8}")
+            continue
+        print(f"{name:<26}{s['count']:>8}{s['errors']:>8}{s['p50']:>10}{s['p95']:>10}{s['p99']:>10}{s['max']:>10}{s['per_second']:>10}")
+
+def compare(results, baseline, tolerance):
+    """Benchmarks whose p95 grew by more than `tolerance` (a fraction) over the baseline."""
+    regressions = []
+    for section, entries in results.items():
+        for name, s in entries.items():
+            old = baseline.get(section, {}).get(name)
+            if not old or not old.get("count") or not s.get("count"):
+                continue
+            if s["p95"] > old["p95"] * (1 + tolerance):
+                regressions.append(f"{section}/{name}: p95 {old['p95']}ms -> {s['p95']}ms")
+    return regressions
+
+
+# --- MICROBENCHMARKS ---
+def timed(fn, args_list):
+    samples, errors = [], 0
+    for args in args_list:
+        started = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception as e:
+            errors += 1
+            print(f"{fn.__name__}{args}: {e}")
+            continue
+        samples.append(time.perf_counter() - started)
+    return summarize(samples, errors=errors)
+
+def micro(user_ids, iterations, refresh_iterations, seed=0):
+    import app
+    from recommendation_engine import analyze_portfolio
+    rng = random.Random(seed)
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT stock_id, current_price FROM Stock WHERE current_price > 0")
+        stocks = [(stock_id, float(price)) for stock_id, price in cur.fetchall()]
+    finally:
+        cur.close()
+        conn.close()
+
+    def tax_report(user_id, query):
+        with app.app.test_request_context(f"/api/tax_report/{user_id}?{query}"):
+            response = app.app.make_response(app.get_tax_report(user_id))
+            if response.status_code != 200:
+                raise Exception(response.get_data(as_text=True))
+            response.get_data()
+
+    # Every sell gives back one share bought in the buy benchmark
+    orders = [(rng.choice(user_ids),) + rng.choice(stocks) for _ in range(iterations)]
+    results = {
+        "execute_buy": timed(app.execute_buy, [(u, s, 1, p) for u, s, p in orders]),
+        "execute_sell_fifo": timed(app.execute_sell_fifo, [(u, s, 1, p) for u, s, p in orders]),
+        "analyze_portfolio": timed(analyze_portfolio, [(rng.choice(user_ids),) for _ in range(iterations)]),
+        "get_tax_report(summary)": timed(tax_report, [(rng.choice(user_ids), "details=0") for _ in range(iterations)]),
+        "get_tax_report(details)": timed(tax_report, [(rng.choice(user_ids), "") for _ in range(iterations)])
+    }
+
+    def refresh():
+        result = MarketData.update_all_prices()
+        if result["status"] != "success":
+            raise Exception(result.get("message"))
+    results["update_all_prices"] = timed(refresh, [()] * refresh_iterations)
+    return results
+
+
+# --- HTTP LOAD ---
+def serve_in_process():
+    """Serve the app on a free local port in a background thread; returns its base URL."""
+    from werkzeug.serving import make_server
+    import app
+    import market_scheduler
+    market_scheduler.scheduler.stop()   # no background refreshes skewing the numbers
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+def load(base_url, user_ids, endpoints, concurrency, duration, seed=0):
+    """
+    Hit `endpoints` (names from ENDPOINTS) round-robin from `concurrency` threads
+    for `duration` seconds. Non-2xx responses and connection errors count as errors.
+    """
+    target = urlsplit(base_url)
+    samples = {name: [] for name in endpoints}
+    errors = {name: 0 for name in endpoints}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed * 1009 + index)
+        conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+        mine = {name: [] for name in endpoints}
+        failed = {name: 0 for name in endpoints}
+        i = index
+        try:
+            while time.monotonic() < deadline:
+                name = endpoints[i % len(endpoints)]
+                i += 1
+                path = target.path.rstrip("/") + ENDPOINTS[name].format(user=rng.choice(user_ids))
+                started = time.perf_counter()
+                try:
+                    conn.request("GET", path)
+                    response = conn.getresponse()
+                    response.read()
+                    ok = 200 <= response.status < 300
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    ok = False
+                if ok:
+                    mine[name].append(time.perf_counter() - started)
+                else:
+                    failed[name] += 1
+        finally:
+            conn.close()
+        with lock:
+            for name in endpoints:
+                samples[name] += mine[name]
+                errors[name] += failed[name]
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    results = {name: summarize(samples[name], elapsed, errors[name]) for name in endpoints}
+    results["total"] = summarize([s for name in endpoints for s in samples[name]], elapsed, sum(errors.values()))
+    return results
+
+
+def seeded_users():
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        user_ids = bench_users(cur)
+    finally:
+        cur.close()
+        conn.close()
+    if not user_ids:
+        raise Exception("No bench users; run `python benchmark.py seed` first")
+    return user_ids
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed synthetic data, run microbenchmarks and HTTP load, and compare against a baseline.")
+    parser.add_argument("command", choices=["seed", "reset", "micro", "load", "run"],
+                        help="run = micro + load")
+    parser.add_argument("--users", type=int, default=BENCH_CONFIG["users"])
+    parser.add_argument("--trades", type=int, default=BENCH_CONFIG["trades_per_user"], help="Trades per user")
+    parser.add_argument("--days", type=int, default=BENCH_CONFIG["history_days"], help="Days of price history")
+    parser.add_argument("--cash", type=float, default=BENCH_CONFIG["cash"])
+    parser.add_argument("--fresh", action="store_true", help="Remove earlier bench users before seeding")
+    parser.add_argument("--iterations", type=int, default=BENCH_CONFIG["iterations"])
+    parser.add_argument("--refresh-iterations", type=int, default=BENCH_CONFIG["refresh_iterations"])
+    parser.add_argument("--yf-latency", type=float, default=0.0, help="Seconds added to every stub download")
+    parser.add_argument("--yf-failure-rate", type=float, default=0.0, help="Share of stub downloads that fail")
+    parser.add_argument("--base-url", help="Server to load (default: serve the app in-process)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of {', '.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=BENCH_CONFIG["concurrency"])
+    parser.add_argument("--duration", type=float, default=BENCH_CONFIG["duration"], help="Seconds of HTTP load")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for data and request mix")
+    parser.add_argument("--save", help="Write results as JSON (a baseline for later runs)")
+    parser.add_argument("--baseline", help="Fail if any p95 regressed past --tolerance against this results file")
+    parser.add_argument("--tolerance", type=float, default=BENCH_CONFIG["tolerance"])
+    args = parser.parse_args()
+
+    stub = install_stub(StubYF(args.seed, args.yf_latency, args.yf_failure_rate, max(args.days, 3 * 365)))
+    try:
+        if args.command == "seed":
+            seed(args.users, args.trades, args.days, args.cash, stub, args.seed, fresh=args.fresh)
+            sys.exit(0)
+        if args.command == "reset":
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                print(f"Removed {reset(cur)} bench users")
+                conn.commit()
+            finally:
+                cur.close()
+                conn.close()
+            sys.exit(0)
+
+        endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+        unknown = [e for e in endpoints if e not in ENDPOINTS]
+        if unknown:
+            raise Exception(f"Unknown endpoints: {', '.join(unknown)}")
+
+        user_ids = seeded_users()
+        results = {}
+        if args.command in ("micro", "run"):
+            results["micro"] = micro(user_ids, args.iterations, args.refresh_iterations, args.seed)
+            print_table("Microbenchmarks", results["micro"])
+        if args.command in ("load", "run"):
+            base_url = args.base_url or serve_in_process()
+            print(f"\nLoading {base_url} from {args.concurrency} threads for {args.duration:g}s...")
+            results["load"] = load(base_url, user_ids, endpoints, args.concurrency, args.duration, args.seed)
+            print_table("HTTP load", results["load"])
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            for r in regressions:
+                print(f"REGRESSION: {r}")
+            sys.exit(1)
+        print(f"\nNo p95 regressions beyond {args.tolerance:.0%} of {args.baseline}.")
@@ -0,0 +1,310 @@
+import threading
+import time
+import random
+import psycopg2
+from psycopg2 import errors
+import metrics
+
+# --- DATABASE CONFIG ---
+DB_CONFIG = {
+    "host": "127.0.0.1",
+    "database": "postgres",
+    "user": "postgres",
+    "password": "1234",
+    "port": 5400
+}
+
+# --- POOL CONFIG ---
+POOL_CONFIG = {
+    "min_connections": 2,
+    "max_connections": 20,
+    "checkout_timeout": 10.0,      # seconds a caller waits for a free connection
+    "health_check_after": 30.0,    # ping idle connections older than this on checkout
+    "recycle_after_uses": 1000     # close and replace a connection after N checkouts
+}
+
+# Checkout latency histogram buckets (seconds)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Thin proxy around a psycopg2 connection. close() hands it back to the pool."""
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def cursor(self, *args, **kwargs):
+        # Same cursor class the caller asked for, with its statements timed for metrics.py
+        factory = kwargs.get("cursor_factory") or self._raw.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = metrics.timed_cursor(factory)
+        return self._raw.cursor(*args, **kwargs)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self._pool.putconn(self._raw)
+
+
+class ConnectionPool:
+    def __init__(self, dsn, min_connections=2, max_connections=20, checkout_timeout=10.0,
+                 health_check_after=30.0, recycle_after_uses=1000):
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.recycle_after_uses = recycle_after_uses
+
+        self._cond = threading.Condition()
+        self._idle = []          # list of (raw_conn, last_used_ts)
+        self._uses = {}          # id(raw_conn) -> checkout count
+        self._size = 0           # open connections (idle + in use)
+        self._in_use = 0
+        self._waiting = 0
+
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "created": 0,
+            "discarded": 0,
+            "recycled": 0,
+            "latency_sum": 0.0,
+            "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1)
+        }
+
+    # --- internals ---
+    def _connect(self):
+        raw = psycopg2.connect(**self.dsn)
+        self._uses[id(raw)] = 0
+        self._stats["created"] += 1
+        return raw
+
+    def _discard(self, raw):
+        self._uses.pop(id(raw), None)
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _healthy(self, raw, last_used):
+        if raw.closed:
+            return False
+        if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.health_check_after:
+            return True
+        try:
+            cur = raw.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            raw.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _record_latency(self, elapsed):
+        self._stats["checkouts"] += 1
+        self._stats["latency_sum"] += elapsed
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                self._stats["latency_buckets"][i] += 1
+                return
+        self._stats["latency_buckets"][-1] += 1
+
+    # --- public API ---
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        while True:
+            raw = None
+            last_used = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"Timed out after {self.checkout_timeout}s waiting for a database connection")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    # Reuse the most recently returned connection
+                    raw, last_used = self._idle.pop()
+                else:
+                    # Reserve a slot; the connect itself happens outside the lock
+                    self._size += 1
+                self._in_use += 1
+
+            # Network I/O (health check / connect) is done without holding the lock
+            if raw is not None:
+                if self._healthy(raw, last_used):
+                    return self._checked_out(raw, start)
+                with self._cond:
+                    self._in_use -= 1
+                    self._size -= 1
+                    self._stats["discarded"] += 1
+                    self._discard(raw)
+                    self._cond.notify()
+                continue
+
+            try:
+                raw = psycopg2.connect(**self.dsn)
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._uses[id(raw)] = 0
+                self._stats["created"] += 1
+            return self._checked_out(raw, start)
+
+    def _checked_out(self, raw, start):
+        with self._cond:
+            self._uses[id(raw)] = self._uses.get(id(raw), 0) + 1
+            self._record_latency(time.monotonic() - start)
+        return PooledConnection(self, raw)
+
+    def putconn(self, raw):
+        keep = not raw.closed
+        if keep:
+            try:
+                # Never hand out a connection with an open or aborted transaction
+                if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    raw.rollback()
+            except Exception:
+                keep = False
+
+        with self._cond:
+            self._in_use -= 1
+            if keep and self._uses.get(id(raw), 0) >= self.recycle_after_uses:
+                self._stats["recycled"] += 1
+                keep = False
+
+            if keep:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._size -= 1
+                self._discard(raw)
+            self._cond.notify()
+
+    def prefill(self):
+        with self._cond:
+            while self._size < self.min_connections:
+                self._size += 1
+                try:
+                    self._idle.append((self._connect(), time.monotonic()))
+                except Exception:
+                    self._size -= 1
+                    raise
+
+    def closeall(self):
+        with self._cond:
+            for raw, _ in self._idle:
+                self._discard(raw)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def metrics(self):
+        with self._cond:
+            count = self._stats["checkouts"]
+            buckets = {}
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS, self._stats["latency_buckets"]):
+                cumulative += n
+                buckets[str(bound)] = cumulative
+            buckets["+Inf"] = count
+            return {
+                "min_connections": self.min_connections,
+                "max_connections": self.max_connections,
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": count,
+                "timeouts": self._stats["timeouts"],
+                "created": self._stats["created"],
+                "discarded": self._stats["discarded"],
+                "recycled": self._stats["recycled"],
+                "checkout_latency": {
+                    "count": count,
+                    "sum": self._stats["latency_sum"],
+                    "avg": (self._stats["latency_sum"] / count) if count else 0.0,
+                    "buckets": buckets
+                }
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                pool = ConnectionPool(DB_CONFIG, **POOL_CONFIG)
+                try:
+                    pool.prefill()
+                except Exception as e:
+                    # Pool still works; connections are created lazily on checkout
+                    print(f"Pool prefill failed: {e}")
+                _pool = pool
+    return _pool
+
+def get_connection():
+    """Check out a pooled connection. Call close() on it to return it to the pool."""
+    return get_pool().getconn()
+
+def pool_metrics():
+    return get_pool().metrics()
+
+# Errors where re-running the whole transaction is safe and usually succeeds
+RETRYABLE_ERRORS = (errors.SerializationFailure, errors.DeadlockDetected, errors.LockNotAvailable)
+
+def run_transaction(work, retries=3, cursor_factory=None):
+    """
+    Run work(cur) in its own transaction on a pooled connection and commit.
+    Serialization failures and deadlocks roll back and retry with jittered
+    backoff; any other exception rolls back and propagates.
+    """
+    attempt = 0
+    while True:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=cursor_factory)
+        try:
+            result = work(cur)
+            conn.commit()
+            return result
+        except RETRYABLE_ERRORS:
+            conn.rollback()
+            if attempt >= retries:
+                raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
+        attempt += 1
+        time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
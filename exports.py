@@ -0,0 +1,243 @@
+import argparse
+import queue
+import sys
+import threading
+from datetime import date
+from db import get_connection
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:   # Parquet export is optional (pip install pyarrow)
+    pa = pq = None
+
+# --- BULK EXPORTS ---
+# CSV comes straight from COPY ... TO STDOUT; Parquet is written in row groups
+# from a server-side cursor. Either way only a few chunks are in memory at once.
+PIPE_CHUNKS = 16          # chunks buffered between the database thread and the response
+CHUNK_SIZE = 64 * 1024    # COPY hands over one row per write; send them in blocks this size
+PARQUET_BATCH = 50000     # rows per Parquet row group / cursor round-trip
+
+EXPORTS = {
+    "transactions": {
+        "query": """
+            SELECT t.txn_id, t.user_id, s.symbol, t.txn_type, t.quantity, t.price, t.txn_date
+            FROM Transaction t
+            JOIN Stock s ON s.stock_id = t.stock_id
+        """,
+        "user_column": "t.user_id", "date_column": "t.txn_date", "order": "t.txn_id",
+        "types": ["int", "int", "str", "str", "int", "decimal", "timestamp"]
+    },
+    "lots": {
+        "query": """
+            SELECT b.lot_id, b.user_id, s.symbol, b.buy_date, b.buy_price,
+                   b.initial_quantity, b.remaining_quantity
+            FROM BuyLot b
+            JOIN Stock s ON s.stock_id = b.stock_id
+        """,
+        "user_column": "b.user_id", "date_column": "b.buy_date", "order": "b.lot_id",
+        "types": ["int", "int", "str", "date", "decimal", "int", "int"]
+    },
+    "realized_gains": {
+        "query": """
+            SELECT r.gain_id, r.user_id, s.symbol, r.buy_lot_id, r.quantity, r.buy_date, r.sell_date,
+                   r.buy_price, r.sell_price, r.total_gain, r.term
+            FROM RealizedGain r
+            JOIN Stock s ON s.stock_id = r.stock_id
+        """,
+        "user_column": "r.user_id", "date_column": "r.sell_date", "order": "r.gain_id",
+        "types": ["int", "int", "str", "int", "int", "date", "date", "decimal", "decimal", "decimal", "str"]
+    }
+}
+FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+def statement(kind, user_id=None, since=None, until=None):
+    """
+    The export's SELECT and its parameters for the user and inclusive date range.
+    Needs no connection; raises ValueError for an unknown export or a malformed date.
+    """
+    spec = EXPORTS.get(kind)
+    if spec is None:
+        raise ValueError(f"Unknown export '{kind}' (use {', '.join(EXPORTS)})")
+    where, params = [], []
+    if user_id is not None:
+        where.append(f"{spec['user_column']} = %s")
+        params.append(int(user_id))
+    if since:
+        where.append(f"{spec['date_column']} >= %s")
+        params.append(date.fromisoformat(str(since)))
+    if until:
+        where.append(f"{spec['date_column']} < %s::date + 1")
+        params.append(date.fromisoformat(str(until)))
+    query = spec["query"] + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {spec['order']}"
+    return query, params
+
+def _bind(conn, query, params):
+    # COPY takes no parameters, so the values are inlined with mogrify
+    cur = conn.cursor()
+    try:
+        return cur.mogrify(query, params).decode()
+    finally:
+        cur.close()
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}' (use {', '.join(FORMATS)})")
+    if fmt == "parquet" and pa is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+
+def write_csv(conn, query, out):
+    cur = conn.cursor()
+    try:
+        cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+    finally:
+        cur.close()
+
+def write_parquet(conn, kind, query, out):
+    arrow_types = {"int": pa.int64(), "str": pa.string(), "decimal": pa.decimal128(15, 2),
+                   "timestamp": pa.timestamp("us"), "date": pa.date32()}
+    cur = conn.cursor(name=f"export_{kind}")
+    cur.itersize = PARQUET_BATCH
+    try:
+        cur.execute(query)
+        rows = cur.fetchmany(PARQUET_BATCH)
+        names = [c[0] for c in cur.description]
+        schema = pa.schema([(n, arrow_types[t]) for n, t in zip(names, EXPORTS[kind]["types"])])
+        writer = pq.ParquetWriter(out, schema)
+        try:
+            while rows:
+                columns = list(zip(*rows))
+                writer.write_batch(pa.record_batch(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+                rows = cur.fetchmany(PARQUET_BATCH)
+        finally:
+            writer.close()
+    finally:
+        cur.close()
+
+def export(kind, out, fmt="csv", user_id=None, since=None, until=None):
+    """Write one export to the binary file object `out`."""
+    check_format(fmt)
+    query, params = statement(kind, user_id, since, until)
+    conn = get_connection()
+    try:
+        query = _bind(conn, query, params)
+        if fmt == "csv":
+            write_csv(conn, query, out)
+        else:
+            write_parquet(conn, kind, query, out)
+    finally:
+        conn.close()
+
+
+class _Pipe:
+    """Write end of a bounded queue, so a writer thread can feed a streamed response."""
+
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=PIPE_CHUNKS)
+        self.cancelled = threading.Event()
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        if self.cancelled.is_set():
+            raise IOError("Export cancelled")
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.drain()
+        return len(data)
+
+    def drain(self):
+        if self.buffer:
+            self.chunks.put(bytes(self.buffer))
+            self.buffer.clear()
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+def stream(kind, fmt="csv", user_id=None, since=None, until=None):
+    """
+    Generator of export bytes for a streamed HTTP response. Arguments are checked
+    before anything is sent (ValueError); the export itself runs on a thread that
+    blocks while the client is slower than the database, and is cancelled if the
+    client goes away. No connection is used until the body is iterated: the query
+    is bound on the export's own connection, so a response that is never sent
+    (e.g. HEAD) holds none.
+    """
+    check_format(fmt)
+    query, params = statement(kind, user_id, since, until)
+
+    def run(conn, pipe):
+        try:
+            query_sql = _bind(conn, query, params)
+            if fmt == "csv":
+                write_csv(conn, query_sql, pipe)
+            else:
+                write_parquet(conn, kind, query_sql, pipe)
+            pipe.drain()
+            pipe.chunks.put(None)
+        except Exception as e:
+            if not pipe.cancelled.is_set():
+                print(f"Export {kind} failed: {e}")
+            pipe.chunks.put(e)
+
+    def chunks():
+        conn = get_connection()
+        pipe = _Pipe()
+        worker = threading.Thread(target=run, args=(conn, pipe), daemon=True)
+        try:
+            worker.start()
+            while True:
+                chunk = pipe.chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # Unblock and stop the writer if the client disconnected mid-export
+            pipe.cancelled.set()
+            while worker.is_alive():
+                try:
+                    pipe.chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            conn.close()
+
+    return chunks()
+
+def filename(kind, fmt, user_id=None, since=None, until=None):
+    parts = [kind] + ([f"user{user_id}"] if user_id is not None else [])
+    parts += [p for p in (since, until) if p]
+    return "_".join(str(p) for p in parts) + "." + fmt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export transactions, buy lots or realized gains as CSV or Parquet.")
+    parser.add_argument("kind", choices=list(EXPORTS))
+    parser.add_argument("--user", type=int, help="Only this user (default: everyone)")
+    parser.add_argument("--since", help="First date, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Last date, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout for CSV, <kind>.parquet for Parquet)")
+    args = parser.parse_args()
+
+    path = args.output or (None if args.format == "csv" else filename(args.kind, "parquet", args.user, args.since, args.until))
+    try:
+        if path is None:
+            export(args.kind, sys.stdout.buffer, args.format, args.user, args.since, args.until)
+        else:
+            with open(path, "wb") as out:
+                export(args.kind, out, args.format, args.user, args.since, args.until)
+            print(f"Wrote {path}", file=sys.stderr)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
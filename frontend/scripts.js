@@ -92,40 +92,25 @@ function updateCashDisplay(amount) {
     }
 }
 
-async function fetchLatestUserData() {
-    if (!currentUser) return;
-    try {
-        const res = await fetch(`${API_BASE}/user/${currentUser.user_id}`);
+function applyUserData(data) {
+    currentUser.cash_balance = data.cash_balance;
+    currentUser.email = data.email; // Sync email
+    currentUser.name = data.name;   // Sync name
+    localStorage.setItem('stock_user', JSON.stringify(currentUser));
+
+    // Refresh UI Elements
+    updateCashDisplay(data.cash_balance);
+    const ddName = document.getElementById('user-name-display');
+    if (ddName) ddName.innerText = data.name;
+    const ddEmail = document.getElementById('user-email-display');
+    if (ddEmail) ddEmail.innerText = data.email;
 
-        // Handle Invalid Session (User deleted/DB reset)
-        if (res.status === 404) {
-            console.warn("User ID not found. Session invalid.");
-            logout();
-            return;
-        }
+    // Update Avatar Initial
+    const initialEl = document.getElementById('user-initial');
+    if (initialEl && data.name) initialEl.innerText = data.name.charAt(0).toUpperCase();
 
-        if (res.ok) {
-            const data = await res.json();
-            currentUser.cash_balance = data.cash_balance;
-            currentUser.email = data.email; // Sync email
-            currentUser.name = data.name;   // Sync name
-            localStorage.setItem('stock_user', JSON.stringify(currentUser));
-
-            // Refresh UI Elements
-            updateCashDisplay(data.cash_balance);
-            const ddName = document.getElementById('user-name-display');
-            if (ddName) ddName.innerText = data.name;
-            const ddEmail = document.getElementById('user-email-display');
-            if (ddEmail) ddEmail.innerText = data.email;
-
-            // Update Avatar Initial
-            const initialEl = document.getElementById('user-initial');
-            if (initialEl && data.name) initialEl.innerText = data.name.charAt(0).toUpperCase();
-
-            const initialElDropdown = document.getElementById('user-initial-dropdown');
-            if (initialElDropdown && data.name) initialElDropdown.innerText = data.name.charAt(0).toUpperCase();
-        }
-    } catch (e) { console.error("Sync user data failed", e); }
+    const initialElDropdown = document.getElementById('user-initial-dropdown');
+    if (initialElDropdown && data.name) initialElDropdown.innerText = data.name.charAt(0).toUpperCase();
 }
 
 function setUser(userData) {
@@ -192,28 +177,37 @@ function checkSession() {
 
 // --- PORTFOLIO & DATA ---
 
+async function fetchPortfolioSummary() {
+    const res = await fetch(`${API_BASE}/portfolio/${currentUser.user_id}/summary`);
+
+    // Handle Invalid Session (User deleted/DB reset)
+    if (res.status === 404) {
+        console.warn("User ID not found. Session invalid.");
+        logout();
+        return null;
+    }
+    const data = await res.json();
+    globalHoldings = data.holdings;
+    applyUserData(data.user);
+    return data;
+}
+
 async function loadPortfolio() {
     if (!currentUser) return;
 
     try {
-        const res = await fetch(`${API_BASE}/portfolio/${currentUser.user_id}`);
-        globalHoldings = await res.json();
-        const holdings = globalHoldings;
+        // Holdings, totals and user cash come back in one server-side valuation
+        const data = await fetchPortfolioSummary();
+        if (!data) return;
+        const holdings = data.holdings;
+        const summary = data.summary;
 
         const tbody = document.getElementById('portfolio-body');
         if (!tbody) return; // Exit if not on dashboard
         tbody.innerHTML = '';
-        let totalVal = 0;
-        let totalCost = 0;
 
         holdings.forEach(item => {
-            const currentVal = item.total_quantity * item.current_price;
-            const costBasis = item.total_quantity * item.avg_buy_price;
-            const pl = currentVal - costBasis;
-            const plPct = (pl / costBasis) * 100;
-
-            totalVal += currentVal;
-            totalCost += costBasis;
+            const pl = item.unrealized_pnl;
 
             const row = tbody.insertRow();
             row.innerHTML = `
@@ -222,28 +216,24 @@ async function loadPortfolio() {
                 <td>₹${item.avg_buy_price.toFixed(2)}</td>
                 <td>₹${item.current_price.toFixed(2)}</td>
                 <td class="${pl >= 0 ? 'positive' : 'negative'}">
-                    ${pl >= 0 ? '+' : ''}${plPct.toFixed(2)}%
+                    ${pl >= 0 ? '+' : ''}${item.unrealized_pnl_pct.toFixed(2)}%
                     <span style="font-size:0.8em; color: var(--text-muted);">(₹${pl.toFixed(2)})</span>
                 </td>
             `;
         });
 
         // Update KPIs
-        document.getElementById('kpi-value').innerText = `₹${totalVal.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
-        const totalPL = totalVal - totalCost;
-        const totalPLPct = totalCost > 0 ? (totalPL / totalCost) * 100 : 0;
+        document.getElementById('kpi-value').innerText = `₹${summary.total_value.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
+        const totalPL = summary.unrealized_pnl;
 
         const plEl = document.getElementById('kpi-pl');
         plEl.innerText = `${totalPL >= 0 ? '+' : ''}₹${totalPL.toFixed(2)}`;
         plEl.className = `kpi-value ${totalPL >= 0 ? 'positive' : 'negative'}`;
 
         const plPctEl = document.getElementById('kpi-pl-percent');
-        plPctEl.innerText = `${totalPLPct.toFixed(2)}%`;
+        plPctEl.innerText = `${summary.unrealized_pnl_pct.toFixed(2)}%`;
         plPctEl.className = `kpi-sub ${totalPL >= 0 ? 'positive' : 'negative'}`;
 
-        // Sync User
-        fetchLatestUserData();
-
     } catch (err) {
         console.error("Failed to load portfolio", err);
     }
@@ -300,16 +290,21 @@ const priceInput = document.getElementById('price');
 if (qtyInput) qtyInput.addEventListener('input', calculateTotal);
 if (priceInput) priceInput.addEventListener('input', calculateTotal);
 
+let lastMarketVersion = null;
+
 async function refreshMarket() {
     monitor("Auto-syncing market data...", "#58a6ff");
     try {
-        const res = await fetch(`${API_BASE}/market/refresh`, { method: 'POST' });
+        // Server refreshes prices on its own schedule; we only poll the snapshot
+        const res = await fetch(`${API_BASE}/market/status`);
         const result = await res.json();
-        if (result.status === 'success') {
-            console.log(`Market Updated: ${result.updated} tickers synced.`);
+        if (result.status === 'success' && result.version !== lastMarketVersion) {
+            lastMarketVersion = result.version;
+            console.log(`Market Updated: ${result.updated} tickers synced ${result.age_seconds}s ago.`);
             // Determine active page logic
             if (document.getElementById('portfolio-body')) {
                 loadPortfolio();
+                loadNavChart();
             }
             if (document.getElementById('detailed-holdings-body')) {
                 loadPortfolioPage();
@@ -328,26 +323,19 @@ async function refreshMarket() {
 async function loadPortfolioPage() {
     if (!currentUser) return;
 
-    // 1. Load Holdings for Detailed Table & Chart
+    // 1. Load Holdings, Totals & Sector Allocation for Detailed Table & Chart
     try {
-        const res = await fetch(`${API_BASE}/portfolio/${currentUser.user_id}`);
-        const holdings = await res.json();
-        const stockPrices = {}; // Map for easy access
+        const data = await fetchPortfolioSummary();
+        if (!data) return;
+        const holdings = data.holdings;
+        const summary = data.summary;
 
         const tbody = document.getElementById('detailed-holdings-body');
         if (tbody) {
             tbody.innerHTML = '';
-            let totalEquity = 0;
-            let totalCostBasis = 0;
-
-            holdings.forEach((item, index) => {
-                const marketVal = item.total_quantity * item.current_price;
-                const costBasis = item.total_quantity * item.avg_buy_price;
-                const pl = marketVal - costBasis;
-
-                totalEquity += marketVal;
-                totalCostBasis += costBasis;
 
+            holdings.forEach(item => {
+                const pl = item.unrealized_pnl;
 
                 const row = tbody.insertRow();
                 row.innerHTML = `
@@ -355,43 +343,29 @@ async function loadPortfolioPage() {
                     <td>${item.total_quantity}</td>
                     <td>₹${item.avg_buy_price.toFixed(2)}</td>
                     <td>₹${item.current_price.toFixed(2)}</td>
-                    <td>₹${marketVal.toLocaleString(undefined, { minimumFractionDigits: 2 })}</td>
+                    <td>₹${item.market_value.toLocaleString(undefined, { minimumFractionDigits: 2 })}</td>
                     <td class="${pl >= 0 ? 'positive' : 'negative'}">₹${pl.toLocaleString(undefined, { minimumFractionDigits: 2 })}</td>
                 `;
             });
 
             // Update Summary Cards
             const portEquity = document.getElementById('port-equity');
-            if (portEquity) portEquity.innerText = `₹${totalEquity.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
+            if (portEquity) portEquity.innerText = `₹${summary.total_value.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
 
             const portCash = document.getElementById('port-cash');
-            if (portCash) portCash.innerText = `₹${parseFloat(currentUser.cash_balance).toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
+            if (portCash) portCash.innerText = `₹${summary.cash_balance.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
 
-            const totalPL = totalEquity - totalCostBasis;
+            const totalPL = summary.unrealized_pnl;
             const plElement = document.getElementById('port-pl');
             if (plElement) {
                 plElement.innerText = `${totalPL >= 0 ? '+' : ''}₹${totalPL.toLocaleString(undefined, { minimumFractionDigits: 2 })}`;
                 plElement.className = `kpi-value ${totalPL >= 0 ? 'positive' : 'negative'}`;
             }
 
-            // Group by Sector
-            const sectorMap = {};
-
-            holdings.forEach(item => {
-                const marketVal = item.total_quantity * item.current_price;
-                if (marketVal > 0) {
-                    if (!sectorMap[item.sector]) {
-                        sectorMap[item.sector] = { value: 0, companies: [] };
-                    }
-                    sectorMap[item.sector].value += marketVal;
-                    sectorMap[item.sector].companies.push(item.symbol);
-                }
-            });
-
-            // Prepare Chart Data
-            const labels = Object.keys(sectorMap);
-            const dataPoints = labels.map(k => sectorMap[k].value);
-            const companyLists = labels.map(k => sectorMap[k].companies);
+            // Sector allocation is computed server-side
+            const labels = data.sectors.map(s => s.sector);
+            const dataPoints = data.sectors.map(s => s.value);
+            const companyLists = data.sectors.map(s => s.symbols);
             const colors = labels.map((_, i) => `hsl(${(i * 137.5) % 360}, 70%, 60%)`);
 
             // Render Chart
@@ -611,7 +585,7 @@ if (txnForm) {
     });
 }
 
-// --- CHART (Mock Data) ---
+// --- CHART (Portfolio NAV history) ---
 function initChart() {
     const canvas = document.getElementById('mainChart');
     if (!canvas) return;
@@ -625,10 +599,11 @@ function initChart() {
     marketChart = new Chart(ctx, {
         type: 'line',
         data: {
-            labels: ['9:30', '10:00', '10:30', '11:00', '11:30', '12:00', '12:30'],
+            labels: [],
             datasets: [{
                 label: 'Portfolio Value',
-                data: [10000, 10200, 10150, 10400, 10350, 10800, 10950],
+                data: [],
+                pointRadius: 0,
                 borderColor: '#3b82f6',
                 backgroundColor: gradient,
                 borderWidth: 2,
@@ -654,6 +629,22 @@ function initChart() {
             }
         }
     });
+
+    loadNavChart();
+}
+
+async function loadNavChart() {
+    if (!marketChart || !currentUser) return;
+    try {
+        const res = await fetch(`${API_BASE}/portfolio/${currentUser.user_id}/nav`);
+        if (!res.ok) return;
+        const data = await res.json();
+        marketChart.data.labels = data.dates;
+        marketChart.data.datasets[0].data = data.nav;
+        marketChart.update();
+    } catch (err) {
+        console.error("Failed to load portfolio history", err);
+    }
 }
 
 // --- MARKET EXPLORER PAGE ---
@@ -938,6 +929,9 @@ async function loadRecommendations() {
             { label: 'Suggested Sector', value: data.sector || 'Diversified', rationale: 'This sector currently offers the best risk-adjusted momentum for your profile.' },
             { label: 'Investment Action', value: data.action || 'Hold', rationale: `Recommended action based on portfolio concentration and market trends.` }
         ];
+        if (data.alternatives && data.alternatives.length) {
+            recs.push({ label: 'Alternatives', value: data.alternatives.join(', '), rationale: 'Next-best momentum candidates in the same sector that you do not already hold.' });
+        }
 
         recs.forEach(rec => {
             const card = document.createElement('div');
@@ -992,42 +986,77 @@ async function loadTableList() {
     }
 }
 
-async function loadTableData(tableName) {
+// Table explorer state: one keyset-paginated page at a time, appended on "Load more"
+const explorer = { table: null, sort: null, order: 'asc', after: null, columns: [] };
+
+function sortTable(col) {
+    explorer.order = (explorer.sort === col && explorer.order === 'asc') ? 'desc' : 'asc';
+    explorer.sort = col;
+    loadTableData(explorer.table);
+}
+
+async function loadTableData(tableName, append = false) {
     const thead = document.getElementById('db-thead');
     const tbody = document.getElementById('db-tbody');
+    const more = document.getElementById('db-more');
     if (!thead || !tbody) return;
 
-    tbody.innerHTML = '<tr><td colspan="100%" style="text-align: center; padding: 40px;"><i class="fas fa-spinner fa-spin"></i> Fetching records...</td></tr>';
+    if (!append) {
+        if (explorer.table !== tableName) {
+            explorer.sort = null;
+            explorer.order = 'asc';
+        }
+        explorer.table = tableName;
+        explorer.after = null;
+        tbody.innerHTML = '<tr><td colspan="100%" style="text-align: center; padding: 40px;"><i class="fas fa-spinner fa-spin"></i> Fetching records...</td></tr>';
+    }
+    if (more) more.style.display = 'none';
 
     try {
         const adminToken = localStorage.getItem('finnex_admin_token');
-        const res = await fetch(`${API_BASE}/admin/table/${tableName}`, {
+        const params = new URLSearchParams({ limit: 100, order: explorer.order });
+        if (explorer.sort) params.set('sort', explorer.sort);
+        if (append && explorer.after) params.set('after', explorer.after);
+        const res = await fetch(`${API_BASE}/admin/table/${tableName}?${params}`, {
             headers: { 'Authorization': adminToken }
         });
         const data = await res.json();
+        if (data.status !== 'success') throw new Error(data.message);
 
-        if (data.length === 0) {
-            thead.innerHTML = '';
-            tbody.innerHTML = '<tr><td colspan="100%" style="text-align: center; padding: 40px; color: var(--text-muted);">This relation is currently empty.</td></tr>';
-            return;
-        }
+        if (!append) {
+            if (data.items.length === 0) {
+                thead.innerHTML = '';
+                tbody.innerHTML = '<tr><td colspan="100%" style="text-align: center; padding: 40px; color: var(--text-muted);">This relation is currently empty.</td></tr>';
+                return;
+            }
 
-        // Generate Headers
-        const cols = Object.keys(data[0]);
-        thead.innerHTML = `<tr>${cols.map(col => `<th>${col}</th>`).join('')}</tr>`;
+            // Headers: indexed columns sort on click
+            explorer.columns = data.columns;
+            thead.innerHTML = `<tr>${data.columns.map(col => {
+                if (!data.sortable.includes(col)) return `<th>${col}</th>`;
+                const arrow = explorer.sort === col ? (explorer.order === 'asc' ? ' ▲' : ' ▼') : '';
+                return `<th style="cursor: pointer;" onclick="sortTable('${col}')">${col}${arrow}</th>`;
+            }).join('')}</tr>`;
+            tbody.innerHTML = '';
+        }
 
         // Generate Body
-        tbody.innerHTML = data.map(row => `
+        tbody.insertAdjacentHTML('beforeend', data.items.map(row => `
             <tr>
-                ${cols.map(col => {
+                ${explorer.columns.map(col => {
             const val = row[col];
             if (val === null) return '<td style="color: var(--text-muted); opacity: 0.5;">null</td>';
             return `<td>${val}</td>`;
         }).join('')}
             </tr>
-        `).join('');
+        `).join(''));
+
+        explorer.after = data.next_after;
+        if (more && data.next_after) more.style.display = 'block';
 
-        monitor(`Visualized: ${tableName} (${data.length} rows)`, "#primary-purple");
+        const shown = tbody.querySelectorAll('tr').length;
+        const estimate = data.estimated_rows !== null ? ` of ~${data.estimated_rows}` : '';
+        monitor(`Visualized: ${tableName} (${shown}${estimate} rows)`, "#primary-purple");
     } catch (err) {
         tbody.innerHTML = `<tr><td colspan="100%" style="text-align: center; color: var(--accent-danger);">Failed to fetch data: ${err.message}</td></tr>`;
     }
@@ -1070,7 +1099,7 @@ window.onload = () => {
     // 30-min Auto Refresh
     setInterval(async () => {
         try {
-            const res = await fetch(`${API_BASE}/market/refresh`, { method: 'POST' });
+            const res = await fetch(`${API_BASE}/market/status`);
             if (res.ok) {
                 if (document.getElementById('market-grid')) loadMarketPage();
                 if (document.getElementById('detailed-holdings-body')) loadPortfolioPage();
@@ -9,6 +9,11 @@ DB_CONFIG = {
 }
 
 COMMANDS = [
+    "DROP TABLE IF EXISTS Recommendation CASCADE",
+    "DROP TABLE IF EXISTS StrategyTarget CASCADE",
+    "DROP TABLE IF EXISTS StrategyProfile CASCADE",
+    "DROP TABLE IF EXISTS TaxSummary CASCADE",
+    "DROP TABLE IF EXISTS PriceBar CASCADE",
     "DROP TABLE IF EXISTS RealizedGain CASCADE",
     "DROP TABLE IF EXISTS BuyLot CASCADE",
     "DROP TABLE IF EXISTS Transaction CASCADE",
@@ -23,7 +28,7 @@ COMMANDS = [
         name VARCHAR(100) NOT NULL,
         email VARCHAR(120) UNIQUE NOT NULL,
         password_hash VARCHAR(255) NOT NULL,
-        cash_balance DECIMAL(15, 2) DEFAULT 1000000.00
+        cash_balance DECIMAL(15, 2) DEFAULT 1000000.00 CHECK (cash_balance >= 0)
     )
     """,
     # Stock
@@ -34,6 +39,7 @@ COMMANDS = [
         name VARCHAR(100),
         sector VARCHAR(50),
         current_price DECIMAL(10, 2) NOT NULL,
+        day_change DECIMAL(7, 2) DEFAULT 0.0,
         momentum_score DECIMAL(5, 2) DEFAULT 0.0
     )
     """,
@@ -42,7 +48,7 @@ COMMANDS = [
     CREATE TABLE Portfolio (
         user_id INTEGER REFERENCES "User"(user_id),
         stock_id INTEGER REFERENCES Stock(stock_id),
-        total_quantity INTEGER DEFAULT 0,
+        total_quantity INTEGER DEFAULT 0 CHECK (total_quantity >= 0),
         avg_buy_price DECIMAL(10, 2),
         PRIMARY KEY (user_id, stock_id)
     )
@@ -56,7 +62,8 @@ COMMANDS = [
         txn_type VARCHAR(10) NOT NULL,
         quantity INTEGER NOT NULL,
         price DECIMAL(10, 2) NOT NULL,
-        txn_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        txn_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        cash_settled BOOLEAN NOT NULL DEFAULT TRUE -- FALSE for imported trades settled at another broker
     )
     """,
     # BuyLot
@@ -68,7 +75,7 @@ COMMANDS = [
         buy_date DATE NOT NULL,
         buy_price DECIMAL(10, 2) NOT NULL,
         initial_quantity INTEGER NOT NULL,
-        remaining_quantity INTEGER NOT NULL
+        remaining_quantity INTEGER NOT NULL CHECK (remaining_quantity >= 0)
     )
     """,
     # RealizedGain (For Tax Analysis)
@@ -87,6 +94,74 @@ COMMANDS = [
         term VARCHAR(10) NOT NULL -- 'SHORT' or 'LONG'
     )
     """,
+    # TaxSummary (Per-user, per-financial-year realized gain aggregates)
+    """
+    CREATE TABLE TaxSummary (
+        user_id INTEGER REFERENCES "User"(user_id),
+        fy INTEGER NOT NULL, -- starting year of the April-March financial year
+        short_term_gain DECIMAL(15, 2) NOT NULL DEFAULT 0,
+        long_term_gain DECIMAL(15, 2) NOT NULL DEFAULT 0,
+        realized_loss DECIMAL(15, 2) NOT NULL DEFAULT 0,
+        lot_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, fy)
+    )
+    """,
+    # Recommendation (Batch-computed AI insights, one row per user)
+    """
+    CREATE TABLE Recommendation (
+        user_id INTEGER PRIMARY KEY REFERENCES "User"(user_id),
+        status VARCHAR(10) NOT NULL,
+        action VARCHAR(10),
+        sector VARCHAR(50),
+        suggested_stock VARCHAR(150),
+        amount DECIMAL(15, 2),
+        reason TEXT,
+        alternatives TEXT[],
+        last_txn_id INTEGER, -- newest Transaction.txn_id of the user when computed
+        computed_at TIMESTAMP NOT NULL
+    )
+    """,
+    # StrategyProfile / StrategyTarget (Sector allocation targets for recommendations and rebalancing)
+    """
+    CREATE TABLE StrategyProfile (
+        profile_id SERIAL PRIMARY KEY,
+        name VARCHAR(50) UNIQUE NOT NULL,
+        description TEXT,
+        is_default BOOLEAN NOT NULL DEFAULT FALSE
+    )
+    """,
+    "CREATE UNIQUE INDEX idx_strategyprofile_default ON StrategyProfile (is_default) WHERE is_default",
+    """
+    CREATE TABLE StrategyTarget (
+        profile_id INTEGER REFERENCES StrategyProfile(profile_id) ON DELETE CASCADE,
+        sector VARCHAR(50) NOT NULL,
+        target_pct DECIMAL(5, 2) NOT NULL CHECK (target_pct >= 0 AND target_pct <= 100),
+        PRIMARY KEY (profile_id, sector)
+    )
+    """,
+    # Per-sector momentum ranking (leaderboard build and sector picks)
+    "CREATE INDEX idx_stock_sector_momentum ON Stock (sector, momentum_score DESC)",
+    # Open lots in FIFO order (only lots with shares left are indexed)
+    "CREATE INDEX idx_buylot_open ON BuyLot (user_id, stock_id, buy_date, lot_id) WHERE remaining_quantity > 0",
+    # Keyset pagination indexes for history listings
+    "CREATE INDEX idx_transaction_user_date ON Transaction (user_id, txn_date DESC, txn_id DESC)",
+    # Newest txn_id per user (stale check for stored recommendations)
+    "CREATE INDEX idx_transaction_user_txn ON Transaction (user_id, txn_id)",
+    "CREATE INDEX idx_realizedgain_user_date ON RealizedGain (user_id, sell_date DESC, gain_id DESC)",
+    # PriceBar (Daily OHLCV history)
+    """
+    CREATE TABLE PriceBar (
+        stock_id INTEGER REFERENCES Stock(stock_id),
+        bar_date DATE NOT NULL,
+        open DECIMAL(12, 2),
+        high DECIMAL(12, 2),
+        low DECIMAL(12, 2),
+        close DECIMAL(12, 2) NOT NULL,
+        volume BIGINT,
+        PRIMARY KEY (stock_id, bar_date)
+    )
+    """,
+    "CREATE INDEX idx_pricebar_date ON PriceBar (bar_date)",
     # Seeds
     """
     INSERT INTO Stock (symbol, sector, current_price) VALUES
@@ -97,6 +172,18 @@ COMMANDS = [
         ('BHARTIARTL', 'Telecom', 1200.00),
         ('ICICIBANK', 'Finance', 1080.00)
     ON CONFLICT (symbol) DO NOTHING
+    """,
+    """
+    INSERT INTO StrategyProfile (name, description, is_default) VALUES
+        ('Strategic V2', 'Balanced core allocation across the major sectors', TRUE)
+    """,
+    """
+    INSERT INTO StrategyTarget (profile_id, sector, target_pct)
+    SELECT p.profile_id, t.sector, t.target_pct
+    FROM StrategyProfile p,
+         (VALUES ('Technology', 25), ('Finance', 25), ('Healthcare', 15),
+                 ('Energy', 15), ('Consumer', 10), ('Unclassified', 10)) AS t (sector, target_pct)
+    WHERE p.name = 'Strategic V2'
     """
 ]
 
@@ -0,0 +1,60 @@
+import threading
+
+TOP_K = 3   # candidates returned per lookup (best pick + alternatives)
+
+
+class SectorLeaderboard:
+    """
+    Stocks of each sector ranked by momentum_score, built once per market refresh.
+    best() walks a sector's ranking and skips what the user already holds, so a
+    lookup costs O(k + held stocks in that sector) instead of a sector scan in SQL.
+    """
+
+    def __init__(self, ranked):
+        self.ranked = ranked   # sector -> [candidate dicts], best first
+
+    @classmethod
+    def build(cls, cur):
+        cur.execute("""
+            SELECT stock_id, sector, symbol, name, current_price, momentum_score
+            FROM Stock
+            ORDER BY sector, momentum_score DESC NULLS LAST, stock_id
+        """)
+        ranked = {}
+        for stock_id, sector, symbol, name, price, score in cur.fetchall():
+            ranked.setdefault(sector, []).append({
+                "stock_id": stock_id,
+                "symbol": symbol,
+                "name": name,
+                "current_price": float(price),
+                "momentum_score": float(score) if score is not None else None
+            })
+        return cls(ranked)
+
+    def best(self, sector, held=(), k=1):
+        """Top k candidates in sector whose stock_id is not in held."""
+        picks = []
+        for candidate in self.ranked.get(sector, ()):
+            if candidate["stock_id"] in held:
+                continue
+            picks.append(candidate)
+            if len(picks) == k:
+                break
+        return picks
+
+
+_current = None
+_lock = threading.Lock()
+
+def rebuild(cur):
+    """Build a fresh leaderboard and publish it for readers."""
+    global _current
+    board = SectorLeaderboard.build(cur)
+    with _lock:
+        _current = board
+    return board
+
+def current(cur):
+    """The published leaderboard, built on first use if no refresh has run yet."""
+    board = _current
+    return board if board is not None else rebuild(cur)
@@ -0,0 +1,343 @@
+import math
+from bisect import bisect_left, bisect_right
+from datetime import date
+import numpy as np
+from tax_ledger import STCG_RATE, LTCG_RATE, estimate_tax
+
+LONG_TERM_DAYS = 365   # same rule as the FIFO sell ("> 365 days" is long term)
+EXACT_SEARCH_LIMIT = 50000   # candidate selections per stock before falling back to the greedy
+
+LOT_COLUMNS = """
+    b.lot_id, b.stock_id, s.symbol, COALESCE(s.sector, 'Unclassified'),
+    b.buy_date, b.buy_price, b.remaining_quantity, s.current_price
+"""
+
+# Sells consume each stock's lots oldest-first (FIFO), so every selection here is
+# expressed as a quantity per stock and priced by walking that stock's lots in order.
+
+def load_open_lots(cur, user_id, sector=None, stock_id=None):
+    """A user's open lots (optionally one sector or stock) as arrays, in FIFO order per stock."""
+    query = f"""
+        SELECT {LOT_COLUMNS}
+        FROM BuyLot b
+        JOIN Stock s ON b.stock_id = s.stock_id
+        WHERE b.user_id = %s AND b.remaining_quantity > 0
+    """
+    params = [user_id]
+    if sector is not None:
+        query += " AND COALESCE(s.sector, 'Unclassified') = %s"
+        params.append(sector)
+    if stock_id is not None:
+        query += " AND b.stock_id = %s"
+        params.append(stock_id)
+    cur.execute(query + " ORDER BY b.stock_id, b.buy_date, b.lot_id", params)
+    return lots_from_rows(cur.fetchall())
+
+def lots_from_rows(rows, today=None):
+    """
+    Column arrays for lot rows (LOT_COLUMNS order, sorted by stock then FIFO), with
+    per-share unrealized gain, term and estimated tax at the current price.
+    """
+    today = np.datetime64(today or date.today(), 'D')
+    cols = list(zip(*rows)) if rows else [()] * 8
+    lots = {
+        "lot_id": np.array(cols[0], dtype=np.int64),
+        "stock_id": np.array(cols[1], dtype=np.int64),
+        "symbol": list(cols[2]),
+        "sector": list(cols[3]),
+        "buy_date": np.array(cols[4], dtype='datetime64[D]'),
+        "buy_price": np.array(cols[5], dtype=float),
+        "remaining": np.array(cols[6], dtype=np.int64),
+        "price": np.array(cols[7], dtype=float),
+    }
+    lots["long_term"] = (today - lots["buy_date"]).astype(np.int64) > LONG_TERM_DAYS
+    lots["gain"] = lots["price"] - lots["buy_price"]
+    lots["tax"] = lots["gain"] * np.where(lots["long_term"], LTCG_RATE, STCG_RATE)
+    return lots
+
+def _stock_groups(lots):
+    """Index of each lot's stock group and the first lot of every group."""
+    stock_ids = lots["stock_id"]
+    new_group = np.r_[True, stock_ids[1:] != stock_ids[:-1]] if len(stock_ids) else np.zeros(0, dtype=bool)
+    return np.cumsum(new_group) - 1, np.flatnonzero(new_group)
+
+def _take(remaining, group, starts, want):
+    """Shares taken from each lot when selling want[g] shares of each stock group oldest-first."""
+    cum = np.cumsum(remaining)
+    consumed_before = cum - remaining - (cum - remaining)[starts][group]
+    return np.clip(want[group] - consumed_before, 0, remaining)
+
+def fifo_take(lots, quantity_by_stock):
+    """Shares taken from each lot when selling quantity_by_stock[stock_id] oldest-first."""
+    group, starts = _stock_groups(lots)
+    want = np.array([quantity_by_stock.get(int(s), 0) for s in lots["stock_id"][starts]], dtype=np.int64)
+    return _take(lots["remaining"], group, starts, want)
+
+def select_for_amount(lots, amount, detail=False):
+    """
+    Shares to sell, per stock, that raise at least `amount` at current prices with
+    the least estimated tax. The exact search (_exact_for_amount) is used whenever
+    it fits in EXACT_SEARCH_LIMIT; larger holdings fall back to the greedy
+    (_greedy_for_amount), which is close but not always minimal. With detail=True
+    returns (take, exact). When the lots cannot raise `amount` every share is taken.
+    """
+    greedy = _greedy_for_amount(lots, amount)
+    take = _exact_for_amount(lots, amount, greedy)
+    exact = take is not None
+    if not exact:
+        take = greedy
+    return (take, exact) if detail else take
+
+def _pareto(proceeds, short, long):
+    """Indices of the selections no other one beats on proceeds, short gain and long gain together."""
+    order = np.lexsort((-proceeds, long, short))
+    keep = []
+    stair_long, stair_proceeds = [], []   # best proceeds seen so far, increasing with long gain
+    for i, l, p in zip(order.tolist(), long[order].tolist(), proceeds[order].tolist()):
+        pos = bisect_right(stair_long, l)
+        if pos and stair_proceeds[pos - 1] >= p:
+            continue
+        keep.append(i)
+        pos = bisect_left(stair_long, l)
+        end = pos
+        while end < len(stair_long) and stair_proceeds[end] <= p:
+            end += 1
+        stair_long[pos:end] = [l]
+        stair_proceeds[pos:end] = [p]
+    return np.array(keep, dtype=np.int64)
+
+def _exact_for_amount(lots, amount, greedy):
+    """
+    Least-tax selection by dynamic programming over stocks, or None when the search
+    would exceed EXACT_SEARCH_LIMIT. A partial selection is (proceeds, short gain,
+    long gain) with proceeds capped at `amount`; estimated tax never falls when
+    either gain rises, so selections beaten on all three are dropped after every
+    stock. So are selections that can no longer raise `amount` from the stocks
+    left, or whose tax with every remaining loss harvested still exceeds that of
+    the greedy selection: what survives always contains the cheapest selection.
+    """
+    n = len(lots["lot_id"])
+    group, starts = _stock_groups(lots)
+    if n == 0 or amount <= 0:
+        return np.zeros(n, dtype=np.int64)
+
+    # Cumulative (short gain, long gain) of selling the first q shares of each stock
+    curves = []
+    for g, first in enumerate(starts):
+        last = starts[g + 1] if g + 1 < len(starts) else n
+        remaining = lots["remaining"][first:last]
+        per_share = np.repeat(lots["gain"][first:last], remaining)
+        is_long = np.repeat(lots["long_term"][first:last], remaining)
+        curves.append((np.r_[0.0, np.cumsum(np.where(is_long, 0.0, per_share))],
+                       np.r_[0.0, np.cumsum(np.where(is_long, per_share, 0.0))]))
+    price = lots["price"][starts]
+    total = np.bincount(group, weights=lots["remaining"], minlength=len(starts))
+    if (total * price).sum() < amount - 1e-6:
+        return lots["remaining"].copy()
+
+    # Stocks with the largest harvestable losses go first, so the tax bound on what
+    # the stocks still to come can subtract tightens quickly
+    least_short = np.array([c[0].min() for c in curves])
+    least_long = np.array([c[1].min() for c in curves])
+    sequence = np.argsort(least_short * STCG_RATE + least_long * LTCG_RATE, kind="stable")
+    later_proceeds = np.r_[np.cumsum((total * price)[sequence][::-1])[::-1][1:], 0.0]
+    later_short = np.r_[np.cumsum(least_short[sequence][::-1])[::-1][1:], 0.0]
+    later_long = np.r_[np.cumsum(least_long[sequence][::-1])[::-1][1:], 0.0]
+    realized = greedy * lots["gain"]
+    bound = estimate_tax(float(realized[~lots["long_term"]].sum()), float(realized[lots["long_term"]].sum())) + 1e-6
+
+    proceeds, short, long = np.zeros(1), np.zeros(1), np.zeros(1)
+    steps = []   # per stock: (parent selection, shares) of every surviving selection
+    for step, g in enumerate(sequence):
+        q_short, q_long = curves[g]
+        q = np.arange(len(q_short))
+        q_proceeds = np.minimum(q * price[g], amount)
+        options = _pareto(q_proceeds, q_short, q_long)
+        if len(proceeds) * len(options) > EXACT_SEARCH_LIMIT:
+            return None
+
+        parent = np.repeat(np.arange(len(proceeds)), len(options))
+        shares = np.tile(q[options], len(proceeds))
+        proceeds = np.minimum(proceeds[parent] + q_proceeds[shares], amount)
+        short = short[parent] + q_short[shares]
+        long = long[parent] + q_long[shares]
+        best_case = (np.maximum(short + later_short[step], 0) * STCG_RATE
+                     + np.maximum(long + later_long[step], 0) * LTCG_RATE)
+        alive = np.flatnonzero((proceeds + later_proceeds[step] >= amount - 1e-6) & (best_case <= bound))
+        keep = alive[_pareto(proceeds[alive], short[alive], long[alive])]
+        proceeds, short, long = proceeds[keep], short[keep], long[keep]
+        steps.append((parent[keep], shares[keep]))
+
+    feasible = proceeds >= amount - 1e-6
+    tax = np.maximum(short, 0) * STCG_RATE + np.maximum(long, 0) * LTCG_RATE
+    best = int(np.argmin(np.where(feasible, tax, np.inf)))
+    want = np.zeros(len(starts), dtype=np.int64)
+    for step in range(len(sequence) - 1, -1, -1):
+        parent, shares = steps[step]
+        want[sequence[step]] = shares[best]
+        best = int(parent[best])
+    return _take(lots["remaining"], group, starts, want)
+
+def _greedy_for_amount(lots, amount):
+    """
+    Approximate least-tax selection for holdings too large for the exact search.
+
+    Within a stock the FIFO sequence fixes which lots a sale consumes, so each
+    stock's lot sequence is reduced to its lower convex hull of cumulative tax: a
+    few segments with increasing tax per share. Across stocks, whole segments are
+    taken greedily by tax per rupee raised (one argsort and a cumulative sum), the
+    remainder is raised by the single-stock extension with the lowest estimate_tax,
+    and loss segments left over are harvested while they still lower it. The greedy
+    step treats tax as linear in gains and shares as divisible, so the result can
+    cost somewhat more than the minimum.
+    """
+    n = len(lots["lot_id"])
+    group, starts = _stock_groups(lots)
+    remaining = lots["remaining"]
+    if n == 0 or amount <= 0:
+        return np.zeros(n, dtype=np.int64)
+
+    # 1. Per-stock hull of (shares, tax) along FIFO order, tracking each segment's
+    #    short and long term gain so the clamped estimate_tax can be evaluated
+    group_l = group.tolist()
+    shares_l = remaining.tolist()
+    gain_l = (lots["gain"] * remaining).tolist()
+    long_l = lots["long_term"].tolist()
+    segments = []   # [group, shares, tax, short gain, long gain]
+    stack = []
+    for j in range(n + 1):
+        if stack and (j == n or group_l[j] != stack[-1][0]):
+            segments.extend(stack)
+            stack = []
+        if j == n:
+            break
+        gain = gain_l[j]
+        if long_l[j]:
+            stack.append([group_l[j], shares_l[j], gain * LTCG_RATE, 0.0, gain])
+        else:
+            stack.append([group_l[j], shares_l[j], gain * STCG_RATE, gain, 0.0])
+        while len(stack) > 1 and stack[-2][2] * stack[-1][1] >= stack[-1][2] * stack[-2][1]:
+            top = stack.pop()
+            for c in (1, 2, 3, 4):
+                stack[-1][c] += top[c]
+
+    seg = np.array(segments)
+    seg_group = seg[:, 0].astype(np.int64)
+    seg_shares = seg[:, 1].astype(np.int64)
+    price = lots["price"][starts]
+    seg_value = seg_shares * price[seg_group]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(seg_value > 0, seg[:, 2] / seg_value, np.inf)
+
+    # 2. Whole segments, cheapest tax per rupee first, until the next one covers the rest
+    order = np.argsort(ratio, kind="stable")
+    raised = np.cumsum(seg_value[order])
+    k = int(np.searchsorted(raised, amount))
+    taken = np.zeros(len(seg), dtype=bool)
+    taken[order[:k]] = True
+    want = np.bincount(seg_group[taken], weights=seg_shares[taken], minlength=len(starts)).astype(np.int64)
+
+    # 3. Raise the remainder from one stock: either just enough shares, or its whole
+    #    next segment (which may cost less tax when it ends on a loss lot)
+    blocked = set()
+    if k < len(order):
+        needed = amount - (raised[k - 1] if k else 0.0)
+        total = np.bincount(group, weights=remaining, minlength=len(starts)).astype(np.int64)
+        just_enough = want + np.ceil(needed / price).astype(np.int64)
+        open_segs = np.flatnonzero(~taken)
+        first_open, idx = np.unique(seg_group[open_segs], return_index=True)
+        next_seg = np.zeros(len(starts), dtype=np.int64)
+        next_seg[first_open] = seg_shares[open_segs[idx]]
+        to_segment_end = want + next_seg
+
+        # Estimated tax of the whole selection if stock g alone is extended to target[g]
+        base = _take(remaining, group, starts, want)
+        base_short = float((base * lots["gain"])[~lots["long_term"]].sum())
+        base_long = float((base * lots["gain"])[lots["long_term"]].sum())
+        def tax_if_extended(target):
+            extra = (_take(remaining, group, starts, target) - base) * lots["gain"]
+            short = base_short + np.bincount(group, weights=np.where(lots["long_term"], 0.0, extra), minlength=len(starts))
+            long = base_long + np.bincount(group, weights=np.where(lots["long_term"], extra, 0.0), minlength=len(starts))
+            return np.maximum(short, 0) * STCG_RATE + np.maximum(long, 0) * LTCG_RATE
+        cost = np.vstack([np.where(just_enough <= total, tax_if_extended(just_enough), np.inf),
+                          np.where(next_seg * price >= needed, tax_if_extended(to_segment_end), np.inf)])
+        option, g = np.unravel_index(np.argmin(cost), cost.shape)
+        if np.isfinite(cost[option, g]):
+            if option == 0:
+                want[g] = just_enough[g]
+                blocked.add(g)
+            else:
+                want[g] = to_segment_end[g]
+                taken[open_segs[idx[np.searchsorted(first_open, g)]]] = True
+
+    # 4. Harvest leftover loss segments while they lower the estimated tax. A
+    #    stock's later segments are only usable once its earlier ones are sold.
+    take = _take(remaining, group, starts, want)
+    short = ~lots["long_term"]
+    short_gain = float((take * lots["gain"])[short].sum())
+    long_gain = float((take * lots["gain"])[~short].sum())
+    for s in order:
+        if ratio[s] >= 0:
+            break
+        g = seg_group[s]
+        if taken[s] or g in blocked:
+            continue
+        new_short, new_long = short_gain + seg[s, 3], long_gain + seg[s, 4]
+        if estimate_tax(new_short, new_long) < estimate_tax(short_gain, long_gain):
+            want[g] += seg_shares[s]
+            short_gain, long_gain = new_short, new_long
+        else:
+            blocked.add(g)
+    return _take(remaining, group, starts, want)
+
+def summarize(lots, take, amount=None):
+    """
+    Sell orders, lots consumed, realized gains and estimated tax for a selection.
+    Given the amount it was meant to raise, also reports the shortfall (0 when covered).
+    """
+    short = ~lots["long_term"]
+    realized = take * lots["gain"]
+    stcg = float(realized[short].sum())
+    ltcg = float(realized[~short].sum())
+
+    orders = {}
+    consumed = []
+    for i in np.flatnonzero(take):
+        qty = int(take[i])
+        stock_id = int(lots["stock_id"][i])
+        order = orders.get(stock_id)
+        if order is None:
+            order = orders[stock_id] = {
+                "stock_id": stock_id,
+                "symbol": lots["symbol"][i],
+                "sector": lots["sector"][i],
+                "quantity": 0,
+                "price": round(float(lots["price"][i]), 2),
+                "proceeds": 0.0
+            }
+        order["quantity"] += qty
+        order["proceeds"] = round(order["quantity"] * order["price"], 2)
+        consumed.append({
+            "lot_id": int(lots["lot_id"][i]),
+            "symbol": lots["symbol"][i],
+            "buy_date": str(lots["buy_date"][i]),
+            "buy_price": round(float(lots["buy_price"][i]), 2),
+            "quantity": qty,
+            "gain": round(float(realized[i]), 2),
+            "term": "LONG" if lots["long_term"][i] else "SHORT"
+        })
+
+    proceeds = float((take * lots["price"]).sum())
+    summary = {
+        "orders": list(orders.values()),
+        "lots": consumed,
+        "proceeds": round(proceeds, 2),
+        "short_term_gain": round(stcg, 2),
+        "long_term_gain": round(ltcg, 2),
+        "realized_loss": round(float(realized[realized < 0].sum()), 2),
+        "estimated_tax": round(estimate_tax(stcg, ltcg), 2),
+        "long_term_only": bool(consumed) and bool(lots["long_term"][take > 0].all())
+    }
+    if amount is not None:
+        summary["shortfall"] = round(max(amount - proceeds, 0.0), 2)
+    return summary
@@ -0,0 +1,159 @@
+import threading
+import time
+from datetime import datetime
+import MarketData
+import recommendation_engine
+
+# --- SCHEDULER CONFIG ---
+REFRESH_INTERVAL = 60   # seconds between background refreshes
+INITIAL_DELAY = 2       # seconds after start before the first refresh
+RECOMMENDATION_INTERVAL = 300   # minimum seconds between all-user recommendation batches
+MANUAL_MIN_AGE = 10     # a manual refresh reuses a snapshot younger than this
+
+
+class RefreshScheduler:
+    """
+    Runs MarketData.update_all_prices() on a fixed cadence in a background thread.
+    Concurrent refresh requests are coalesced into the single in-flight job
+    (single-flight), and readers get the last snapshot instead of triggering work.
+    """
+
+    def __init__(self, refresh_fn, interval=REFRESH_INTERVAL, initial_delay=INITIAL_DELAY):
+        self.refresh_fn = refresh_fn
+        self.interval = interval
+        self.initial_delay = initial_delay
+
+        self._lock = threading.Lock()
+        self._inflight = None        # threading.Event of the running job, if any
+        self._last_result = None
+        self._last_finished = None   # time.time() of the last completed refresh
+        self._version = 0            # bumped after every successful refresh
+
+        self._thread = None
+        self._stop = threading.Event()
+        self._jobs = []              # jobs started after successful refreshes (see after_refresh)
+
+    def after_refresh(self, name, fn, min_interval=0):
+        """
+        Register a job to start on its own thread after a successful refresh, once
+        the new prices are published. A job is skipped while its previous run is
+        still going or if it started less than min_interval seconds ago.
+        """
+        self._jobs.append({"name": name, "fn": fn, "min_interval": min_interval,
+                           "running": False, "started": None, "result": None})
+
+    # --- lifecycle ---
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="market-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self._stop.wait(self.initial_delay):
+            return
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.refresh()
+            elapsed = time.monotonic() - started
+            if self._stop.wait(max(self.interval - elapsed, 0)):
+                return
+
+    # --- single-flight refresh ---
+    def refresh(self, min_age=None):
+        """
+        Run a refresh, or wait for the one already running and share its result.
+        With min_age, a result younger than that many seconds is returned as is.
+        """
+        with self._lock:
+            event = self._inflight
+            if (event is None and min_age is not None and self._last_finished is not None
+                    and time.time() - self._last_finished < min_age):
+                return self._last_result
+            leader = event is None
+            if leader:
+                event = self._inflight = threading.Event()
+
+        if not leader:
+            event.wait()
+            return self._last_result
+
+        try:
+            result = self.refresh_fn()
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+
+        with self._lock:
+            self._last_result = result
+            self._last_finished = time.time()
+            if result.get("status") == "success":
+                self._version += 1
+            self._inflight = None
+        event.set()
+
+        if result.get("status") == "success":
+            self._start_jobs()
+        return result
+
+    # --- post-refresh jobs (off the refresh path) ---
+    def _start_jobs(self):
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for job in self._jobs:
+                if job["running"] or (job["started"] is not None and now - job["started"] < job["min_interval"]):
+                    continue
+                job["running"], job["started"] = True, now
+                due.append(job)
+        for job in due:
+            threading.Thread(target=self._run_job, args=(job,), name=f"job-{job['name']}", daemon=True).start()
+
+    def _run_job(self, job):
+        try:
+            result = job["fn"]()
+        except Exception as e:
+            result = {"status": "error", "message": str(e)}
+        with self._lock:
+            job["result"] = result
+            job["running"] = False
+
+    def request_refresh(self, min_age=MANUAL_MIN_AGE):
+        """
+        Manual refresh: joins the in-flight run if there is one, reuses a snapshot
+        younger than min_age seconds, and otherwise refreshes now. Returns the snapshot.
+        """
+        self.refresh(min_age)
+        return self.snapshot()
+
+    # --- readers ---
+    @property
+    def version(self):
+        return self._version
+
+    def snapshot(self):
+        with self._lock:
+            result = dict(self._last_result) if self._last_result else {"status": "pending"}
+            finished = self._last_finished
+            result["in_flight"] = self._inflight is not None
+            result["version"] = self._version
+            if self._jobs:
+                result["jobs"] = {job["name"]: dict(job["result"] or {}, running=job["running"])
+                                  for job in self._jobs}
+        result["interval_seconds"] = self.interval
+        if finished is not None:
+            result["refreshed_at"] = datetime.fromtimestamp(finished).isoformat(timespec='seconds')
+            result["age_seconds"] = round(time.time() - finished, 1)
+        else:
+            result["refreshed_at"] = None
+            result["age_seconds"] = None
+        return result
+
+
+scheduler = RefreshScheduler(MarketData.update_all_prices)
+scheduler.after_refresh("recommendations", recommendation_engine.recompute_all, RECOMMENDATION_INTERVAL)
@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import deque
+
+# --- METRICS CONFIG ---
+METRICS_CONFIG = {
+    "slow_request_ms": 1000,     # requests slower than this are logged with their queries
+    "slow_log_size": 50,         # slow requests kept for /api/admin/slow_requests
+    "max_logged_queries": 100    # queries remembered per request for the slow log
+}
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250)
+FETCH_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets, labels=()):
+        self.name, self.help, self.buckets, self.labels = name, help, buckets, labels
+        self._values = {}    # label values -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with _lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            else:
+                entry[len(self.buckets)] += 1
+            entry[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, entry):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+                count = cumulative + entry[len(self.buckets)]
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, key)} {entry[-1]}")
+                lines.append(f"{self.name}_count{_labels(self.labels, key)} {count}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route.",
+                            REQUEST_BUCKETS, ("route", "method"))
+REQUESTS = Counter("http_requests_total", "Requests by route and status code.", ("route", "method", "status"))
+REQUEST_QUERIES = Histogram("http_request_db_queries", "Database queries per request (high counts point at N+1 loops).",
+                            QUERY_COUNT_BUCKETS, ("route", "method"))
+DB_QUERIES = Counter("db_queries_total", "Database statements executed, by route (background for scheduler jobs).", ("route",))
+DB_SECONDS = Counter("db_query_seconds_total", "Time spent in database statements, by route.", ("route",))
+YF_DOWNLOAD_SECONDS = Histogram("yfinance_download_seconds", "Duration of each yfinance download attempt.",
+                                FETCH_BUCKETS, ("result",))
+REFRESH_FETCH_SECONDS = Histogram("price_refresh_fetch_seconds", "Time update_all_prices spends fetching bars from yfinance.",
+                                  FETCH_BUCKETS)
+METRICS = (REQUEST_SECONDS, REQUESTS, REQUEST_QUERIES, DB_QUERIES, DB_SECONDS, YF_DOWNLOAD_SECONDS, REFRESH_FETCH_SECONDS)
+
+slow_requests = deque(maxlen=METRICS_CONFIG["slow_log_size"])
+
+
+# --- PER-REQUEST COLLECTION ---
+# Each request thread collects its own query count, time and statements; queries
+# run outside a request (scheduler jobs, streamed bodies) count as "background".
+_local = threading.local()
+
+def start_request():
+    _local.request = {"started": time.perf_counter(), "queries": 0, "db_seconds": 0.0, "log": []}
+
+def record_query(query, elapsed):
+    req = getattr(_local, "request", None)
+    if req is None:
+        DB_QUERIES.inc(route="background")
+        DB_SECONDS.inc(elapsed, route="background")
+        return
+    req["queries"] += 1
+    req["db_seconds"] += elapsed
+    if len(req["log"]) < METRICS_CONFIG["max_logged_queries"]:
+        req["log"].append((query, elapsed))
+
+def finish_request(route, method, status):
+    req = getattr(_local, "request", None)
+    _local.request = None
+    if req is None:
+        return
+    elapsed = time.perf_counter() - req["started"]
+    REQUEST_SECONDS.observe(elapsed, route=route, method=method)
+    REQUESTS.inc(route=route, method=method, status=status)
+    REQUEST_QUERIES.observe(req["queries"], route=route, method=method)
+    DB_QUERIES.inc(req["queries"], route=route)
+    DB_SECONDS.inc(req["db_seconds"], route=route)
+
+    if elapsed * 1000 >= METRICS_CONFIG["slow_request_ms"]:
+        entry = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "route": route,
+            "method": method,
+            "status": status,
+            "ms": round(elapsed * 1000, 1),
+            "queries": req["queries"],
+            "db_ms": round(req["db_seconds"] * 1000, 1),
+            "statements": [{"ms": round(t * 1000, 2), "sql": _statement_text(q)} for q, t in req["log"]]
+        }
+        slow_requests.append(entry)
+        print(f"SLOW {method} {route} {entry['ms']}ms: {entry['queries']} queries, {entry['db_ms']}ms in the database")
+
+
+def _statement_text(query, limit=500):
+    if isinstance(query, bytes):
+        query = query.decode(errors="replace")
+    text = " ".join(str(query).split())
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+# --- CURSOR INSTRUMENTATION ---
+class _TimedCursorMixin:
+    """Times execute/executemany/copy_expert on top of any psycopg2 cursor class."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+_timed_classes = {}
+
+def timed_cursor(factory):
+    """Subclass of the cursor class `factory` (cached) whose statements are recorded."""
+    cls = _timed_classes.get(factory)
+    if cls is None:
+        cls = type(f"Timed{factory.__name__}", (_TimedCursorMixin, factory), {})
+        _timed_classes[factory] = cls
+    return cls
+
+
+# --- EXPOSITION ---
+def render(pool=None):
+    """Every metric in Prometheus text format, plus the connection pool's when given."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    if pool is not None:
+        lines += _render_pool(pool)
+    return "\n".join(lines) + "\n"
+
+def _render_pool(pool):
+    lines = []
+    for key in ("size", "in_use", "idle", "waiting", "max_connections"):
+        lines += [f"# TYPE db_pool_{key} gauge", f"db_pool_{key} {pool[key]}"]
+    for key in ("checkouts", "timeouts", "created", "discarded", "recycled"):
+        lines += [f"# TYPE db_pool_{key}_total counter", f"db_pool_{key}_total {pool[key]}"]
+    latency = pool["checkout_latency"]
+    lines += ["# HELP db_pool_checkout_seconds Time spent waiting for a pooled connection.",
+              "# TYPE db_pool_checkout_seconds histogram"]
+    for bound, count in latency["buckets"].items():
+        lines.append(f'db_pool_checkout_seconds_bucket{{le="{bound}"}} {count}')
+    lines += [f"db_pool_checkout_seconds_sum {latency['sum']}", f"db_pool_checkout_seconds_count {latency['count']}"]
+    return lines
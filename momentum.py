@@ -0,0 +1,149 @@
+import threading
+import numpy as np
+import pandas as pd
+from psycopg2 import extras
+from db import get_connection
+
+# --- MOMENTUM CONFIG ---
+WINDOWS = (20, 60, 120)   # trading-day lookbacks for returns
+VOL_WINDOW = 60           # trading days of daily returns for realized volatility
+MIN_BARS = 21             # a stock needs at least this many closes to be scored
+
+def load_close_matrix(cur, since=None, bars=None):
+    """
+    Stored closes as a (bar_date x stock_id) float matrix. Either everything from
+    `since` (inclusive) or roughly the last `bars` trading days.
+    """
+    if since is None and bars is not None:
+        # ~5 trading days per 7 calendar days, plus slack for holidays
+        cur.execute("SELECT CURRENT_DATE - %s::int", (int(bars * 7 / 5) + 14,))
+        since = cur.fetchone()[0]
+    if since is None:
+        cur.execute("SELECT stock_id, bar_date, close FROM PriceBar")
+    else:
+        cur.execute("SELECT stock_id, bar_date, close FROM PriceBar WHERE bar_date >= %s", (since,))
+    rows = cur.fetchall()
+    if not rows:
+        return pd.DataFrame(dtype=float)
+    frame = pd.DataFrame(rows, columns=["stock_id", "bar_date", "close"])
+    frame["close"] = frame["close"].astype(float)
+    return frame.pivot(index="bar_date", columns="stock_id", values="close").sort_index()
+
+def compute_momentum(closes, windows=WINDOWS, vol_window=VOL_WINDOW, min_bars=MIN_BARS):
+    """
+    Volatility-adjusted multi-window momentum for every column of a
+    (date x stock) close matrix in one vectorized pass.
+
+    For each window w the raw return P[t] / P[t-w] - 1 is divided by the
+    realized volatility scaled to that horizon (daily vol * sqrt(w)).
+    The per-window scores are averaged and turned into a 0-100 cross-sectional
+    percentile rank. Stocks with too little history get NaN.
+    """
+    if closes is None or closes.empty:
+        return pd.Series(dtype=float)
+
+    arr = closes.ffill().to_numpy(dtype=float)
+    n_rows = arr.shape[0]
+    last = arr[-1]
+
+    # Realized volatility from daily log returns over the trailing window
+    tail = arr[-(vol_window + 1):]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_ret = np.diff(np.log(tail), axis=0)
+    counts = np.sum(~np.isnan(log_ret), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.nansum(log_ret, axis=0) / counts
+        var = np.nansum((log_ret - mean) ** 2, axis=0) / (counts - 1)
+    daily_vol = np.where((counts >= 2) & (var > 0), np.sqrt(np.where(var > 0, var, 0.0)), np.nan)
+
+    # Bars since each stock's first close (ffill leaves only leading gaps)
+    history = np.sum(~np.isnan(arr), axis=0)
+    cols = np.arange(arr.shape[1])
+
+    scores = []
+    for w in windows:
+        # Per stock: a short history uses its longest available lookback instead of dropping out
+        lookback = np.minimum(w, history - 1)
+        base = arr[np.clip(n_rows - 1 - lookback, 0, n_rows - 1), cols]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ret = last / base - 1
+            scores.append(np.where(lookback >= 1, ret / (daily_vol * np.sqrt(np.maximum(lookback, 1))), np.nan))
+
+    stacked = np.vstack(scores)
+    scored = np.sum(~np.isnan(stacked), axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        composite = np.nansum(stacked, axis=0) / scored
+    composite[history < min_bars] = np.nan
+
+    score = pd.Series(composite, index=closes.columns)
+    return (score.rank(pct=True) * 100).round(2)
+
+def write_scores(cur, scores):
+    """Persist momentum scores with one UPDATE ... FROM (VALUES ...) round-trip."""
+    rows = [(int(sid), float(s)) for sid, s in scores.dropna().items()]
+    if not rows:
+        return 0
+    extras.execute_values(cur, """
+        UPDATE Stock AS s SET momentum_score = v.momentum_score
+        FROM (VALUES %s) AS v(stock_id, momentum_score)
+        WHERE s.stock_id = v.stock_id
+    """, rows, template="(%s, %s::numeric)", page_size=len(rows))
+    return len(rows)
+
+
+class MomentumEngine:
+    """
+    Keeps the trailing close matrix in memory so a refresh only reloads bars
+    from the newest cached date on, instead of the whole window.
+    """
+
+    def __init__(self, windows=WINDOWS, vol_window=VOL_WINDOW):
+        self.windows = windows
+        self.vol_window = vol_window
+        self.depth = max(max(windows), vol_window) + 1
+        self.closes = None
+        self._lock = threading.Lock()
+
+    def _load(self, cur):
+        if self.closes is None or self.closes.empty:
+            return load_close_matrix(cur, bars=self.depth)
+        newest = self.closes.index[-1]
+        fresh = load_close_matrix(cur, since=newest)
+        if fresh.empty:
+            return self.closes
+        if not set(fresh.columns) <= set(self.closes.columns):
+            # New symbols have no cached history; rebuild the window
+            return load_close_matrix(cur, bars=self.depth)
+        older = self.closes[self.closes.index < newest]
+        return pd.concat([older, fresh]).tail(self.depth)
+
+    def scores(self, cur):
+        with self._lock:
+            self.closes = self._load(cur)
+            return compute_momentum(self.closes, self.windows, self.vol_window)
+
+    def reset(self):
+        with self._lock:
+            self.closes = None
+
+
+engine = MomentumEngine()
+
+def recompute_all():
+    """Full recompute from stored history (e.g. after a backfill)."""
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        engine.reset()
+        updated = write_scores(cur, engine.scores(cur))
+        conn.commit()
+        return updated
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    print(f"Momentum scores updated for {recompute_all()} stocks.")
@@ -0,0 +1,165 @@
+import threading
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+
+
+def replay(txns, closes, positions, cash, last_prices, fallback_prices):
+    """
+    Daily equity curve over the dates of `closes` (bar_date x stock_id).
+
+    Starts from the holdings `positions` {stock_id: qty}, `cash` and `last_prices`
+    {stock_id: close} as of the day before the first date. txns are
+    (stock_id, day, txn_type, quantity, price, cash_settled); trades that were not
+    settled in this account's cash (imports) move shares but not cash, so they show
+    up as transfers in or out rather than as spending. Each lands on the first trading
+    date on or after its day, and ones after the last date are left for later.
+    Positions and cash are cumulative sums of a (dates x stocks) trade matrix, so
+    the whole history is one matrix product with the forward-filled prices.
+
+    Returns (frame with holdings_value, cash, nav per date; state per date as
+    (positions matrix, cash vector, price matrix, stock_ids)).
+    """
+    stocks = sorted(set(closes.columns) | set(positions) | {t[0] for t in txns})
+    dates = closes.index
+    col_of = {sid: j for j, sid in enumerate(stocks)}
+
+    # Prices: seed row of last known closes, forward fill, then back-fill stocks
+    # that have no bar yet and fall back to the current price for stocks with none
+    seed = pd.DataFrame([[last_prices.get(sid, np.nan) for sid in stocks]], columns=stocks)
+    prices = pd.concat([seed, closes.reindex(columns=stocks).reset_index(drop=True)], ignore_index=True)
+    prices = prices.ffill().bfill().iloc[1:]
+    prices = prices.fillna(pd.Series(fallback_prices, dtype=float)).fillna(0.0).to_numpy(dtype=float)
+
+    delta = np.zeros((len(dates), len(stocks)))
+    flow = np.zeros(len(dates))
+    if txns:
+        days = np.array([t[1] for t in txns], dtype='datetime64[D]')
+        row = np.searchsorted(dates.to_numpy(dtype='datetime64[D]'), days)
+        col = np.array([col_of[t[0]] for t in txns])
+        signed = np.array([t[3] if t[2] == 'BUY' else -t[3] for t in txns], dtype=float)
+        amount = signed * np.array([float(t[4]) if t[5] else 0.0 for t in txns])
+        keep = row < len(dates)
+        np.add.at(delta, (row[keep], col[keep]), signed[keep])
+        np.add.at(flow, row[keep], -amount[keep])
+
+    start = np.array([positions.get(sid, 0) for sid in stocks], dtype=float)
+    held = start + np.cumsum(delta, axis=0)
+    cash_series = cash + np.cumsum(flow)
+    holdings_value = np.einsum('ij,ij->i', held, prices)
+
+    frame = pd.DataFrame({
+        "holdings_value": holdings_value,
+        "cash": cash_series,
+        "nav": holdings_value + cash_series
+    }, index=dates)
+    return frame, (held, cash_series, prices, stocks)
+
+
+class NavEngine:
+    """
+    Per-user equity curves kept in memory. The first request replays every
+    transaction; later ones only replay bars and trades after the last settled
+    day (the newest day is recomputed, since its bar is overwritten while the
+    market is open). A trade dated on or before the settled day forces a rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}   # user_id -> {curve, checkpoint, last_txn_id}
+
+    def curve(self, cur, user_id):
+        """Daily (holdings_value, cash, nav) frame for a user, or None if the user does not exist."""
+        cur.execute("""
+            SELECT u.cash_balance, t.last_txn_id, t.net_flow, t.first_day
+            FROM "User" u
+            CROSS JOIN LATERAL (
+                SELECT MAX(txn_id) AS last_txn_id,
+                       COALESCE(SUM(CASE WHEN txn_type = 'SELL' THEN quantity * price ELSE -quantity * price END)
+                                FILTER (WHERE cash_settled), 0) AS net_flow,
+                       MIN(txn_date)::date AS first_day
+                FROM Transaction WHERE user_id = u.user_id
+            ) t
+            WHERE u.user_id = %s
+        """, (user_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        cash_balance, last_txn_id, net_flow, first_day = row
+        if last_txn_id is None:
+            return pd.DataFrame(columns=["holdings_value", "cash", "nav"], dtype=float)
+
+        with self._lock:
+            entry = self._cache.get(user_id)
+        if entry is not None and last_txn_id != entry["last_txn_id"]:
+            # Trades added since: fine if they all fall after the settled day
+            cur.execute("SELECT MIN(txn_date)::date FROM Transaction WHERE user_id = %s AND txn_id > %s",
+                        (user_id, entry["last_txn_id"]))
+            earliest = cur.fetchone()[0]
+            if earliest is None or earliest <= entry["checkpoint"]["day"]:
+                entry = None
+
+        if entry is None:
+            # Opening cash is today's balance with every cash-settled trade undone
+            checkpoint = {"day": first_day - timedelta(days=1), "positions": {}, "prices": {},
+                          "cash": float(cash_balance) - float(net_flow)}
+            curve = None
+        else:
+            checkpoint, curve = entry["checkpoint"], entry["curve"]
+
+        since = checkpoint["day"] + timedelta(days=1)
+        new_curve, checkpoint = self._extend(cur, user_id, checkpoint, since)
+        if curve is not None:
+            new_curve = pd.concat([curve[curve.index < since], new_curve])
+
+        with self._lock:
+            self._cache[user_id] = {"curve": new_curve, "checkpoint": checkpoint, "last_txn_id": last_txn_id}
+        return new_curve
+
+    def _extend(self, cur, user_id, checkpoint, since):
+        cur.execute("""
+            SELECT stock_id, txn_date::date, txn_type, quantity, price, cash_settled
+            FROM Transaction
+            WHERE user_id = %s AND txn_date >= %s
+            ORDER BY txn_date, txn_id
+        """, (user_id, since))
+        txns = cur.fetchall()
+        stock_ids = sorted(set(checkpoint["positions"]) | {t[0] for t in txns})
+        if not stock_ids:
+            return pd.DataFrame(columns=["holdings_value", "cash", "nav"], dtype=float), checkpoint
+
+        cur.execute("""
+            SELECT stock_id, bar_date, close FROM PriceBar
+            WHERE stock_id = ANY(%s) AND bar_date >= %s
+        """, (stock_ids, since))
+        bars = pd.DataFrame(cur.fetchall(), columns=["stock_id", "bar_date", "close"])
+        if bars.empty:
+            return pd.DataFrame(columns=["holdings_value", "cash", "nav"], dtype=float), checkpoint
+        bars["close"] = bars["close"].astype(float)
+        closes = bars.pivot(index="bar_date", columns="stock_id", values="close").sort_index()
+
+        cur.execute("SELECT stock_id, current_price FROM Stock WHERE stock_id = ANY(%s)", (stock_ids,))
+        fallback = {sid: float(price) for sid, price in cur.fetchall()}
+
+        frame, (held, cash_series, prices, stocks) = replay(
+            txns, closes, checkpoint["positions"], checkpoint["cash"], checkpoint["prices"], fallback)
+
+        # Settle everything but the newest day, which may still change
+        if len(frame) >= 2:
+            checkpoint = {
+                "day": frame.index[-2],
+                "positions": {sid: int(q) for sid, q in zip(stocks, held[-2]) if q},
+                "prices": dict(zip(stocks, prices[-2].tolist())),
+                "cash": float(cash_series[-2])
+            }
+        return frame, checkpoint
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
+
+
+engine = NavEngine()
@@ -92,19 +92,18 @@ def populate_db():
                 final_price = price + random.uniform(-price*0.02, price*0.02) # 2% variation
 
                 if symbol not in existing_symbols:
-                    momentum = random.uniform(30.0, 95.0)
+                    # Neutral momentum until momentum.py scores it from stored price history
                     cur.execute("""
                         INSERT INTO Stock (symbol, name, sector, current_price, momentum_score)
                         VALUES (%s, %s, %s, %s, %s)
-                    """, (symbol, name, sector, round(final_price, 2), round(momentum, 2)))
+                    """, (symbol, name, sector, round(final_price, 2), 50.0))
                     count += 1
                 else:
-                    # Update price, name and momentum for existing symbols
-                    momentum = random.uniform(30.0, 95.0)
+                    # Update price and name for existing symbols (momentum comes from price history)
                     cur.execute("""
-                        UPDATE Stock SET name = %s, current_price = %s, sector = %s, momentum_score = %s
+                        UPDATE Stock SET name = %s, current_price = %s, sector = %s
                         WHERE symbol = %s
-                    """, (name, round(final_price, 2), sector, round(momentum, 2), symbol))
+                    """, (name, round(final_price, 2), sector, symbol))
         
         conn.commit()
         print(f"Successfully processed database. Added {count} new stocks.")
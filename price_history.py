@@ -0,0 +1,94 @@
+import pandas as pd
+from psycopg2 import extras
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS PriceBar (
+        stock_id INTEGER REFERENCES Stock(stock_id),
+        bar_date DATE NOT NULL,
+        open DECIMAL(12, 2),
+        high DECIMAL(12, 2),
+        low DECIMAL(12, 2),
+        close DECIMAL(12, 2) NOT NULL,
+        volume BIGINT,
+        PRIMARY KEY (stock_id, bar_date)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_pricebar_date ON PriceBar (bar_date)"
+]
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+def ensure_schema(cur):
+    for cmd in SCHEMA:
+        cur.execute(cmd)
+
+def bars_from_frame(all_data, symbol_to_id):
+    """
+    Flatten a (date x (ticker, field)) yfinance frame into PriceBar rows
+    (stock_id, bar_date, open, high, low, close, volume). Bars without a close are dropped.
+    """
+    if all_data is None or all_data.empty:
+        return []
+    long = all_data.stack(level=0)
+    long = long.reindex(columns=FIELDS)
+    long = long[long["Close"].notna()]
+    if long.empty:
+        return []
+
+    dates = long.index.get_level_values(0)
+    tickers = long.index.get_level_values(1)
+    stock_ids = pd.Series(tickers).map(symbol_to_id).to_numpy()
+    keep = pd.notna(stock_ids)
+
+    prices = long[["Open", "High", "Low", "Close"]].round(2).astype(object)
+    prices = prices.where(prices.notna(), None).to_numpy()[keep]
+    volume = long["Volume"].astype(object)
+    volume = volume.where(volume.notna(), None).to_numpy()[keep]
+
+    return [
+        (int(sid), d.date(), o, h, l, c, int(v) if v is not None else None)
+        for sid, d, (o, h, l, c), v in zip(stock_ids[keep], dates[keep], prices, volume)
+    ]
+
+def write_bars(cur, rows, page_size=5000):
+    """Upsert PriceBar rows in bulk; the latest bar is overwritten while the session is open."""
+    if not rows:
+        return 0
+    extras.execute_values(cur, """
+        INSERT INTO PriceBar (stock_id, bar_date, open, high, low, close, volume)
+        VALUES %s
+        ON CONFLICT (stock_id, bar_date) DO UPDATE SET
+            open = EXCLUDED.open, high = EXCLUDED.high, low = EXCLUDED.low,
+            close = EXCLUDED.close, volume = EXCLUDED.volume
+    """, rows, page_size=page_size)
+    return len(rows)
+
+def last_bar_dates(cur):
+    """Latest stored bar_date per stock (index lookups, not a scan of PriceBar)."""
+    cur.execute("""
+        SELECT s.stock_id, (SELECT MAX(bar_date) FROM PriceBar b WHERE b.stock_id = s.stock_id)
+        FROM Stock s
+    """)
+    return {stock_id: last for stock_id, last in cur.fetchall() if last is not None}
+
+def recent_closes(cur, n=2):
+    """
+    Last n stored closes per stock as a (bar_date x stock_id) frame, read through
+    the (stock_id, bar_date) primary key rather than a full table scan.
+    """
+    cur.execute("""
+        SELECT s.stock_id, b.bar_date, b.close
+        FROM Stock s
+        CROSS JOIN LATERAL (
+            SELECT bar_date, close FROM PriceBar
+            WHERE stock_id = s.stock_id
+            ORDER BY bar_date DESC LIMIT %s
+        ) b
+    """, (n,))
+    rows = cur.fetchall()
+    if not rows:
+        return pd.DataFrame()
+    frame = pd.DataFrame(rows, columns=["stock_id", "bar_date", "close"])
+    frame["close"] = frame["close"].astype(float)
+    return frame.pivot(index="bar_date", columns="stock_id", values="close").sort_index()
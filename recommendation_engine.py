@@ -1,135 +1,328 @@
-from decimal import Decimal
-import psycopg2
+import itertools
+import time
+import numpy as np
 from psycopg2 import extras
+from db import get_connection
+import valuation
+import leaderboard
+import strategy
+import lot_selection
+import risk
 
-DB_CONFIG = {
-    "host": "127.0.0.1",
-    "database": "postgres",
-    "user": "postgres",
-    "password": "1234",
-    "port": 5400
+OVERWEIGHT_BAND = 15     # trim when a sector is this many points above target
+UNDERWEIGHT_BAND = 10    # buy when a sector is this many points below target
+CASH_BUFFER = strategy.CASH_BUFFER   # never suggest spending below this
+MAX_BUY_AMOUNT = 50000
+
+EMPTY_RESULT = {
+    "status": "empty",
+    "message": "Portfolio is empty. Begin with a foundation in Technology or Finance using your cash reserves."
 }
 
-def get_connection():
-    return psycopg2.connect(**DB_CONFIG)
+def select_sectors(sector_matrix, totals, target_pct,
+                   overweight_band=OVERWEIGHT_BAND, underweight_band=UNDERWEIGHT_BAND):
+    """
+    Vectorized over users: sector_matrix is (users x target sectors) market value,
+    totals is each user's total portfolio value and target_pct the profile's
+    target per sector. Returns, per user, the index of
+    the most overweight sector (-1 if none), its divergence, the index of the
+    most underweight sector (-1 if none) and its gap, all in percentage points.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(totals[:, None] > 0, sector_matrix / totals[:, None] * 100, 0.0)
+
+    divergence = pct - target_pct
+    over = np.where(divergence > overweight_band, divergence, -np.inf)
+    over_idx = np.argmax(over, axis=1)
+    over_val = over[np.arange(len(over)), over_idx]
+    over_idx = np.where(np.isfinite(over_val), over_idx, -1)
+
+    gap = target_pct - pct
+    under = np.where(gap > underweight_band, gap, -np.inf)
+    under_idx = np.argmax(under, axis=1)
+    under_val = under[np.arange(len(under)), under_idx]
+    under_idx = np.where(np.isfinite(under_val), under_idx, -1)
+
+    return over_idx, np.where(over_idx >= 0, over_val, 0.0), under_idx, np.where(under_idx >= 0, under_val, 0.0)
+
+def build_recommendation(cash_balance, overweight_sector, highest_divergence, underweight_sector, max_gap,
+                         trim, picks, profile_name=strategy.DEFAULT_PROFILE, risk_note=None):
+    """
+    Turn the selected sectors into the recommendation payload. trim is the
+    tax-aware lot selection (lot_selection.summarize) that brings the overweight
+    sector back to target, or None; picks are the top momentum stocks not yet held
+    in the underweight sector, best first. risk_note (risk.risk_note) is appended
+    when portfolio risk is elevated.
+    """
+    pick = picks[0] if picks else None
+    messages = []
+    action = "HOLD"
+    suggested_stock = "ETF"
+    suggested_sector = None
+    amount = 0
+
+    if overweight_sector and trim and trim['orders']:
+        tax_msg = " (LTCG Eligible - Tax Efficient)" if trim['long_term_only'] else ""
+        names = ", ".join(f"**{o['quantity']} {o['symbol']}**" for o in trim['orders'])
+        messages.append(f"Strategic Trim: Portfolio is {highest_divergence:.1f}% overweight in {overweight_sector}.")
+        messages.append(f"Consider scaling back {names}{tax_msg} to rebalance (est. tax ₹{trim['estimated_tax']:,.0f}).")
+
+    if underweight_sector and cash_balance > CASH_BUFFER:
+        if pick:
+            suggested_stock = f"{pick['name']} ({pick['symbol']})"
+            suggested_sector = underweight_sector
+            action = "BUY"
+            amount = min(cash_balance - CASH_BUFFER, MAX_BUY_AMOUNT)
+            messages.append(f"Strategic Entry: {underweight_sector} is underweight by {max_gap:.1f}%.")
+            messages.append(f"With ₹{cash_balance:,.0f} cash available, **{suggested_stock}** is a top momentum candidate.")
+    elif cash_balance <= 25000 and underweight_sector:
+        messages.append(f"Allocation for {underweight_sector} is low, but maintaining cash reserves (₹{cash_balance:,.0f}) is prioritized.")
+
+    final_msg = " ".join(messages) if messages else f"Portfolio is optimally aligned with {profile_name} Targets."
+    if risk_note:
+        final_msg += " " + risk_note
+
+    return {
+        "status": "success",
+        "action": action,
+        "sector": suggested_sector,
+        "suggested_stock": suggested_stock,
+        "amount": amount,
+        "reason": final_msg,
+        "alternatives": [f"{p['name']} ({p['symbol']})" for p in picks[1:]] if action == "BUY" else []
+    }
 
 def analyze_portfolio(user_id):
     conn = get_connection()
     try:
         cur = conn.cursor(cursor_factory=extras.DictCursor)
-        
-        # 1. Fetch User Cash & Total Holdings
-        cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s', (user_id,))
-        res_cash = cur.fetchone()
-        cash_balance = float(res_cash[0]) if res_cash else 0.0
-
-        query = """
-            SELECT p.total_quantity, s.current_price, s.sector, s.symbol, s.stock_id, p.avg_buy_price
-            FROM Portfolio p
-            JOIN Stock s ON p.stock_id = s.stock_id
-            WHERE p.user_id = %s AND p.total_quantity > 0
-        """
-        cur.execute(query, (user_id,))
-        holdings = cur.fetchall()
-        
-        # 2. Calculate Total Value and Sector Allocation
-        total_value = 0.0
-        sector_values = {}
-        for h in holdings:
-            val = float(h['total_quantity']) * float(h['current_price'])
-            section = h['sector'] or 'Unclassified'
-            total_value += val
-            sector_values[section] = sector_values.get(section, 0.0) + val
-            
+
+        # 1-2. Cash, holdings, total value and sector allocation in one valuation query
+        portfolio = valuation.value_portfolio(cur, user_id)
+        cash_balance = portfolio['summary']['cash_balance'] if portfolio else 0.0
+        total_value = portfolio['summary']['total_value'] if portfolio else 0.0
+        sector_values = {s['sector']: s['value'] for s in portfolio['sectors']} if portfolio else {}
+
         # 3. Analyze Balance
         if total_value == 0:
-            return {
-                "status": "empty",
-                "message": "Portfolio is empty. Begin with a foundation in Technology or Finance using your cash reserves."
-            }
-            
-        # V2 Strategic Targets
-        targets = {
-            "Technology": 25, "Finance": 25,
-            "Healthcare": 15, "Energy": 15,
-            "Consumer": 10, "Unclassified": 10
-        }
-        
-        messages = []
-        action = "HOLD"
-        suggested_stock = "ETF"
-        suggested_sector = None
-        amount = 0
-
-        # Overweight Check
-        overweight_sector = None
-        highest_divergence = 0
-        for sector, target_pct in targets.items():
-            current_pct = (sector_values.get(sector, 0) / total_value) * 100
-            if current_pct > (target_pct + 15):
-                div = current_pct - target_pct
-                if div > highest_divergence:
-                    highest_divergence = div
-                    overweight_sector = sector
+            return dict(EMPTY_RESULT)
 
+        profile = strategy.load_profile(cur)
+        target_sectors = list(profile['targets'])
+        target_pct = np.array(list(profile['targets'].values()), dtype=float)
+        matrix = np.array([[sector_values.get(s, 0.0) for s in target_sectors]])
+        over_idx, over_val, under_idx, under_val = select_sectors(matrix, np.array([total_value]), target_pct)
+        overweight_sector = target_sectors[over_idx[0]] if over_idx[0] >= 0 else None
+        underweight_sector = target_sectors[under_idx[0]] if under_idx[0] >= 0 else None
+
+        trim = None
         if overweight_sector:
-            cur.execute("""
-                SELECT s.symbol, b.lot_id, b.buy_date
-                FROM BuyLot b
-                JOIN Stock s ON b.stock_id = s.stock_id
-                WHERE s.sector = %s AND b.user_id = %s AND b.remaining_quantity > 0
-                ORDER BY b.buy_date ASC LIMIT 1
-            """, (overweight_sector, user_id))
-            target_lot = cur.fetchone()
-            if target_lot:
-                from datetime import date
-                is_long_term = (date.today() - target_lot['buy_date']).days > 365
-                tax_msg = " (LTCG Eligible - Tax Efficient)" if is_long_term else ""
-                messages.append(f"Strategic Trim: Portfolio is {highest_divergence:.1f}% overweight in {overweight_sector}.")
-                messages.append(f"Consider scaling back **{target_lot['symbol']}**{tax_msg} to rebalance.")
-
-        # Underweight Check
-        underweight_sector = None
-        max_gap = 0
-        for sector, target_pct in targets.items():
-            current_pct = (sector_values.get(sector, 0) / total_value) * 100
-            gap = target_pct - current_pct
-            if gap > 10:
-                if gap > max_gap:
-                    max_gap = gap
-                    underweight_sector = sector
-
-        if underweight_sector and cash_balance > 10000:
-            cur.execute("""
-                SELECT symbol, name, current_price, momentum_score 
-                FROM Stock 
-                WHERE sector = %s 
-                AND stock_id NOT IN (SELECT stock_id FROM Portfolio WHERE user_id = %s)
-                ORDER BY momentum_score DESC LIMIT 1
-            """, (underweight_sector, user_id))
-            pick = cur.fetchone()
-            if pick:
-                suggested_stock = f"{pick['name']} ({pick['symbol']})"
-                suggested_sector = underweight_sector
-                action = "BUY"
-                amount = min(cash_balance - 10000, 50000)
-                messages.append(f"Strategic Entry: {underweight_sector} is underweight by {max_gap:.1f}%.")
-                messages.append(f"With ₹{cash_balance:,.0f} cash available, **{suggested_stock}** is a top momentum candidate.")
-        elif cash_balance <= 25000 and underweight_sector:
-            messages.append(f"Allocation for {underweight_sector} is low, but maintaining cash reserves (₹{cash_balance:,.0f}) is prioritized.")
-
-        final_msg = " ".join(messages) if messages else "Portfolio is optimally aligned with Strategic V2 Targets."
-        
-        return {
-            "status": "success",
-            "action": action,
-            "sector": suggested_sector,
-            "suggested_stock": suggested_stock,
-            "amount": amount,
-            "reason": final_msg
-        }
+            lots = lot_selection.load_open_lots(cur, user_id, sector=overweight_sector)
+            excess = float(over_val[0]) / 100 * total_value
+            trim = lot_selection.summarize(lots, lot_selection.select_for_amount(lots, excess))
+
+        picks = []
+        if underweight_sector and cash_balance > CASH_BUFFER:
+            cur.execute("SELECT stock_id FROM Portfolio WHERE user_id = %s", (user_id,))
+            held = {row[0] for row in cur.fetchall()}
+            picks = leaderboard.current(cur).best(underweight_sector, held, k=leaderboard.TOP_K)
+
+        report = risk.engine.report(cur, user_id)
+        stats = report['portfolio'] if report else {}
+        note = risk.risk_note(stats.get('volatility'), stats.get('beta'), stats.get('var_historical'))
+
+        return build_recommendation(cash_balance, overweight_sector, float(over_val[0]),
+                                    underweight_sector, float(under_val[0]), trim, picks, profile['name'], note)
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
     finally:
         conn.close()
+
+# --- BATCH MODE: every user in one pass, stored in the Recommendation table ---
+
+def compute_all(cur):
+    """
+    Compute recommendations for every user from a handful of bulk queries.
+    Returns {user_id: recommendation}; each carries the user's last_txn_id.
+    """
+    # Read each user's newest txn_id before their holdings. Trades take the User row
+    # lock before inserting, so a user's txn_ids grow in commit order and anything
+    # committed after this read has a larger id (see get_stored).
+    cur.execute("""
+        SELECT u.user_id, u.cash_balance,
+               (SELECT MAX(t.txn_id) FROM Transaction t WHERE t.user_id = u.user_id)
+        FROM "User" u ORDER BY u.user_id
+    """)
+    users = cur.fetchall()
+    if not users:
+        return {}
+    last_txn = {u[0]: u[2] for u in users}
+    user_ids = np.array([u[0] for u in users])
+    cash = np.array([float(u[1]) for u in users])
+    row_of = {uid: i for i, uid in enumerate(user_ids.tolist())}
+    profile = strategy.load_profile(cur)
+    target_sectors = list(profile['targets'])
+    target_pct = np.array(list(profile['targets'].values()), dtype=float)
+
+    # users x sector value matrix (open holdings only), plus total value per user
+    cur.execute("""
+        SELECT p.user_id, COALESCE(s.sector, 'Unclassified'), SUM(p.total_quantity * s.current_price)
+        FROM Portfolio p
+        JOIN Stock s ON p.stock_id = s.stock_id
+        WHERE p.total_quantity > 0
+        GROUP BY 1, 2
+    """)
+    col_of = {s: j for j, s in enumerate(target_sectors)}
+    matrix = np.zeros((len(users), len(target_sectors)))
+    totals = np.zeros(len(users))
+    for uid, sector, value in cur.fetchall():
+        i = row_of.get(uid)
+        if i is None:
+            continue
+        totals[i] += float(value)
+        j = col_of.get(sector)
+        if j is not None:
+            matrix[i, j] += float(value)
+
+    over_idx, over_val, under_idx, under_val = select_sectors(matrix, totals, target_pct)
+
+    # Tax-aware trims: open lots of every user's overweight sector in one query
+    overweight = [(uid, target_sectors[over_idx[i]]) for i, uid in enumerate(user_ids.tolist())
+                  if over_idx[i] >= 0 and totals[i] > 0]
+    trims = {}
+    if overweight:
+        rows = extras.execute_values(cur, f"""
+            SELECT b.user_id, {lot_selection.LOT_COLUMNS}
+            FROM BuyLot b
+            JOIN Stock s ON b.stock_id = s.stock_id
+            JOIN (VALUES %s) AS w (user_id, sector)
+              ON w.user_id = b.user_id AND w.sector = COALESCE(s.sector, 'Unclassified')
+            WHERE b.remaining_quantity > 0
+            ORDER BY b.user_id, b.stock_id, b.buy_date, b.lot_id
+        """, overweight, page_size=len(overweight), fetch=True)
+        for uid, user_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            lots = lot_selection.lots_from_rows([row[1:] for row in user_rows])
+            i = row_of[uid]
+            excess = float(over_val[i]) / 100 * totals[i]
+            trims[uid] = lot_selection.summarize(lots, lot_selection.select_for_amount(lots, excess))
+
+    # Momentum leaders per sector (published by the latest refresh) and what each user already holds
+    board = leaderboard.current(cur)
+    cur.execute("SELECT user_id, stock_id, total_quantity FROM Portfolio")
+    portfolio_rows = cur.fetchall()
+    held = {}
+    for uid, stock_id, _ in portfolio_rows:
+        held.setdefault(uid, set()).add(stock_id)
+
+    # Risk of every portfolio at once: (days x stocks) returns @ (stocks x users) weights
+    closes = risk.engine.market(cur)
+    returns, benchmark = risk.daily_returns(closes)
+    stock_col = {sid: j for j, sid in enumerate(closes.columns)}
+    last_close = np.nan_to_num(closes.ffill().iloc[-1].to_numpy(dtype=float)) if len(closes) else np.zeros(0)
+    holding_value = np.zeros((len(users), len(stock_col)))
+    for uid, stock_id, quantity in portfolio_rows:
+        if uid in row_of and stock_id in stock_col and quantity > 0:
+            holding_value[row_of[uid], stock_col[stock_id]] = quantity * last_close[stock_col[stock_id]]
+    risk_value = holding_value.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        risk_weights = np.where(risk_value[:, None] > 0, holding_value / risk_value[:, None], 0.0)
+    risk_stats = risk.portfolio_stats(returns, benchmark, risk_weights, risk_value)
+
+    results = {}
+    for i, uid in enumerate(user_ids.tolist()):
+        if totals[i] == 0:
+            results[uid] = dict(EMPTY_RESULT)
+            continue
+        overweight_sector = target_sectors[over_idx[i]] if over_idx[i] >= 0 else None
+        underweight_sector = target_sectors[under_idx[i]] if under_idx[i] >= 0 else None
+
+        picks = []
+        if underweight_sector and cash[i] > CASH_BUFFER:
+            picks = board.best(underweight_sector, held.get(uid, ()), k=leaderboard.TOP_K)
+
+        note = risk.risk_note(risk_stats["volatility"][i], risk_stats["beta"][i], risk_stats["var_historical"][i])
+        results[uid] = build_recommendation(float(cash[i]), overweight_sector, float(over_val[i]),
+                                            underweight_sector, float(under_val[i]), trims.get(uid), picks,
+                                            profile['name'], note)
+    for uid, rec in results.items():
+        rec["last_txn_id"] = last_txn[uid]
+    return results
+
+def ensure_schema(cur):
+    """Columns and indexes added after the Recommendation table was first created."""
+    cur.execute("ALTER TABLE Recommendation ADD COLUMN IF NOT EXISTS last_txn_id INTEGER")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_transaction_user_txn ON Transaction (user_id, txn_id)")
+
+def store(cur, results, page_size=5000):
+    rows = [(uid, r["status"], r.get("action"), r.get("sector"), r.get("suggested_stock"),
+             r.get("amount"), r.get("reason") or r.get("message"), r.get("alternatives") or [], r.get("last_txn_id"))
+            for uid, r in results.items()]
+    extras.execute_values(cur, """
+        INSERT INTO Recommendation (user_id, status, action, sector, suggested_stock, amount, reason, alternatives,
+                                    last_txn_id, computed_at)
+        VALUES %s
+        ON CONFLICT (user_id) DO UPDATE SET
+            status = EXCLUDED.status, action = EXCLUDED.action, sector = EXCLUDED.sector,
+            suggested_stock = EXCLUDED.suggested_stock, amount = EXCLUDED.amount,
+            reason = EXCLUDED.reason, alternatives = EXCLUDED.alternatives,
+            last_txn_id = EXCLUDED.last_txn_id, computed_at = EXCLUDED.computed_at
+    """, rows, template="(%s, %s, %s, %s, %s, %s, %s, %s::text[], %s, CURRENT_TIMESTAMP)", page_size=page_size)
+    return len(rows)
+
+def recompute_all():
+    """Batch job: recompute and store recommendations for every user (run after each market refresh)."""
+    started = time.monotonic()
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        ensure_schema(cur)
+        count = store(cur, compute_all(cur))
+        conn.commit()
+        return {"status": "success", "users": count, "seconds": round(time.monotonic() - started, 2)}
+    except Exception as e:
+        conn.rollback()
+        print(f"Recommendation batch error: {e}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        cur.close()
+        conn.close()
+
+def get_stored(user_id):
+    """
+    Stored recommendation for a user, or None if there is none or the user has
+    traded since it was computed (any transaction newer than its last_txn_id,
+    whatever its txn_date, so imported history counts too).
+    """
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    try:
+        cur.execute("""
+            SELECT r.status, r.action, r.sector, r.suggested_stock, r.amount, r.reason, r.alternatives
+            FROM Recommendation r
+            WHERE r.user_id = %s
+            AND NOT EXISTS (
+                SELECT 1 FROM Transaction t
+                WHERE t.user_id = r.user_id AND t.txn_id > COALESCE(r.last_txn_id, 0)
+            )
+        """, (user_id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        if row['status'] == 'empty':
+            return {"status": "empty", "message": row['reason']}
+        return {
+            "status": row['status'],
+            "action": row['action'],
+            "sector": row['sector'],
+            "suggested_stock": row['suggested_stock'],
+            "amount": float(row['amount']) if row['amount'] is not None else 0,
+            "reason": row['reason'],
+            "alternatives": row['alternatives'] or []
+        }
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    print(recompute_all())
@@ -0,0 +1,203 @@
+import threading
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+import momentum
+
+# --- RISK CONFIG ---
+LOOKBACK = 252           # trading days of daily returns
+TRADING_DAYS = 252       # annualization factor
+VAR_CONFIDENCE = 0.95    # one-day VaR confidence level
+MIN_OBS = 20             # fewer daily returns than this gives no statistic
+HIGH_VOLATILITY = 25.0   # annualized %, flagged in recommendation reasons
+HIGH_BETA = 1.3
+
+# There is no index series in PriceBar, so the benchmark is the equal-weighted
+# daily return of every stored stock (a broad market proxy).
+
+def daily_returns(closes):
+    """Simple daily returns of a (date x stock) close matrix and the equal-weight benchmark."""
+    arr = closes.ffill().to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = arr[1:] / arr[:-1] - 1
+    ret[~np.isfinite(ret)] = np.nan
+    valid = ~np.isnan(ret)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        benchmark = np.where(valid, ret, 0.0).sum(axis=1) / valid.sum(axis=1)
+    return ret, benchmark
+
+def _max_drawdown(returns):
+    """Worst peak-to-trough fall (%) of each column's compounded return path."""
+    wealth = np.cumprod(1 + np.nan_to_num(returns), axis=0)
+    peak = np.maximum.accumulate(wealth, axis=0)
+    return (wealth / peak - 1).min(axis=0) * 100
+
+def _beta(returns, benchmark):
+    """Beta of each column against the benchmark, over the rows where both exist."""
+    valid = ~np.isnan(returns) & ~np.isnan(benchmark)[:, None]
+    n = valid.sum(axis=0)
+    r = np.where(valid, returns, 0.0)
+    b = np.where(valid, np.nan_to_num(benchmark)[:, None], 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_mean, b_mean = r.sum(axis=0) / n, b.sum(axis=0) / n
+        cov = (np.where(valid, (r - r_mean) * (b - b_mean), 0.0)).sum(axis=0) / (n - 1)
+        var = (np.where(valid, (b - b_mean) ** 2, 0.0)).sum(axis=0) / (n - 1)
+        beta = cov / var
+    return np.where(n >= MIN_OBS, beta, np.nan)
+
+def _volatility(returns):
+    """Annualized volatility (%) of each column, NaN-aware."""
+    valid = ~np.isnan(returns)
+    n = valid.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, returns, 0.0).sum(axis=0) / n
+        var = np.where(valid, (returns - mean) ** 2, 0.0).sum(axis=0) / (n - 1)
+    return np.where(n >= MIN_OBS, np.sqrt(np.maximum(var, 0)) * np.sqrt(TRADING_DAYS) * 100, np.nan)
+
+def portfolio_stats(returns, benchmark, weights, values, confidence=VAR_CONFIDENCE):
+    """
+    Risk of many portfolios at once: returns is (days x stocks), weights is
+    (portfolios x stocks) summing to 1 per row and values the holdings value of
+    each portfolio. Days a stock has no return count as flat for the portfolio.
+    Returns arrays (one entry per portfolio) of annualized volatility %, beta,
+    historical and parametric one-day VaR in rupees and max drawdown %.
+    """
+    port = np.nan_to_num(returns) @ weights.T          # days x portfolios
+    enough = len(port) >= MIN_OBS
+    mean = port.mean(axis=0) if len(port) else np.zeros(weights.shape[0])
+    std = port.std(axis=0, ddof=1) if len(port) > 1 else np.zeros(weights.shape[0])
+    z = NormalDist().inv_cdf(confidence)
+    hist = -np.quantile(port, 1 - confidence, axis=0) if len(port) else np.zeros(weights.shape[0])
+    nan = np.full(weights.shape[0], np.nan)
+    return {
+        "volatility": _volatility(port) if enough else nan,
+        "beta": _beta(port, benchmark) if enough else nan,
+        "var_historical": np.maximum(hist, 0) * values if enough else nan,
+        "var_parametric": np.maximum(z * std - mean, 0) * values if enough else nan,
+        "max_drawdown": _max_drawdown(port) if enough else nan
+    }
+
+def _num(x, digits=2):
+    return None if x is None or not np.isfinite(x) else round(float(x), digits)
+
+def compute_report(closes, holdings, confidence=VAR_CONFIDENCE):
+    """
+    Risk report for one portfolio. closes is the market (date x stock_id) close
+    matrix; holdings are (stock_id, symbol, quantity) rows.
+    """
+    ret, benchmark = daily_returns(closes)
+    col_of = {sid: j for j, sid in enumerate(closes.columns)}
+    held = [(sid, symbol, qty) for sid, symbol, qty in holdings if sid in col_of]
+    cols = [col_of[sid] for sid, _, _ in held]
+
+    last = closes.ffill().iloc[-1].to_numpy(dtype=float) if len(closes) else np.zeros(0)
+    value = np.array([qty * last[j] for (_, _, qty), j in zip(held, cols)], dtype=float)
+    value = np.nan_to_num(value)
+    total = float(value.sum())
+    weights = value / total if total else np.zeros(len(held))
+
+    R = ret[:, cols] if cols else np.zeros((len(ret), 0))
+    stats = portfolio_stats(R if total else R[:0], benchmark, weights[None, :], np.array([total]), confidence)
+    vol, beta, drawdown = _volatility(R), _beta(R, benchmark), _max_drawdown(R)
+
+    symbols = [symbol for _, symbol, _ in held]
+    corr = pd.DataFrame(R, columns=symbols).corr(min_periods=MIN_OBS) if symbols else pd.DataFrame()
+    return {
+        "as_of": closes.index[-1].isoformat() if len(closes) else None,
+        "observations": int(len(ret)),
+        "confidence": confidence,
+        "benchmark": "Equal-weight market",
+        "portfolio": {
+            "value": round(total, 2),
+            "volatility": _num(stats["volatility"][0]),
+            "beta": _num(stats["beta"][0]),
+            "var_historical": _num(stats["var_historical"][0]),
+            "var_parametric": _num(stats["var_parametric"][0]),
+            "max_drawdown": _num(stats["max_drawdown"][0])
+        },
+        "holdings": [{
+            "stock_id": sid,
+            "symbol": symbol,
+            "weight": round(float(weights[i]) * 100, 2),
+            "volatility": _num(vol[i]),
+            "beta": _num(beta[i]),
+            "max_drawdown": _num(drawdown[i])
+        } for i, (sid, symbol, _) in enumerate(held)],
+        "correlation": {
+            "symbols": symbols,
+            "matrix": [[_num(x, 3) for x in row] for row in corr.to_numpy()]
+        }
+    }
+
+def risk_note(volatility, beta, var, confidence=VAR_CONFIDENCE):
+    """Sentence for the recommendation reason when portfolio risk is elevated, else None."""
+    vol_high = volatility is not None and np.isfinite(volatility) and volatility >= HIGH_VOLATILITY
+    beta_high = beta is not None and np.isfinite(beta) and beta >= HIGH_BETA
+    if not (vol_high or beta_high):
+        return None
+    note = f"Risk Check: portfolio volatility is {volatility:.1f}% annualized"
+    if beta is not None and np.isfinite(beta):
+        note += f" (beta {beta:.2f} vs the market)"
+    if var is not None and np.isfinite(var):
+        note += f", with a 1-day {confidence:.0%} VaR of ₹{var:,.0f}"
+    return note + "."
+
+
+class RiskEngine:
+    """
+    Keeps the market's trailing close matrix for the latest bar date, and each
+    user's last report keyed by (bar date, holdings), so a report is recomputed
+    only after a trade or a new day of bars.
+    """
+
+    def __init__(self, lookback=LOOKBACK):
+        self.lookback = lookback
+        self.closes = None
+        self.as_of = None
+        self._reports = {}
+        self._lock = threading.Lock()
+
+    def market(self, cur):
+        """Trailing (date x stock_id) closes up to the newest stored bar."""
+        cur.execute("SELECT MAX(bar_date) FROM PriceBar")
+        as_of = cur.fetchone()[0]
+        with self._lock:
+            if self.closes is None or as_of != self.as_of:
+                self.closes = momentum.load_close_matrix(cur, bars=self.lookback + 1).tail(self.lookback + 1)
+                self.as_of = as_of
+                self._reports = {}
+            return self.closes
+
+    def report(self, cur, user_id):
+        """Risk report for a user's open holdings, or None if the user does not exist."""
+        cur.execute("""
+            SELECT p.stock_id, s.symbol, p.total_quantity
+            FROM "User" u
+            LEFT JOIN Portfolio p ON p.user_id = u.user_id AND p.total_quantity > 0
+            LEFT JOIN Stock s ON s.stock_id = p.stock_id
+            WHERE u.user_id = %s
+            ORDER BY p.stock_id
+        """, (user_id,))
+        rows = cur.fetchall()
+        if not rows:
+            return None
+        holdings = tuple((r[0], r[1], r[2]) for r in rows if r[0] is not None)
+
+        closes = self.market(cur)
+        key = (self.as_of, holdings)
+        cached = self._reports.get(user_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        report = compute_report(closes, holdings)
+        with self._lock:
+            self._reports[user_id] = (key, report)
+        return report
+
+    def reset(self):
+        with self._lock:
+            self.closes = None
+            self.as_of = None
+            self._reports = {}
+
+
+engine = RiskEngine()
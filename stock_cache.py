@@ -0,0 +1,36 @@
+import hashlib
+import threading
+
+
+class VersionedSnapshot:
+    """
+    Read-through cache for a pre-serialized JSON payload. The payload is rebuilt
+    only when the caller's version (e.g. the market-data version bumped by each
+    refresh) differs from the cached one; every other read is a memory lookup.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader          # () -> bytes
+        self._lock = threading.Lock()
+        self._entry = None            # (version, body, etag), replaced as a whole
+
+    def get(self, version):
+        """Return (body, etag) for the given data version."""
+        # One attribute read, so a concurrent rebuild can't pair a body with another version's etag
+        entry = self._entry
+        if entry is not None and entry[0] == version:
+            return entry[1], entry[2]
+
+        with self._lock:
+            # Another thread may have rebuilt it while we waited
+            entry = self._entry
+            if entry is not None and entry[0] == version:
+                return entry[1], entry[2]
+            body = self.loader()
+            etag = hashlib.sha1(body).hexdigest()[:20]
+            self._entry = (version, body, etag)
+            return body, etag
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
@@ -0,0 +1,179 @@
+import numpy as np
+
+# Built-in profile: seeds the StrategyProfile table and is used when it is empty
+DEFAULT_PROFILE = "Strategic V2"
+DEFAULT_TARGETS = {
+    "Technology": 25, "Finance": 25,
+    "Healthcare": 15, "Energy": 15,
+    "Consumer": 10, "Unclassified": 10
+}
+
+CASH_BUFFER = 10000       # the plan never spends cash below this
+MIN_TRADE_VALUE = 1000    # skip trades smaller than this; drift below it is tolerated
+
+
+def load_profile(cur, name=None):
+    """
+    Strategy profile {name, targets: {sector: pct}} by name, or the default profile
+    when name is None. Returns None if a named profile does not exist.
+    """
+    if name is None:
+        cur.execute("""
+            SELECT p.name, t.sector, t.target_pct
+            FROM StrategyProfile p
+            JOIN StrategyTarget t ON t.profile_id = p.profile_id
+            WHERE p.is_default
+            ORDER BY t.target_pct DESC, t.sector
+        """)
+    else:
+        cur.execute("""
+            SELECT p.name, t.sector, t.target_pct
+            FROM StrategyProfile p
+            JOIN StrategyTarget t ON t.profile_id = p.profile_id
+            WHERE p.name = %s
+            ORDER BY t.target_pct DESC, t.sector
+        """, (name,))
+    rows = cur.fetchall()
+    if not rows:
+        if name is None or name == DEFAULT_PROFILE:
+            return {"name": DEFAULT_PROFILE, "targets": dict(DEFAULT_TARGETS)}
+        return None
+    return {"name": rows[0][0], "targets": {sector: float(pct) for _, sector, pct in rows}}
+
+def list_profiles(cur):
+    cur.execute("""
+        SELECT p.name, p.description, p.is_default, t.sector, t.target_pct
+        FROM StrategyProfile p
+        JOIN StrategyTarget t ON t.profile_id = p.profile_id
+        ORDER BY p.is_default DESC, p.name, t.target_pct DESC
+    """)
+    profiles = {}
+    for name, description, is_default, sector, pct in cur.fetchall():
+        profile = profiles.setdefault(name, {
+            "name": name, "description": description, "is_default": is_default, "targets": {}
+        })
+        profile["targets"][sector] = float(pct)
+    return list(profiles.values())
+
+
+def plan_rebalance(positions, cash_balance, targets, candidates=None,
+                   cash_buffer=CASH_BUFFER, min_trade_value=MIN_TRADE_VALUE):
+    """
+    Whole-share trades that bring the profile's sectors to their target weights
+    with the least turnover and as few trades as possible.
+
+    positions are holdings ({stock_id, symbol, sector, current_price, total_quantity});
+    candidates maps a target sector with no holdings to the stock to open it with.
+    Only sectors named in targets are rebalanced: holdings in other sectors are
+    left alone (give a sector a 0 target to exit it).
+
+    Each sector's exact move is target value - current value; trading exactly
+    that is the least turnover that reaches the targets. A sector's buy goes to
+    its largest holding (or the candidate), and its sell comes out of the largest
+    holdings first. Shares are rounded towards zero. Then single shares are added
+    back wherever that brings a sector closer to its target and cash allows.
+    Trades under min_trade_value are dropped, and cash never goes below cash_buffer.
+    """
+    rows = list(positions)
+    held_sectors = {p["sector"] for p in rows}
+    for sector, candidate in (candidates or {}).items():
+        if sector not in held_sectors and targets.get(sector, 0) > 0:
+            rows.append(dict(candidate, sector=sector, total_quantity=0))
+
+    if not rows:
+        return {"trades": [], "sectors": [], "cash_before": round(cash_balance, 2),
+                "cash_after": round(cash_balance, 2), "turnover": 0.0}
+
+    sectors = list(targets) + sorted({r["sector"] for r in rows} - set(targets))
+    col_of = {s: j for j, s in enumerate(sectors)}
+    sector_idx = np.array([col_of[r["sector"]] for r in rows])
+    price = np.array([float(r["current_price"]) for r in rows])
+    qty = np.array([int(r["total_quantity"]) for r in rows])
+    value = price * qty
+    managed = np.array([s in targets for s in sectors])
+
+    # Target weights over the targeted sectors that have a stock to hold, renormalized
+    sector_value = np.bincount(sector_idx, weights=value, minlength=len(sectors))
+    sector_count = np.bincount(sector_idx, minlength=len(sectors))
+    weights = np.array([targets.get(s, 0.0) for s in sectors], dtype=float)
+    weights[sector_count == 0] = 0.0
+    if weights.sum() > 0:
+        weights = weights / weights.sum()
+
+    # Exact value each targeted sector has to move
+    investable = max(sector_value[managed].sum() + cash_balance - cash_buffer, 0.0)
+    move = np.where(managed, weights * investable - sector_value, 0.0)
+
+    # Rows of each sector, largest position first (a candidate being opened is the only row)
+    order = np.lexsort((-value, sector_idx))
+    by_sector = {j: [i for i in order if sector_idx[i] == j] for j in range(len(sectors))}
+
+    delta = np.zeros(len(rows), dtype=int)
+    for j in np.flatnonzero(managed):
+        members = by_sector[j]
+        if move[j] > 0 and members:
+            i = members[0]
+            delta[i] = int(move[j] // price[i])
+        elif move[j] < 0:
+            need = -move[j]
+            for i in members:
+                sell = min(int(qty[i]), int(need // price[i]))
+                delta[i] = -sell
+                need -= sell * price[i]
+                if sell < qty[i]:
+                    break
+    delta[np.abs(delta) * price < min_trade_value] = 0
+
+    # Fund buys from cash above the buffer plus sale proceeds
+    sells = np.minimum(delta, 0)
+    buys = np.maximum(delta, 0)
+    available = max(cash_balance - cash_buffer - (sells * price).sum(), 0.0)
+    buy_cost = (buys * price).sum()
+    if buy_cost > available:
+        buys = np.floor(buys * (available / buy_cost)).astype(int)
+        buys[buys * price < min_trade_value] = 0
+        buy_cost = (buys * price).sum()
+
+    # Integer repair: spend what rounding left over, one share at a time, on the
+    # buys furthest below target, while a share still reduces the sector's error
+    spare = available - buy_cost
+    for i in sorted(np.flatnonzero(buys), key=lambda i: -(move[sector_idx[i]] - buys[i] * price[i])):
+        short = move[sector_idx[i]] - buys[i] * price[i]
+        extra = min(int((short + price[i] / 2) // price[i]), int(spare // price[i]))
+        if extra > 0:
+            buys[i] += extra
+            spare -= extra * price[i]
+    delta = sells + buys
+
+    trades = []
+    for i in np.flatnonzero(delta):
+        r = rows[i]
+        trades.append({
+            "stock_id": r["stock_id"],
+            "symbol": r["symbol"],
+            "sector": r["sector"],
+            "action": "BUY" if delta[i] > 0 else "SELL",
+            "quantity": int(abs(delta[i])),
+            "price": round(float(price[i]), 2),
+            "value": round(float(abs(delta[i]) * price[i]), 2)
+        })
+    trades.sort(key=lambda t: (t["action"] != "SELL", -t["value"]))
+
+    new_value = (qty + delta) * price
+    new_sector_value = np.bincount(sector_idx, weights=new_value, minlength=len(sectors))
+    total_before, total_after = value.sum(), new_value.sum()
+    cash_after = cash_balance - (delta * price).sum()
+    summary = [{
+        "sector": s,
+        "target_pct": round(float(weights[j]) * 100, 2) if managed[j] else None,
+        "current_pct": round(float(sector_value[j] / total_before) * 100, 2) if total_before else 0.0,
+        "planned_pct": round(float(new_sector_value[j] / total_after) * 100, 2) if total_after else 0.0
+    } for j, s in enumerate(sectors)]
+
+    return {
+        "trades": trades,
+        "sectors": summary,
+        "cash_before": round(cash_balance, 2),
+        "cash_after": round(float(cash_after), 2),
+        "turnover": round(float(np.abs(delta * price).sum()), 2)
+    }
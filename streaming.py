@@ -0,0 +1,46 @@
+import json
+from psycopg2 import extras
+from db import get_connection
+
+FETCH_SIZE = 2000   # rows pulled per round-trip from a server-side cursor
+
+def iter_rows(query, params, name, convert=None, itersize=FETCH_SIZE):
+    """
+    Yield rows from a named (server-side) cursor so only `itersize` rows are in
+    memory at a time. The pooled connection is held until the generator finishes
+    or is closed (e.g. the client disconnects).
+    """
+    conn = get_connection()
+    cur = conn.cursor(name=name, cursor_factory=extras.RealDictCursor)
+    cur.itersize = itersize
+    try:
+        cur.execute(query, params)
+        for row in cur:
+            yield convert(row) if convert else row
+    finally:
+        cur.close()
+        conn.close()
+
+def json_array(rows, head='', tail=''):
+    """Stream an iterable of dicts as one JSON array, optionally wrapped in head/tail text."""
+    yield head + '['
+    first = True
+    for row in rows:
+        yield ('' if first else ',') + json.dumps(row)
+        first = False
+    yield ']' + tail
+
+def ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+def fetch_page(cur, query, params, limit, key):
+    """
+    Run a keyset-paginated query that selects up to limit + 1 rows and return
+    (rows, next_after) where next_after is the `key` of the last row if more remain.
+    """
+    cur.execute(query, params + (limit + 1,))
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1][key] if has_more and rows else None)
@@ -0,0 +1,113 @@
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from werkzeug.security import generate_password_hash
+from db import get_connection
+from app import execute_buy, execute_sell_fifo
+
+# Fires many concurrent buys and sells at ONE account and then checks that
+# cash, holdings, lots, realized gains and the transaction log still agree.
+
+def create_account(cash):
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        email = f"stress_{int(time.time() * 1000)}_{random.randint(0, 9999)}@example.com"
+        cur.execute('INSERT INTO "User" (name, email, password_hash, cash_balance) VALUES (%s, %s, %s, %s) RETURNING user_id',
+                    ("Stress Test", email, generate_password_hash("stress"), cash))
+        user_id = cur.fetchone()[0]
+        cur.execute("SELECT stock_id FROM Stock ORDER BY stock_id LIMIT 3")
+        stock_ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        return user_id, stock_ids
+    finally:
+        cur.close()
+        conn.close()
+
+def place_order(user_id, stock_ids):
+    stock_id = random.choice(stock_ids)
+    quantity = random.randint(1, 5)
+    price = round(random.uniform(90, 110), 2)
+    try:
+        if random.random() < 0.55:
+            execute_buy(user_id, stock_id, quantity, price)
+            return "BUY"
+        execute_sell_fifo(user_id, stock_id, quantity, price)
+        return "SELL"
+    except Exception as e:
+        # Rejections (insufficient funds / shares) are expected under contention
+        return "REJECTED" if "Insufficient" in str(e) else f"ERROR: {e}"
+
+def check_invariants(user_id, initial_cash):
+    conn = get_connection()
+    cur = conn.cursor()
+    failures = []
+    try:
+        cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s', (user_id,))
+        cash = cur.fetchone()[0]
+        if cash < 0:
+            failures.append(f"negative cash balance {cash}")
+
+        # Cash must equal the starting balance replayed through the transaction log
+        cur.execute("""
+            SELECT COALESCE(SUM(CASE WHEN txn_type = 'SELL' THEN quantity * price ELSE -quantity * price END), 0)
+            FROM Transaction WHERE user_id = %s
+        """, (user_id,))
+        expected_cash = Decimal(initial_cash) + cur.fetchone()[0]
+        if cash != expected_cash:
+            failures.append(f"cash {cash} != replayed cash {expected_cash}")
+
+        # Per stock: portfolio quantity == open lot quantity == bought - sold
+        cur.execute("""
+            SELECT s.stock_id,
+                   COALESCE((SELECT total_quantity FROM Portfolio p WHERE p.user_id = %(u)s AND p.stock_id = s.stock_id), 0),
+                   COALESCE((SELECT SUM(remaining_quantity) FROM BuyLot b WHERE b.user_id = %(u)s AND b.stock_id = s.stock_id), 0),
+                   COALESCE((SELECT SUM(CASE WHEN txn_type = 'BUY' THEN quantity ELSE -quantity END)
+                             FROM Transaction t WHERE t.user_id = %(u)s AND t.stock_id = s.stock_id), 0),
+                   COALESCE((SELECT SUM(quantity) FROM RealizedGain r WHERE r.user_id = %(u)s AND r.stock_id = s.stock_id), 0),
+                   COALESCE((SELECT SUM(quantity) FROM Transaction t WHERE t.user_id = %(u)s AND t.stock_id = s.stock_id AND txn_type = 'SELL'), 0)
+            FROM Stock s
+        """, {"u": user_id})
+        for stock_id, held, open_lots, net_traded, gain_qty, sold in cur.fetchall():
+            if not (held == open_lots == net_traded):
+                failures.append(f"stock {stock_id}: portfolio {held}, open lots {open_lots}, net traded {net_traded}")
+            if gain_qty != sold:
+                failures.append(f"stock {stock_id}: realized gain qty {gain_qty} != sold {sold}")
+
+        cur.execute("SELECT COUNT(*) FROM BuyLot WHERE user_id = %s AND (remaining_quantity < 0 OR remaining_quantity > initial_quantity)", (user_id,))
+        bad_lots = cur.fetchone()[0]
+        if bad_lots:
+            failures.append(f"{bad_lots} lots with impossible remaining quantity")
+        return failures
+    finally:
+        cur.close()
+        conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrency stress test for order execution.")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--cash", type=float, default=20000.0)
+    args = parser.parse_args()
+
+    user_id, stock_ids = create_account(args.cash)
+    print(f"Firing {args.orders} orders from {args.workers} threads at user {user_id}...")
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        outcomes = list(pool.map(lambda _: place_order(user_id, stock_ids), range(args.orders)))
+    elapsed = time.monotonic() - started
+
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    print(f"Done in {elapsed:.1f}s ({args.orders / elapsed:.0f} orders/s): {counts}")
+
+    failures = check_invariants(user_id, args.cash)
+    if failures:
+        for f in failures:
+            print(f"FAIL: {f}")
+        raise SystemExit(1)
+    print("All invariants hold.")
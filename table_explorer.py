@@ -0,0 +1,211 @@
+import json
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from psycopg2 import extras, sql
+
+# --- ADMIN TABLE EXPLORER ---
+# Pages through any public table with keyset pagination on (sort column, primary
+# key). Sorting and filtering are limited to indexed columns so every page is an
+# index range scan, however large the table. Tables without a primary key fall
+# back to OFFSET pages in physical (ctid) order, up to MAX_OFFSET rows deep.
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_OFFSET = 100000
+CATALOG_TTL = 300    # seconds before the table/column whitelist is re-read
+
+FILTER_OPS = {
+    "eq": "=", "ne": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">=",
+    "like": "LIKE", "null": "IS NULL", "notnull": "IS NOT NULL"
+}
+
+_catalog = None
+_loaded_at = 0.0
+_lock = threading.Lock()
+
+def load_catalog(cur):
+    """
+    {lowercased table name: {name, columns: {column: {type, udt, nullable}}, primary_key,
+    indexed}} for every public table, in column order. udt is the (schema, name) of
+    the column's actual type, which filter values are cast to.
+    """
+    cur.execute("""
+        SELECT c.table_name, c.column_name, c.data_type, c.udt_schema, c.udt_name, c.is_nullable
+        FROM information_schema.columns c
+        JOIN information_schema.tables t
+          ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+        WHERE c.table_schema = 'public' AND t.table_type = 'BASE TABLE'
+        ORDER BY c.table_name, c.ordinal_position
+    """)
+    tables = {}
+    for table, column, data_type, udt_schema, udt_name, nullable in cur.fetchall():
+        entry = tables.setdefault(table.lower(), {
+            "name": table, "columns": {}, "primary_key": [], "indexed": set()
+        })
+        entry["columns"][column] = {"type": data_type, "udt": (udt_schema, udt_name), "nullable": nullable == 'YES'}
+
+    # Columns of every index; the primary key's in key order
+    cur.execute("""
+        SELECT c.relname, a.attname, i.indisprimary
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        CROSS JOIN LATERAL unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, ord)
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+        WHERE c.relnamespace = 'public'::regnamespace
+        ORDER BY c.relname, i.indisprimary DESC, k.ord
+    """)
+    for table, column, is_primary in cur.fetchall():
+        entry = tables.get(table.lower())
+        if entry is None:
+            continue
+        entry["indexed"].add(column)
+        if is_primary and column not in entry["primary_key"]:
+            entry["primary_key"].append(column)
+    return tables
+
+def catalog(cur):
+    """The cached catalog, reloaded every CATALOG_TTL seconds."""
+    global _catalog, _loaded_at
+    with _lock:
+        if _catalog is not None and time.monotonic() - _loaded_at < CATALOG_TTL:
+            return _catalog
+    tables = load_catalog(cur)
+    with _lock:
+        _catalog, _loaded_at = tables, time.monotonic()
+    return tables
+
+def invalidate():
+    global _catalog
+    with _lock:
+        _catalog = None
+
+def lookup(cur, table_name):
+    """Catalog entry for a table name (any case, so 'user' finds "User"), or None."""
+    return catalog(cur).get(table_name.lower())
+
+def estimate_rows(cur, table):
+    """Planner's row estimate from pg_class.reltuples (None if never analyzed)."""
+    cur.execute("""
+        SELECT reltuples::bigint FROM pg_class
+        WHERE relname = %s AND relnamespace = 'public'::regnamespace
+    """, (table["name"],))
+    row = cur.fetchone()
+    return int(row[0]) if row and row[0] >= 0 else None
+
+def convert_value(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+def convert_row(row):
+    return {k: convert_value(v) for k, v in row.items()}
+
+def build_query(table, columns=None, filters=(), sort=None, descending=False, after=None, limit=None):
+    """
+    (query, params, key) for one page. filters are (column, op, value) triples;
+    after is the `next_after` token of the previous page. key is the keyset
+    columns, or {"offset": n} for a table without a primary key. Raises
+    ValueError for columns, operators or tokens the explorer does not accept.
+    """
+    cols = table["columns"]
+    keyed = bool(table["primary_key"])
+    sort = sort or (table["primary_key"][0] if keyed else None)
+    if sort is not None and sort not in table["indexed"]:
+        raise ValueError(f"Can only sort by indexed columns: {', '.join(sorted(table['indexed']))}")
+    key = [sort] + [c for c in table["primary_key"] if c != sort] if keyed else []
+
+    selected = list(columns) if columns else list(cols)
+    unknown = [c for c in selected if c not in cols]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    selected += [k for k in key if k not in selected]   # needed for the next page's token
+
+    def typed(column):
+        return sql.SQL("%s::{}").format(sql.Identifier(*cols[column]["udt"]))
+
+    where, params = [], []
+    for column, op, value in filters:
+        if column not in table["indexed"]:
+            raise ValueError(f"Can only filter on indexed columns: {', '.join(sorted(table['indexed']))}")
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unknown filter operator '{op}' (use {', '.join(FILTER_OPS)})")
+        if op in ("null", "notnull"):
+            where.append(sql.SQL("{} " + FILTER_OPS[op]).format(sql.Identifier(column)))
+        else:
+            where.append(sql.SQL("{} " + FILTER_OPS[op] + " {}").format(sql.Identifier(column), typed(column)))
+            params.append(value)
+
+    offset = 0
+    if after is not None and not keyed:
+        try:
+            offset = json.loads(after)["offset"]
+        except (ValueError, TypeError, KeyError):
+            offset = None
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Invalid 'after' token for this table")
+        if offset > MAX_OFFSET:
+            raise ValueError(f"{table['name']} has no primary key; only the first {MAX_OFFSET} rows can be paged")
+    elif after is not None:
+        try:
+            values = json.loads(after)
+        except ValueError:
+            values = None
+        if not isinstance(values, list) or len(values) != len(key):
+            raise ValueError("Invalid 'after' token for this sort")
+        cmp = sql.SQL("<" if descending else ">")
+
+        def row_compare(names, vals):
+            params.extend(vals)
+            return sql.SQL("({}) {} ({})").format(
+                sql.SQL(", ").join(map(sql.Identifier, names)), cmp,
+                sql.SQL(", ").join(typed(c) for c in names))
+
+        # NULL sort values come last, walked in primary key order
+        if values[0] is None:
+            where.append(sql.SQL("{} IS NULL AND {}").format(
+                sql.Identifier(sort), row_compare(key[1:], values[1:])))
+        elif cols[sort]["nullable"]:
+            where.append(sql.SQL("({} OR {} IS NULL)").format(
+                row_compare(key, values), sql.Identifier(sort)))
+        else:
+            where.append(row_compare(key, values))
+
+    direction = sql.SQL(" DESC NULLS LAST" if descending else " ASC NULLS LAST")
+    order = [sql.Identifier(k) + direction for k in key]
+    if not keyed:
+        order = ([sql.Identifier(sort) + direction] if sort else []) + [sql.SQL("ctid")]
+    query = sql.SQL("SELECT {} FROM {}{} ORDER BY {}").format(
+        sql.SQL(", ").join(map(sql.Identifier, selected)),
+        sql.Identifier(table["name"]),
+        sql.SQL(" WHERE ") + sql.SQL(" AND ").join(where) if where else sql.SQL(""),
+        sql.SQL(", ").join(order))
+    if limit is not None:
+        query += sql.SQL(" LIMIT %s")
+        params.append(limit + 1)
+        if not keyed:
+            query += sql.SQL(" OFFSET %s")
+            params.append(offset)
+    return query, params, key if keyed else {"offset": offset}
+
+def fetch_page(conn, query, params, limit, key):
+    """
+    Rows of a build_query(limit=...) query through a named cursor, converted for
+    JSON, and the token for the next page (None on the last page).
+    """
+    cur = conn.cursor(name='explorer_page', cursor_factory=extras.RealDictCursor)
+    try:
+        cur.execute(query, params)
+        rows = cur.fetchmany(limit + 1)
+    finally:
+        cur.close()
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if isinstance(key, dict):
+            next_after = json.dumps({"offset": key["offset"] + limit})
+        else:
+            next_after = json.dumps([rows[-1][k] for k in key], default=str)
+    return [convert_row(r) for r in rows], next_after
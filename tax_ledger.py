@@ -0,0 +1,137 @@
+import argparse
+from psycopg2 import extras
+from db import get_connection
+
+# Simple Tax Calc (Example logic: 15% STCG, 10% LTCG)
+STCG_RATE = 0.15
+LTCG_RATE = 0.10
+
+# Indian financial year (April - March), identified by its starting calendar year
+FY_EXPR = "EXTRACT(YEAR FROM {col} - INTERVAL '3 months')::int"
+
+def estimate_tax(stcg, ltcg):
+    # Assuming only positive gains are taxed, but losses offset gains.
+    # This is a basic estimation.
+    tax = (stcg * STCG_RATE) if stcg > 0 else 0
+    tax += (ltcg * LTCG_RATE) if ltcg > 0 else 0
+    return tax
+
+def record_sale(cur, user_id, short_term_gain, long_term_gain, realized_loss, lot_count):
+    """
+    Fold one sell's realized gains into the user's TaxSummary row for the current
+    financial year. Must run in the same transaction as the RealizedGain inserts.
+    """
+    cur.execute(f"""
+        INSERT INTO TaxSummary (user_id, fy, short_term_gain, long_term_gain, realized_loss, lot_count)
+        VALUES (%s, {FY_EXPR.format(col='CURRENT_DATE')}, %s, %s, %s, %s)
+        ON CONFLICT (user_id, fy) DO UPDATE SET
+            short_term_gain = TaxSummary.short_term_gain + EXCLUDED.short_term_gain,
+            long_term_gain = TaxSummary.long_term_gain + EXCLUDED.long_term_gain,
+            realized_loss = TaxSummary.realized_loss + EXCLUDED.realized_loss,
+            lot_count = TaxSummary.lot_count + EXCLUDED.lot_count
+    """, (user_id, short_term_gain, long_term_gain, realized_loss, lot_count))
+
+def get_summary(cur, user_id):
+    """Tax summary for a user from the materialized per-year rows (no RealizedGain scan)."""
+    cur.execute("""
+        SELECT fy, short_term_gain, long_term_gain, realized_loss, lot_count
+        FROM TaxSummary WHERE user_id = %s ORDER BY fy DESC
+    """, (user_id,))
+    by_year = []
+    stcg = ltcg = 0.0
+    for fy, st, lt, loss, lots in cur.fetchall():
+        st, lt, loss = float(st), float(lt), float(loss)
+        stcg += st
+        ltcg += lt
+        by_year.append({
+            "financial_year": f"{fy}-{str(fy + 1)[-2:]}",
+            "short_term_gain": st,
+            "long_term_gain": lt,
+            "realized_loss": loss,
+            "lot_count": lots,
+            "tax_liability": estimate_tax(st, lt)
+        })
+    return {
+        "short_term_gain": stcg,
+        "long_term_gain": ltcg,
+        "tax_liability": estimate_tax(stcg, ltcg),
+        "by_year": by_year
+    }
+
+AGGREGATE_QUERY = f"""
+    SELECT user_id, {FY_EXPR.format(col='sell_date')} AS fy,
+           COALESCE(SUM(total_gain) FILTER (WHERE term = 'SHORT'), 0) AS short_term_gain,
+           COALESCE(SUM(total_gain) FILTER (WHERE term <> 'SHORT'), 0) AS long_term_gain,
+           COALESCE(SUM(total_gain) FILTER (WHERE total_gain < 0), 0) AS realized_loss,
+           COUNT(*) AS lot_count
+    FROM RealizedGain
+    {{where}}
+    GROUP BY user_id, fy
+"""
+
+def rebuild(cur, user_id=None):
+    """Recompute TaxSummary from RealizedGain in bulk (all users or one)."""
+    where = "WHERE user_id = %s" if user_id is not None else ""
+    params = (user_id,) if user_id is not None else ()
+    cur.execute(f"DELETE FROM TaxSummary {where}", params)
+    cur.execute(f"""
+        INSERT INTO TaxSummary (user_id, fy, short_term_gain, long_term_gain, realized_loss, lot_count)
+        {AGGREGATE_QUERY.format(where=where)}
+    """, params)
+    return cur.rowcount
+
+def verify(cur):
+    """Return the (user_id, fy) rows where TaxSummary disagrees with RealizedGain."""
+    cur.execute(f"""
+        WITH expected AS ({AGGREGATE_QUERY.format(where='')})
+        SELECT COALESCE(e.user_id, t.user_id) AS user_id, COALESCE(e.fy, t.fy) AS fy,
+               e.short_term_gain AS expected_stcg, t.short_term_gain AS stored_stcg,
+               e.long_term_gain AS expected_ltcg, t.long_term_gain AS stored_ltcg,
+               e.lot_count AS expected_lots, t.lot_count AS stored_lots
+        FROM expected e
+        FULL OUTER JOIN TaxSummary t ON t.user_id = e.user_id AND t.fy = e.fy
+        WHERE e.short_term_gain IS DISTINCT FROM t.short_term_gain
+           OR e.long_term_gain IS DISTINCT FROM t.long_term_gain
+           OR e.realized_loss IS DISTINCT FROM t.realized_loss
+           OR e.lot_count IS DISTINCT FROM t.lot_count
+    """)
+    return [dict(row) for row in cur.fetchall()]
+
+def ensure_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS TaxSummary (
+            user_id INTEGER REFERENCES "User"(user_id),
+            fy INTEGER NOT NULL,
+            short_term_gain DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            long_term_gain DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            realized_loss DECIMAL(15, 2) NOT NULL DEFAULT 0,
+            lot_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, fy)
+        )
+    """)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the per-user, per-financial-year TaxSummary table.")
+    parser.add_argument("command", choices=["rebuild", "verify"])
+    parser.add_argument("--user", type=int, help="Only rebuild this user")
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor(cursor_factory=extras.DictCursor)
+    try:
+        if args.command == "rebuild":
+            ensure_schema(cur)
+            count = rebuild(cur, args.user)
+            conn.commit()
+            print(f"Rebuilt {count} tax summary rows.")
+        else:
+            mismatches = verify(cur)
+            for m in mismatches:
+                print(f"Mismatch: {m}")
+            print(f"{len(mismatches)} mismatched rows.")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error: {e}")
+    finally:
+        cur.close()
+        conn.close()
@@ -0,0 +1,338 @@
+import argparse
+import csv
+import io
+import json
+from collections import deque
+from functools import lru_cache
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from psycopg2 import extras
+import db
+from tax_ledger import estimate_tax
+
+# --- BULK TRADE IMPORT ---
+# Historical trades (e.g. another broker's contract notes exported to CSV) are
+# replayed in memory in date order: buys open lots, sells consume them FIFO
+# with the same 365-day term rule as apply_sell_fifo. The result is written in
+# one transaction with COPY, or returned as a dry-run diff without writing.
+LONG_TERM_DAYS = 365
+CENT = Decimal('0.01')
+MAX_ERRORS = 100    # errors reported per import
+
+# Accepted header names for each field (case-insensitive)
+COLUMNS = {
+    "date": ("date", "trade_date", "txn_date"),
+    "symbol": ("symbol", "ticker", "scrip"),
+    "type": ("type", "side", "txn_type", "action"),
+    "quantity": ("quantity", "qty"),
+    "price": ("price", "rate", "trade_price"),
+}
+SIDES = {"BUY": "BUY", "B": "BUY", "SELL": "SELL", "S": "SELL"}
+DATE_FORMATS = ("%d-%m-%Y", "%d/%m/%Y", "%d-%b-%Y")   # besides ISO dates/timestamps
+
+@lru_cache(maxsize=4096)   # contract notes repeat the same few dates
+def parse_date(text):
+    """Naive datetime; timestamps with an offset are converted to server local time like txn_date."""
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        value = None
+    if value is not None:
+        return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognized date '{text}'")
+
+def parse_trades(text):
+    """
+    Trades from CSV text, sorted chronologically (file order within the same
+    timestamp), and a list of (line, message) for rows that could not be read.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    header = {h.strip().lower(): h for h in reader.fieldnames or []}
+    fields = {}
+    for field, aliases in COLUMNS.items():
+        match = next((header[a] for a in aliases if a in header), None)
+        if match is None:
+            raise ValueError(f"CSV needs a {field} column ({' / '.join(aliases)})")
+        fields[field] = match
+
+    trades, errors = [], []
+    for line, row in enumerate(reader, start=2):
+        try:
+            side = SIDES.get((row[fields["type"]] or "").strip().upper())
+            if side is None:
+                raise ValueError("Type must be BUY or SELL")
+            quantity = int((row[fields["quantity"]] or "").strip())
+            price = Decimal((row[fields["price"]] or "").strip().replace(",", "")).quantize(CENT)
+            if quantity <= 0 or price <= 0:
+                raise ValueError("Quantity and price must be positive")
+            trades.append({
+                "line": line,
+                "when": parse_date((row[fields["date"]] or "").strip()),
+                "symbol": (row[fields["symbol"]] or "").strip().upper(),
+                "side": side,
+                "quantity": quantity,
+                "price": price
+            })
+        except (ValueError, InvalidOperation) as e:
+            errors.append((line, str(e) or "Invalid number"))
+    trades.sort(key=lambda t: t["when"])
+    return trades, errors
+
+def financial_year(day):
+    return day.year if day.month >= 4 else day.year - 1
+
+def plan_import(cur, user_id, trades, adjust_cash=False):
+    """
+    Replay trades against the account's current holdings and open lots in memory.
+    Locks the User row, then the touched holdings and lots (same order as single
+    orders). Returns (diff, state) where state holds the rows write_import needs.
+    Trades dated at or before the account's latest trade in the same stock are
+    rejected, so existing FIFO history is never rewritten.
+    """
+    cur.execute('SELECT cash_balance FROM "User" WHERE user_id = %s FOR UPDATE', (user_id,))
+    row = cur.fetchone()
+    if row is None:
+        raise Exception("User not found")
+    cash_before = cash = row[0]
+
+    cur.execute("SELECT symbol, stock_id FROM Stock WHERE symbol = ANY(%s)",
+                (sorted({t["symbol"] for t in trades}),))
+    stock_of = dict(cur.fetchall())
+    symbol_of = {sid: symbol for symbol, sid in stock_of.items()}
+    stock_ids = sorted(stock_of.values())
+
+    cur.execute("""
+        SELECT stock_id, total_quantity, avg_buy_price FROM Portfolio
+        WHERE user_id = %s AND stock_id = ANY(%s)
+        ORDER BY stock_id FOR UPDATE
+    """, (user_id, stock_ids))
+    holdings = {sid: [qty, avg or Decimal(0)] for sid, qty, avg in cur.fetchall()}
+    before = {sid: list(h) for sid, h in holdings.items()}
+
+    # Lots are [lot_id (None until written), stock_id, buy_date, buy_price, initial, remaining]
+    cur.execute("""
+        SELECT lot_id, stock_id, buy_date, buy_price, initial_quantity, remaining_quantity FROM BuyLot
+        WHERE user_id = %s AND stock_id = ANY(%s) AND remaining_quantity > 0
+        ORDER BY stock_id, buy_date, lot_id FOR UPDATE
+    """, (user_id, stock_ids))
+    open_lots = {}
+    lot_total = {}    # shares left in open lots per stock (can disagree with Portfolio)
+    existing = []
+    for lot in cur.fetchall():
+        lot = list(lot) + [lot[5]]    # remember the stored remaining quantity
+        open_lots.setdefault(lot[1], deque()).append(lot)
+        lot_total[lot[1]] = lot_total.get(lot[1], 0) + lot[5]
+        existing.append(lot)
+
+    cur.execute("""
+        SELECT stock_id, MAX(txn_date) FROM Transaction
+        WHERE user_id = %s AND stock_id = ANY(%s)
+        GROUP BY stock_id
+    """, (user_id, stock_ids))
+    last_trade = dict(cur.fetchall())
+
+    txns, new_lots, gains, errors = [], [], [], []
+    for t in trades:
+        sid = stock_of.get(t["symbol"])
+        if sid is None:
+            errors.append((t["line"], f"Unknown symbol {t['symbol']}"))
+            continue
+        if sid in last_trade and t["when"] <= last_trade[sid]:
+            errors.append((t["line"], f"{t['symbol']} trade is not after this account's last {t['symbol']} trade ({last_trade[sid]:%Y-%m-%d %H:%M})"))
+            continue
+
+        day, qty, price = t["when"].date(), t["quantity"], t["price"]
+        amount = qty * price
+        held = holdings.setdefault(sid, [0, Decimal(0)])
+        if t["side"] == 'BUY':
+            if adjust_cash and cash < amount:
+                errors.append((t["line"], f"Insufficient funds. Required: ₹{amount}, Available: ₹{cash}"))
+                continue
+            lot = [None, sid, day, price, qty, qty]
+            new_lots.append(lot)
+            open_lots.setdefault(sid, deque()).append(lot)
+            lot_total[sid] = lot_total.get(sid, 0) + qty
+            held[1] = ((held[0] * held[1] + amount) / (held[0] + qty)).quantize(CENT)
+            held[0] += qty
+            if adjust_cash:
+                cash -= amount
+        else:
+            if held[0] < qty:
+                errors.append((t["line"], f"Selling {qty} {t['symbol']} but only {held[0]} held"))
+                continue
+            if lot_total.get(sid, 0) < qty:
+                # Same check as apply_sell_fifo: holdings and open lots out of step
+                errors.append((t["line"], f"Insufficient open lots. Selling {qty} {t['symbol']} but only "
+                                          f"{lot_total.get(sid, 0)} left in open lots"))
+                continue
+            lot_total[sid] -= qty
+            left, lots = qty, open_lots[sid]
+            while left:
+                lot = lots[0]
+                used = min(lot[5], left)
+                term = 'LONG' if (day - lot[2]).days > LONG_TERM_DAYS else 'SHORT'
+                gains.append((sid, lot, used, lot[2], day, lot[3], price, (price - lot[3]) * used, term))
+                lot[5] -= used
+                left -= used
+                if lot[5] == 0:
+                    lots.popleft()
+            held[0] -= qty
+            if adjust_cash:
+                cash += amount
+        txns.append((sid, t["side"], qty, price, t["when"]))
+
+    # Realized gains per financial year, as they will land in TaxSummary
+    by_year = {}
+    for sid, lot, used, buy_day, sell_day, buy_price, sell_price, gain, term in gains:
+        year = by_year.setdefault(financial_year(sell_day), [Decimal(0), Decimal(0), Decimal(0), 0])
+        year[0 if term == 'SHORT' else 1] += gain
+        if gain < 0:
+            year[2] += gain
+        year[3] += 1
+
+    touched = sorted({sid for sid, *_ in txns})
+    diff = {
+        "user_id": user_id,
+        "trades": len(txns),
+        "buys": sum(1 for t in txns if t[1] == 'BUY'),
+        "sells": sum(1 for t in txns if t[1] == 'SELL'),
+        "lots_created": len(new_lots),
+        "existing_lots_consumed": sum(1 for lot in existing if lot[5] != lot[6]),
+        "realized": [{
+            "financial_year": f"{fy}-{str(fy + 1)[-2:]}",
+            "short_term_gain": float(st),
+            "long_term_gain": float(lt),
+            "realized_loss": float(loss),
+            "lot_count": lots,
+            "tax_liability": estimate_tax(float(st), float(lt))
+        } for fy, (st, lt, loss, lots) in sorted(by_year.items())],
+        "holdings": [{
+            "stock_id": sid,
+            "symbol": symbol_of[sid],
+            "quantity_before": before.get(sid, [0])[0],
+            "quantity_after": holdings[sid][0],
+            "avg_price_before": float(before[sid][1]) if sid in before else None,
+            "avg_price_after": float(holdings[sid][1])
+        } for sid in touched],
+        "cash_before": float(cash_before),
+        "cash_after": float(cash),
+        "errors": [{"line": line, "message": message} for line, message in errors]
+    }
+    state = {"txns": txns, "new_lots": new_lots, "gains": gains, "existing": existing,
+             "holdings": {sid: holdings[sid] for sid in touched}, "by_year": by_year,
+             "cash": cash if adjust_cash else None}
+    return diff, state
+
+def ensure_schema(cur):
+    """Transaction.cash_settled on databases created before imports recorded it."""
+    cur.execute("ALTER TABLE Transaction ADD COLUMN IF NOT EXISTS cash_settled BOOLEAN NOT NULL DEFAULT TRUE")
+
+def _copy(cur, table, columns, rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+def write_import(cur, user_id, state):
+    """Write a planned import: COPY the new rows, then update lots, holdings, tax summary and cash."""
+    # Without adjust_cash the trades were paid for at the other broker; NAV treats them as transfers
+    settled = state["cash"] is not None
+    _copy(cur, "Transaction", ("user_id", "stock_id", "txn_type", "quantity", "price", "txn_date", "cash_settled"),
+          ((user_id, sid, side, qty, price, when, settled) for sid, side, qty, price, when in state["txns"]))
+
+    # Reserve lot ids up front so RealizedGain rows can reference them; ascending
+    # in trade order, which keeps same-day lots FIFO by lot_id afterwards
+    new_lots = state["new_lots"]
+    if new_lots:
+        cur.execute("SELECT nextval(pg_get_serial_sequence('buylot', 'lot_id')) FROM generate_series(1, %s)",
+                    (len(new_lots),))
+        for lot, lot_id in zip(new_lots, sorted(r[0] for r in cur.fetchall())):
+            lot[0] = lot_id
+        _copy(cur, "BuyLot", ("lot_id", "user_id", "stock_id", "buy_date", "buy_price", "initial_quantity", "remaining_quantity"),
+              ((lot[0], user_id, lot[1], lot[2], lot[3], lot[4], lot[5]) for lot in new_lots))
+
+    _copy(cur, "RealizedGain", ("user_id", "stock_id", "buy_lot_id", "quantity", "buy_date", "sell_date",
+                                "buy_price", "sell_price", "total_gain", "term"),
+          ((user_id, sid, lot[0], used, buy_day, sell_day, buy_price, sell_price, gain, term)
+           for sid, lot, used, buy_day, sell_day, buy_price, sell_price, gain, term in state["gains"]))
+
+    changed = [(lot[0], lot[5]) for lot in state["existing"] if lot[5] != lot[6]]
+    if changed:
+        extras.execute_values(cur, """
+            UPDATE BuyLot b SET remaining_quantity = v.remaining
+            FROM (VALUES %s) AS v(lot_id, remaining)
+            WHERE b.lot_id = v.lot_id
+        """, changed)
+
+    if state["holdings"]:
+        extras.execute_values(cur, '''
+            INSERT INTO Portfolio (user_id, stock_id, total_quantity, avg_buy_price)
+            VALUES %s
+            ON CONFLICT (user_id, stock_id) DO UPDATE SET
+                total_quantity = EXCLUDED.total_quantity,
+                avg_buy_price = EXCLUDED.avg_buy_price
+        ''', [(user_id, sid, qty, avg) for sid, (qty, avg) in state["holdings"].items()])
+
+    if state["by_year"]:
+        extras.execute_values(cur, """
+            INSERT INTO TaxSummary (user_id, fy, short_term_gain, long_term_gain, realized_loss, lot_count)
+            VALUES %s
+            ON CONFLICT (user_id, fy) DO UPDATE SET
+                short_term_gain = TaxSummary.short_term_gain + EXCLUDED.short_term_gain,
+                long_term_gain = TaxSummary.long_term_gain + EXCLUDED.long_term_gain,
+                realized_loss = TaxSummary.realized_loss + EXCLUDED.realized_loss,
+                lot_count = TaxSummary.lot_count + EXCLUDED.lot_count
+        """, [(user_id, fy, st, lt, loss, lots) for fy, (st, lt, loss, lots) in state["by_year"].items()])
+
+    if state["cash"] is not None:
+        cur.execute('UPDATE "User" SET cash_balance = %s WHERE user_id = %s', (state["cash"], user_id))
+
+def import_trades(user_id, text, dry_run=False, adjust_cash=False):
+    """
+    Parse, replay and (unless dry_run or any row is invalid) write a CSV of
+    trades for one user in a single transaction. With adjust_cash the trades'
+    cash flows are applied to the balance too (buys must then be affordable);
+    otherwise they are treated as settled at the other broker.
+    Returns the diff with status "dry_run", "rejected" or "imported".
+    """
+    trades, parse_errors = parse_trades(text)
+
+    def work(cur):
+        diff, state = plan_import(cur, user_id, trades, adjust_cash)
+        errors = sorted([{"line": line, "message": message} for line, message in parse_errors] + diff["errors"],
+                        key=lambda e: e["line"])
+        diff["errors"] = errors[:MAX_ERRORS]
+        diff["error_count"] = len(errors)
+        if errors:
+            diff["status"] = "rejected"
+        elif dry_run:
+            diff["status"] = "dry_run"
+        else:
+            write_import(cur, user_id, state)
+            diff["status"] = "imported"
+        return diff
+
+    return db.run_transaction(work)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a CSV of historical trades (date, symbol, type, quantity, price) for one user.")
+    parser.add_argument("path")
+    parser.add_argument("--user", type=int, required=True)
+    parser.add_argument("--dry-run", action="store_true", help="Show what would change without writing")
+    parser.add_argument("--adjust-cash", action="store_true", help="Apply the trades' cash flows to the balance")
+    args = parser.parse_args()
+
+    with open(args.path, newline="", encoding="utf-8-sig") as f:
+        text = f.read()
+    try:
+        db.run_transaction(ensure_schema)
+        result = import_trades(args.user, text, args.dry_run, args.adjust_cash)
+        print(json.dumps(result, indent=2))
+    except Exception as e:
+        print(f"Error: {e}")
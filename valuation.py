@@ -0,0 +1,92 @@
+# One statement: user row plus every open holding with its value, cost basis and
+# the portfolio / sector totals computed by window aggregates.
+VALUATION_QUERY = """
+    SELECT u.user_id, u.name, u.email, u.cash_balance,
+           h.stock_id, h.symbol, h.stock_name, h.sector, h.total_quantity, h.avg_buy_price, h.current_price,
+           h.market_value, h.cost_basis,
+           SUM(h.market_value) OVER () AS total_value,
+           SUM(h.cost_basis) OVER () AS total_cost,
+           SUM(h.market_value) OVER (PARTITION BY h.sector) AS sector_value
+    FROM "User" u
+    LEFT JOIN LATERAL (
+        SELECT s.stock_id, s.symbol, s.name AS stock_name, COALESCE(s.sector, 'Unclassified') AS sector,
+               p.total_quantity, p.avg_buy_price, s.current_price,
+               p.total_quantity * s.current_price AS market_value,
+               p.total_quantity * p.avg_buy_price AS cost_basis
+        FROM Portfolio p
+        JOIN Stock s ON p.stock_id = s.stock_id
+        WHERE p.user_id = u.user_id AND p.total_quantity > 0
+    ) h ON TRUE
+    WHERE u.user_id = %s
+    ORDER BY h.market_value DESC NULLS LAST, h.symbol
+"""
+
+def value_portfolio(cur, user_id):
+    """
+    Value a user's portfolio in one query: holdings with market value, unrealized
+    P&L and weight, portfolio totals, and sector allocation. Returns None if the
+    user does not exist.
+    """
+    cur.execute(VALUATION_QUERY, (user_id,))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+
+    first = rows[0]
+    cash_balance = float(first['cash_balance'])
+    total_value = float(first['total_value'] or 0)
+    total_cost = float(first['total_cost'] or 0)
+
+    holdings = []
+    sectors = {}
+    for row in rows:
+        if row['stock_id'] is None:
+            continue  # user with no open holdings
+        market_value = float(row['market_value'])
+        cost_basis = float(row['cost_basis'])
+        pnl = market_value - cost_basis
+        holdings.append({
+            "stock_id": row['stock_id'],
+            "symbol": row['symbol'],
+            "name": row['stock_name'],
+            "sector": row['sector'],
+            "total_quantity": row['total_quantity'],
+            "avg_buy_price": float(row['avg_buy_price']),
+            "current_price": float(row['current_price']),
+            "market_value": round(market_value, 2),
+            "cost_basis": round(cost_basis, 2),
+            "unrealized_pnl": round(pnl, 2),
+            "unrealized_pnl_pct": round((pnl / cost_basis) * 100, 2) if cost_basis else 0.0,
+            "weight": round((market_value / total_value) * 100, 2) if total_value else 0.0
+        })
+        sector = sectors.get(row['sector'])
+        if sector is None:
+            sector_value = float(row['sector_value'])
+            sector = sectors[row['sector']] = {
+                "sector": row['sector'],
+                "value": round(sector_value, 2),
+                "weight": round((sector_value / total_value) * 100, 2) if total_value else 0.0,
+                "symbols": []
+            }
+        sector["symbols"].append(row['symbol'])
+
+    pnl = total_value - total_cost
+    return {
+        "user": {
+            "user_id": first['user_id'],
+            "name": first['name'],
+            "email": first['email'],
+            "cash_balance": cash_balance
+        },
+        "holdings": holdings,
+        "summary": {
+            "total_value": round(total_value, 2),
+            "total_cost": round(total_cost, 2),
+            "unrealized_pnl": round(pnl, 2),
+            "unrealized_pnl_pct": round((pnl / total_cost) * 100, 2) if total_cost else 0.0,
+            "cash_balance": cash_balance,
+            "net_worth": round(total_value + cash_balance, 2),
+            "positions": len(holdings)
+        },
+        "sectors": sorted(sectors.values(), key=lambda s: s["value"], reverse=True)
+    }